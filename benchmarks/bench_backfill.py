@@ -0,0 +1,39 @@
+# Benchmark of the concurrent historic backfill against the local mock weather API
+import os
+import tempfile
+import time
+import click
+from src.mock_weatherapi import start_mock_server
+from src.weather_client import WeatherClient
+from src.weather_db import connect
+from src.weather_fetcher import backfill_historic_weather
+from src.weather_writer import WeatherWriter
+
+
+@click.command()
+@click.option('--days', default=60, show_default=True, help='Number of days to backfill.')
+@click.option('--latency', default=0.05, show_default=True, help='Seconds the mock API waits per request.')
+@click.option('--concurrency', '-n', multiple=True, type=int, default=(1, 4, 16), show_default=True,
+              help='Worker pool sizes to compare, can be repeated.')
+def main(days, latency, concurrency):
+    """
+    Backfills the same day range with every worker pool size and prints the wall clock time.
+    """
+    server, base_url = start_mock_server(latency)
+    for workers in concurrency:
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'weather_data.db')
+            conn = connect(database)
+            writer = WeatherWriter(database).start()
+            started = time.perf_counter()
+            backfill_historic_weather('Frankfurt', 'key', days, conn.cursor(), writer,
+                                      WeatherClient(base_url, pool_size=workers), concurrency=workers)
+            writer.close()
+            elapsed = time.perf_counter() - started
+            print(f"concurrency={workers:<4} days={days} elapsed={elapsed:.2f}s")
+            conn.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
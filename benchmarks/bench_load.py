@@ -0,0 +1,145 @@
+# Load test of the latest weather polling and of the historic backfill against the mock weather API
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import tempfile
+import time
+import click
+from src import metrics
+from src.mock_weatherapi import parse_errors, start_mock_server
+from src.scheduler import Scheduler
+from src.weather_client import BULK_LIMIT, WeatherClient
+from src.weather_db import connect
+from src.weather_fetcher import backfill_cities, run_latest_weather
+from src.weather_writer import WeatherWriter
+
+
+def lag_summary(histogram):
+    """
+    Returns the number of scheduler runs, the mean lag and the bucket bounds of the 50th, 95th and 99th
+    percentile of the lag in seconds.
+    """
+    counts = histogram.values.get((), [0] * len(histogram.buckets) + [0.0, 0])
+    runs = counts[-1]
+    summary = {'runs': runs, 'mean_s': round(counts[-2] / runs, 4) if runs else 0.0}
+    for name, quantile in (('p50_s', 0.5), ('p95_s', 0.95), ('p99_s', 0.99)):
+        # Buckets are cumulative, the first bound reaching the quantile is an upper bound of it
+        summary[name] = next((bound for bound, count in zip(histogram.buckets, counts) if count >= quantile * runs),
+                             float('inf')) if runs else None
+    return summary
+
+
+def load_latest(cities, api_key, base_url, database, duration, interval, concurrency, batch_size, queue_size):
+    """
+    Polls the current weather of every city every interval seconds for duration seconds with the scheduler of
+    get-latest-weather, readings are written by the writer thread like in the command.
+    """
+    client = WeatherClient(base_url, pool_size=concurrency)
+    writer = WeatherWriter(database, max_queue=queue_size).start()
+    # Jobs are spread over the interval like the jitter of the command spreads them over a minute
+    scheduler = Scheduler(jitter=interval)
+
+    async def run():
+        asyncio.get_running_loop().call_later(duration, scheduler.stop)
+        return await run_latest_weather(cities, api_key, interval / 60, writer, client, scheduler, concurrency,
+                                        batch_size=batch_size)
+
+    try:
+        totals = asyncio.run(run())
+    finally:
+        writer.close()
+        client.close()
+    return totals, client, writer
+
+
+def load_historic(cities, api_key, base_url, database, days, concurrency, queue_size):
+    """
+    Backfills the given days of every city like get-historic-weather.
+    """
+    client = WeatherClient(base_url, pool_size=concurrency)
+    conn = connect(database)
+    writer = WeatherWriter(database, max_queue=queue_size).start()
+    try:
+        results = backfill_cities(cities, api_key, days, conn.cursor(), writer, client, concurrency,
+                                  skip_stored=False)
+    finally:
+        writer.close()
+        client.close()
+        conn.close()
+    totals = {'retrieved': sum(result['retrieved'] for result in results.values())}
+    return totals, client, writer
+
+
+@click.command()
+@click.option('--mode', type=click.Choice(['latest', 'historic']), default='latest', show_default=True,
+              help='Poll the current weather or backfill the history.')
+@click.option('--cities', default=2000, show_default=True, help='Number of cities.')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds of polling with --mode latest.')
+@click.option('--interval', default=10.0, show_default=True,
+              help='Seconds between two polls of a city with --mode latest, also the update interval of the mock.')
+@click.option('--days', default=7, show_default=True, help='Days backfilled per city with --mode historic.')
+@click.option('--concurrency', default=32, show_default=True, help='Maximum number of API calls in flight.')
+@click.option('--batch-size', type=click.IntRange(1, BULK_LIMIT), default=1, show_default=True,
+              help='Cities per bulk request with --mode latest.')
+@click.option('--queue-size', default=10000, show_default=True,
+              help='Maximum number of records waiting for the writer.')
+@click.option('--latency', default=0.02, show_default=True, help='Seconds the mock API waits per request.')
+@click.option('--latency-jitter', default=0.0, show_default=True, help='Random seconds added to the mock latency.')
+@click.option('--error', 'errors', multiple=True, metavar='STATUS=FRACTION',
+              help='Fraction of the mock responses failing with a status code, e.g. 500=0.01. Repeatable.')
+@click.option('--rate', type=int, default=None, help='Requests per second answered by the mock, the others get 429.')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Serve the responses of a file written with --record, synthetic data for the others.')
+@click.option('--base-url', default=None, help='Load an already running API instead of starting the mock.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Also write the results as JSON.')
+def main(mode, cities, duration, interval, days, concurrency, batch_size, queue_size, latency, latency_jitter, errors,
+         rate, replay, base_url, output):
+    """
+    Drives get-latest-weather or get-historic-weather at thousands of cities against the mock weather API and
+    prints the request and ingest throughput, the scheduler lag and the peak memory of the process.
+    """
+    server = None
+    if base_url is None:
+        server, base_url = start_mock_server(latency, update_interval=interval, recording=replay,
+                                             errors=parse_errors(errors), rate=rate, latency_jitter=latency_jitter)
+    names = [f'City{city:05d}' for city in range(cities)]
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'weather_data.db')
+        # The commands print every failed city, which would dominate the run at a high error rate
+        with contextlib.redirect_stdout(io.StringIO()):
+            connect(database).close()
+            started = time.perf_counter()
+            if mode == 'latest':
+                totals, client, writer = load_latest(names, 'key', base_url, database, duration, interval,
+                                                     concurrency, batch_size, queue_size)
+            else:
+                totals, client, writer = load_historic(names, 'key', base_url, database, days, concurrency,
+                                                       queue_size)
+        elapsed = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+    written = writer.metrics()
+    results = {'mode': mode, 'cities': cities, 'concurrency': concurrency, 'elapsed_s': round(elapsed, 3),
+               'requests': client.stats['calls'], 'requests_per_s': round(client.stats['calls'] / elapsed, 1),
+               'retries': client.stats['retries'], 'errors': client.stats['errors'],
+               'mean_latency_ms': round(client.stats['latency'] / max(1, client.stats['calls']) * 1000, 2),
+               'rows_written': written['inserted'] + written['updated'],
+               'rows_per_s': round((written['inserted'] + written['updated']) / elapsed, 1),
+               'batches': written['batches'], 'max_queue_depth': written['max_queue_depth'],
+               'average_commit_ms': round(written['average_commit_latency'] * 1000, 2),
+               'scheduler_lag': lag_summary(metrics.SCHEDULER_LAG),
+               # ru_maxrss is in kilobytes on Linux
+               'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    results.update(totals)
+    for name, value in results.items():
+        print(f"{name:<18} {value}")
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+# Benchmark suite of the insert, query and fetch paths, results are written as JSON to compare commits
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import click
+from click.testing import CliRunner
+from src.mock_weatherapi import start_mock_server
+from src.weather_client import WeatherClient
+from src.weather_db import connect, weather_info_bulk_insert
+from src.weather_fetcher import weather_info_insert, backfill_cities
+from src.weather_writer import WeatherWriter
+from src.weather_cli import latest, compare, average
+from src.weather_queries import DirectQueries
+from src.query_client import QueryClient
+from src.query_server import QueryServer
+from src.readings import Reading
+from src.columnar import export_weather, read_columns
+
+
+def synthetic_readings(cities, days, readings_per_day=1):
+    """
+    Generates weather records of the given number of cities and days ending today.
+
+    Args:
+        cities (int): Number of cities.
+        days (int): Number of days per city.
+        readings_per_day (int): Readings per day, more than one gives readings with a time.
+
+    Returns:
+        generator: Readings.
+    """
+    today = datetime.date.today()
+    for city in range(cities):
+        for offset in range(days, 0, -1):
+            day = today - datetime.timedelta(days=offset)
+            for reading in range(readings_per_day):
+                update_datetime = day.isoformat()
+                if readings_per_day > 1:
+                    minutes = reading * 24 * 60 // readings_per_day
+                    update_datetime += f" {minutes // 60:02d}:{minutes % 60:02d}"
+                seed = city * 31 + offset * 7 + reading
+                yield Reading(f'City{city:04d}', 'Benchland', 50.11, 8.68, float(seed % 35), seed % 100,
+                              float(seed % 20), float(seed % 5), update_datetime)
+
+
+def timings(function, repeat):
+    """
+    Calls a function repeatedly and returns the median and 95th percentile of its wall clock time in milliseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {'median_ms': round(statistics.median(samples), 4),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4)}
+
+
+def bench_insert(directory, rows):
+    """
+    Measures the rows per second of weather_info_insert (one commit per row) and of the batched insert.
+    """
+    results = []
+    for name in ('weather_info_insert', 'weather_info_bulk_insert'):
+        conn = connect(os.path.join(directory, f'insert_{name}_{rows}.db'))
+        c = conn.cursor()
+        readings = list(synthetic_readings(-(-rows // 365), 365))[:rows]
+        started = time.perf_counter()
+        if name == 'weather_info_insert':
+            for weather_info in readings:
+                weather_info_insert(weather_info, conn, c)
+        else:
+            weather_info_bulk_insert(readings, conn, c)
+        elapsed = time.perf_counter() - started
+        conn.close()
+        results.append({'benchmark': f'insert.{name}', 'rows': len(readings), 'seconds': round(elapsed, 4),
+                        'rows_per_second': round(len(readings) / elapsed, 1)})
+    return results
+
+
+def bench_queries(directory, cities, repeat):
+    """
+    Measures the latency of the latest, compare and average commands against a synthetic database of
+    the given number of cities with two years of hourly readings.
+    """
+    conn = connect(os.path.join(directory, f'queries_{cities}.db'))
+    weather_info_bulk_insert(synthetic_readings(cities, 730, readings_per_day=24), conn, conn.cursor(),
+                             flush_size=10000)
+    rows = conn.execute("SELECT COUNT(*) FROM weather").fetchone()[0]
+    runner = CliRunner()
+    last_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+    commands = {'latest': (latest, ['City0000']),
+                'compare.week': (compare, ['week', 'City0000']),
+                'compare.month': (compare, ['month', 'City0000']),
+                'compare.year': (compare, ['year', 'City0000']),
+                'average': (average, [last_month.strftime('%m'), last_month.strftime('%Y'), 'City0000'])}
+    results = []
+    for name, (command, args) in commands.items():
+        result = {'benchmark': f'query.{name}', 'rows': rows}
+        result.update(timings(lambda: runner.invoke(command, args, obj=conn), repeat))
+        results.append(result)
+
+    # The queries alone, answered by SQLite and by the query server
+    server = QueryServer(conn_path(conn))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    month = last_month.strftime('%Y-%m')
+    for source, queries in [('direct', DirectQueries(conn)), ('server', QueryClient(server.path, server.database))]:
+        lookups = {'latest': lambda: queries.latest('City0000'),
+                   'compare.year': lambda: (queries.average_since('City0000', 365), queries.latest('City0000')),
+                   'average': lambda: queries.month_average('City0000', month)}
+        for name, lookup in lookups.items():
+            result = {'benchmark': f'query.{source}.{name}', 'rows': rows}
+            result.update(timings(lookup, repeat))
+            results.append(result)
+    server.shutdown()
+    server.server_close()
+    conn.close()
+    return results
+
+
+def conn_path(conn):
+    """
+    Returns the file of an open SQLite connection.
+    """
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def bench_fetch(directory, cities, days, latency, concurrency):
+    """
+    Measures the end to end time of the historic backfill against the local mock weather API.
+    """
+    server, base_url = start_mock_server(latency)
+    database = os.path.join(directory, f'fetch_{cities}_{days}.db')
+    conn = connect(database)
+    writer = WeatherWriter(database).start()
+    client = WeatherClient(base_url, pool_size=concurrency)
+    started = time.perf_counter()
+    try:
+        try:
+            backfill_cities([f'City{city:04d}' for city in range(cities)], 'key', days, conn.cursor(), writer,
+                            client, concurrency)
+        finally:
+            # Closing waits for the writer to store the queued days, which is part of the measured time
+            writer.close()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+    conn.close()
+    requests_made = cities * days
+    return [{'benchmark': 'fetch.get_historic_weather', 'cities': cities, 'days': days, 'latency': latency,
+             'concurrency': concurrency, 'requests': requests_made, 'seconds': round(elapsed, 4),
+             'requests_per_second': round(requests_made / elapsed, 1)}]
+
+
+def bench_columnar(directory, cities, repeat):
+    """
+    Measures the export of two years of hourly readings and the mean temperature of one city over a year,
+    read as columns from the export and row by row from SQLite.
+    """
+    conn = connect(os.path.join(directory, f'columnar_{cities}.db'))
+    weather_info_bulk_insert(synthetic_readings(cities, 730, readings_per_day=24), conn, conn.cursor(),
+                             flush_size=10000)
+    rows = conn.execute("SELECT COUNT(*) FROM weather").fetchone()[0]
+    export = os.path.join(directory, f'export_{cities}')
+    started = time.perf_counter()
+    export_weather(conn, export)
+    elapsed = time.perf_counter() - started
+    results = [{'benchmark': 'columnar.export', 'rows': rows, 'seconds': round(elapsed, 4),
+                'rows_per_second': round(rows / elapsed, 1)}]
+    start = (datetime.date.today() - datetime.timedelta(days=365)).isoformat()
+
+    def from_columns():
+        temperatures = read_columns(export, ['City0000'], start, None, ['temperature'])['temperature']
+        return sum(temperatures) / len(temperatures)
+
+    def from_cursor():
+        total = count = 0
+        for (temperature,) in conn.execute("SELECT temperature FROM weather WHERE city=? AND update_datetime >=?",
+                                           ('City0000', start)):
+            total += temperature
+            count += 1
+        return total / count
+
+    for name, function in [('columns', from_columns), ('cursor', from_cursor)]:
+        result = {'benchmark': f'columnar.year_mean.{name}', 'rows': rows}
+        result.update(timings(function, repeat))
+        results.append(result)
+    conn.close()
+    return results
+
+
+def bench_startup(directory, repeat):
+    """
+    Measures the wall clock time of running the commands called from shell scripts in a new interpreter,
+    next to an interpreter doing nothing.
+    """
+    database = os.path.join(directory, 'startup.db')
+    conn = connect(database)
+    weather_info_bulk_insert(synthetic_readings(1, 30), conn, conn.cursor())
+    conn.close()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    commands = {'python': [sys.executable, '-c', 'pass'],
+                'weather_cli.latest': [sys.executable, '-m', 'src.weather_cli', '--database', database, 'latest',
+                                       'City0000'],
+                'weather_fetcher.help': [sys.executable, '-m', 'src.weather_fetcher', '--help']}
+    results = []
+    for name, command in commands.items():
+        result = {'benchmark': f'startup.{name}'}
+        result.update(timings(lambda: subprocess.run(command, cwd=directory, env=env, check=True,
+                                                     stdout=subprocess.DEVNULL), repeat))
+        results.append(result)
+    server = QueryServer(database)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    result = {'benchmark': 'startup.weather_cli.latest.server'}
+    result.update(timings(lambda: subprocess.run(commands['weather_cli.latest'], cwd=directory, env=env, check=True,
+                                                 stdout=subprocess.DEVNULL), repeat))
+    results.append(result)
+    server.shutdown()
+    server.server_close()
+    return results
+
+
+def git_commit():
+    """
+    Returns the commit of the working tree, None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    """
+    Returns the key identifying the same measurement in two result files.
+    """
+    return result['benchmark'], result.get('rows'), result.get('cities'), result.get('days')
+
+
+def compare_results(baseline, results):
+    """
+    Prints the change of every measurement against a baseline result file.
+    """
+    previous = {result_key(result): result for result in baseline['results']}
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        for metric in ('median_ms', 'seconds'):
+            if metric in result and before.get(metric):
+                change = (result[metric] - before[metric]) / before[metric] * 100
+                print(f"{result['benchmark']:<40} {metric} {before[metric]:>10} -> {result[metric]:>10} "
+                      f"({change:+.1f}%)")
+
+
+@click.command()
+@click.option('--rows', multiple=True, type=int, default=(10000, 100000, 1000000), show_default=True,
+              help='Row counts of the insert benchmark, can be repeated.')
+@click.option('--query-cities', multiple=True, type=int, default=(1, 10, 50), show_default=True,
+              help='Number of cities with two years of hourly readings in the query benchmark, can be repeated.')
+@click.option('--repeat', default=50, show_default=True, help='Calls of every query.')
+@click.option('--fetch-cities', default=10, show_default=True, help='Number of cities of the fetch benchmark.')
+@click.option('--fetch-days', default=30, show_default=True, help='Number of days of the fetch benchmark.')
+@click.option('--latency', default=0.05, show_default=True, help='Seconds the mock API waits per request.')
+@click.option('--concurrency', default=16, show_default=True, help='Workers of the fetch benchmark.')
+@click.option('--only', multiple=True, type=click.Choice(['insert', 'query', 'fetch', 'startup', 'columnar']),
+              help='Only run these benchmarks, can be repeated.')
+@click.option('--output', type=click.Path(), default='bench_results.json', show_default=True,
+              help='File the JSON results are written to.')
+@click.option('--baseline', type=click.File('r'), default=None,
+              help='Earlier JSON results to compare with.')
+def main(rows, query_cities, repeat, fetch_cities, fetch_days, latency, concurrency, only, output, baseline):
+    """
+    Runs the benchmark suite and writes the results as JSON.
+    """
+    only = set(only or ['insert', 'query', 'fetch', 'startup', 'columnar'])
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        if 'insert' in only:
+            for count in rows:
+                results += bench_insert(directory, count)
+        if 'query' in only:
+            for cities in query_cities:
+                results += bench_queries(directory, cities, repeat)
+        if 'fetch' in only:
+            results += bench_fetch(directory, fetch_cities, fetch_days, latency, concurrency)
+        if 'columnar' in only:
+            results += bench_columnar(directory, query_cities[-1], max(1, repeat // 5))
+        if 'startup' in only:
+            results += bench_startup(directory, max(1, repeat // 5))
+    report = {'commit': git_commit(), 'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'results': results}
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    for result in results:
+        print(json.dumps(result))
+    if baseline is not None:
+        compare_results(json.load(baseline), results)
+
+
+if __name__ == '__main__':
+    main()
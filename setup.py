@@ -6,7 +6,6 @@ setup(
     install_requires=[
         # Specify your package dependencies here
         'requests == 2.28.2',
-        'click == 8.1.3',
-        'schedule == 1.2.0'
+        'click == 8.1.3'
     ],
 )
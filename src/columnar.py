@@ -0,0 +1,292 @@
+# Columnar export and import of the weather table as NumPy .npz files partitioned by city and month
+import ast
+import json
+import os
+import sys
+import zipfile
+from array import array
+from urllib.parse import quote, unquote
+from src.partitions import has_hourly, source_groups, union_query
+from src.weather_db import hourly_readings, weather_info_bulk_insert
+
+# Exported columns and their NumPy type, the city is the name of the partition directory.
+# Strings are fixed width unicode, NULL numbers are written as NaN (floats) or 0 (epochs).
+COLUMNS = [('update_datetime', 'U'), ('update_epoch', '<i8'), ('country', 'U'), ('latitude', '<f8'),
+           ('longitude', '<f8'), ('temperature', '<f8'), ('humidity', '<f8'), ('wind_speed', '<f8'),
+           ('precipitation', '<f8')]
+ARRAY_TYPES = {'<f8': 'd', '<i8': 'q'}
+MANIFEST = '_export.json'
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def write_npy(output, values, descr):
+    """
+    Writes one column in the NumPy .npy format (version 1.0).
+
+    Args:
+        output (file): Binary file object.
+        values (list): Column values.
+        descr (str): NumPy type, '<f8', '<i8' or 'U' for strings.
+    """
+    if descr == 'U':
+        width = max([len(value) for value in values] + [1])
+        descr = f'<U{width}'
+        data = b''.join(value.ljust(width, '\0').encode('utf-32-le') for value in values)
+    else:
+        column = array(ARRAY_TYPES[descr], values)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        data = column.tobytes()
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': (len(values),)})
+    # The header is padded with spaces so the data starts at a multiple of 64 bytes
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * (padding % 64) + '\n').encode('latin1')
+    output.write(NPY_MAGIC + len(header).to_bytes(2, 'little') + header + data)
+
+
+def read_npy(data):
+    """
+    Reads one column written in the NumPy .npy format (version 1.0).
+
+    Args:
+        data (bytes): Content of the .npy file.
+
+    Returns:
+        array.array or list: Typed array of a numeric column, list of a string column.
+    """
+    if not data.startswith(NPY_MAGIC):
+        raise ValueError("Not a NumPy .npy file")
+    length = int.from_bytes(data[8:10], 'little')
+    header = ast.literal_eval(data[10:10 + length].decode('latin1'))
+    body = data[10 + length:]
+    descr = header['descr']
+    if descr.startswith('<U'):
+        width = int(descr[2:])
+        text = body.decode('utf-32-le')
+        return [text[offset:offset + width].rstrip('\0') for offset in range(0, len(text), width)]
+    column = array(ARRAY_TYPES[descr])
+    column.frombytes(body)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def write_npz(path, columns):
+    """
+    Writes columns of the same length as a NumPy .npz archive, one .npy member per column.
+
+    Args:
+        path (str): Path of the .npz file.
+        columns (dict): Column values by name.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, descr in COLUMNS:
+            with archive.open(name + '.npy', 'w') as output:
+                write_npy(output, columns[name], descr)
+
+
+def read_npz(path, names=None):
+    """
+    Reads the columns of a .npz archive.
+
+    Args:
+        path (str): Path of the .npz file.
+        names (list): Columns to read, all when not given.
+
+    Returns:
+        dict: Column arrays by name.
+    """
+    with zipfile.ZipFile(path) as archive:
+        return {name: read_npy(archive.read(name + '.npy')) for name, _ in COLUMNS if names is None or name in names}
+
+
+def partition_path(directory, city, month, first_id, index):
+    """
+    Returns the file of a part of the city/month partition written by the export starting after first_id,
+    e.g. city=Berlin/month=2023-04/part-00000000-000001.npz.
+    """
+    return os.path.join(directory, f'city={quote(city, safe="")}', f'month={month}',
+                        f'part-{first_id:08d}-{index:06d}.npz')
+
+
+def read_manifest(directory):
+    """
+    Returns the manifest of an export directory, an empty manifest if nothing was exported yet.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {'last_id': 0, 'last_hourly_id': 0, 'rows': 0, 'files': 0}
+
+
+def export_weather(conn, directory, full=False, chunk_size=10000):
+    """
+    Streams the weather table and the hourly readings in chunks into columnar .npz files partitioned by city and
+    month. The highest exported row id, and the id of the last day of hourly readings exported, are kept in the
+    manifest of the directory, so the next export only writes the rows inserted since, as new parts of their
+    partitions. The hourly readings have no location, their country is empty.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        directory (str): Export directory.
+        full (bool): Export every row again instead of the rows newer than the previous export.
+        chunk_size (int): Maximum number of rows fetched and written at once.
+
+    Returns:
+        dict: Number of 'rows' and 'files' written, the 'last_id' and the 'last_hourly_id' exported.
+    """
+    if full:
+        for _, path in partition_files(directory):
+            os.remove(path)
+        manifest = {'last_id': 0, 'last_hourly_id': 0, 'rows': 0, 'files': 0}
+    else:
+        manifest = read_manifest(directory)
+    first_id = manifest['last_id']
+    first_hourly_id = manifest.get('last_hourly_id', 0)
+    c = conn.cursor()
+    written = {'rows': 0, 'files': 0, 'last_id': first_id, 'last_hourly_id': first_hourly_id}
+    partition, columns = None, None
+
+    def flush():
+        if partition is not None and columns['update_datetime']:
+            write_npz(partition_path(directory, partition[0], partition[1], first_id, written['files']), columns)
+            written['files'] += 1
+
+    def write_rows(last_id):
+        # Rows of id, city, month and the exported columns, the highest id is kept under last_id
+        nonlocal partition, columns
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                key = (row[1], row[2])
+                if key != partition or len(columns['update_datetime']) >= chunk_size:
+                    flush()
+                    partition, columns = key, {name: [] for name, _ in COLUMNS}
+                for (name, descr), value in zip(COLUMNS, row[3:]):
+                    if value is None:
+                        value = '' if descr == 'U' else 0 if descr == '<i8' else float('nan')
+                    columns[name].append(value)
+                written['rows'] += 1
+                written[last_id] = max(written[last_id], row[0])
+
+    exported = ', '.join(name for name, _ in COLUMNS)
+    # Range of the (city, update_datetime) unique index, so the rows arrive grouped by partition.
+    # The archived years keep their ids in their partitions, a group of years never shares a month with another.
+    for sources in source_groups(conn, hourly=False):
+        c.execute(union_query(sources, f"id, city, substr(update_datetime, 1, 7), {exported}", "id > ?",
+                              'city, update_datetime'), (first_id,) * len(sources))
+        write_rows('last_id')
+        # The hourly readings of the days stored since the last export, along the primary key of every day.
+        # The days stay listed in the main database when their year is archived.
+        for schema in (source.split('.')[0] for source in sources):
+            if not has_hourly(conn, schema):
+                continue
+            c.execute(f"SELECT d.id, h.city, substr(h.update_datetime, 1, 7), "
+                      f"{', '.join('h.' + name for name, _ in COLUMNS)} FROM main.weather_hourly_days d "
+                      f"JOIN {hourly_readings(schema + '.weather_hourly')} h ON h.city = d.city "
+                      f"AND h.update_datetime >= d.day AND h.update_datetime < date(d.day, '+1 day') "
+                      f"WHERE d.id > ? ORDER BY h.city, h.update_datetime", (first_hourly_id,))
+            write_rows('last_hourly_id')
+    flush()
+    manifest = {'last_id': written['last_id'], 'last_hourly_id': written['last_hourly_id'],
+                'rows': manifest['rows'] + written['rows'], 'files': manifest['files'] + written['files']}
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, MANIFEST), 'w') as output:
+        json.dump(manifest, output)
+    return written
+
+
+def partition_files(directory, cities=None, start=None, end=None):
+    """
+    Returns the part files of the partitions matching the cities and the month range, the other partitions are
+    pruned from their directory names without being opened.
+
+    Args:
+        directory (str): Export directory.
+        cities (list): Cities to read, all when not given.
+        start (str): First day to read (YYYY-MM-DD), no lower bound when not given.
+        end (str): Last day to read (YYYY-MM-DD), no upper bound when not given.
+
+    Returns:
+        list: Tuples of city and path of every matching part file.
+    """
+    files = []
+    for city_directory in sorted(os.listdir(directory) if os.path.isdir(directory) else []):
+        if not city_directory.startswith('city='):
+            continue
+        city = unquote(city_directory[5:])
+        if cities and city not in cities:
+            continue
+        for month_directory in sorted(os.listdir(os.path.join(directory, city_directory))):
+            month = month_directory[6:]
+            if (start and month < start[:7]) or (end and month > end[:7]):
+                continue
+            path = os.path.join(directory, city_directory, month_directory)
+            files += [(city, os.path.join(path, name)) for name in sorted(os.listdir(path)) if name.endswith('.npz')]
+    return files
+
+
+def read_columns(directory, cities=None, start=None, end=None, names=None):
+    """
+    Reads the exported rows of the cities and days as columns, one typed array per numeric column.
+
+    Args:
+        directory (str): Export directory.
+        cities (list): Cities to read, all when not given.
+        start (str): First day to read (YYYY-MM-DD), no lower bound when not given.
+        end (str): Last day to read (YYYY-MM-DD), no upper bound when not given.
+        names (list): Columns to read, all when not given.
+
+    Returns:
+        dict: Column arrays by name plus the 'city' column.
+    """
+    result = {name: array(ARRAY_TYPES[descr]) if descr in ARRAY_TYPES else []
+              for name, descr in COLUMNS if names is None or name in names}
+    result['city'] = []
+    for city, path in partition_files(directory, cities, start, end):
+        month = os.path.basename(os.path.dirname(path))[6:]
+        # Only the partitions of the first and last month of the range need a row filter on the day
+        boundary = (start and month == start[:7]) or (end and month == end[:7])
+        columns = read_npz(path, None if names is None else set(names) | ({'update_datetime'} if boundary else set()))
+        length = len(next(iter(columns.values())))
+        keep = None
+        if boundary:
+            keep = [index for index, day in enumerate(columns['update_datetime'])
+                    if (not start or day[:10] >= start) and (not end or day[:10] <= end)]
+        for name in result:
+            if name != 'city':
+                result[name].extend(columns[name] if keep is None else [columns[name][index] for index in keep])
+        result['city'].extend([city] * (length if keep is None else len(keep)))
+    return result
+
+
+def import_weather(conn, c, directory, policy='ignore', flush_size=10000):
+    """
+    Inserts the rows of an export directory into the database, one batch per part file.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        c (sqlite3.Cursor): SQLite database cursor object.
+        directory (str): Export directory.
+        policy (str): Conflict policy of weather_info_bulk_insert ('ignore' or 'update').
+        flush_size (int): Number of rows written per transaction.
+
+    Returns:
+        dict: Number of 'inserted', 'updated', 'skipped' and 'failed' rows.
+    """
+    totals = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    names = [name for name, _ in COLUMNS if name != 'update_epoch']
+    for city, path in partition_files(directory):
+        columns = read_npz(path, names)
+        nan_to_none = {name: [None if value != value else value for value in columns[name]]
+                       for name, descr in COLUMNS if descr == '<f8'}
+        columns.update(nan_to_none)
+        weather_infos = (dict(zip(names, values), city=city) for values in zip(*(columns[name] for name in names)))
+        counts = weather_info_bulk_insert(weather_infos, conn, c, policy, flush_size)
+        for key in totals:
+            totals[key] += counts[key]
+    return totals
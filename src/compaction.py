@@ -0,0 +1,174 @@
+# Downsampling of old readings into hourly or daily rows, in small resumable batches
+import datetime
+
+# Length of the update_datetime prefix shared by the readings of an hour or a day
+RESOLUTIONS = {'hour': 13, 'day': 10}
+BUCKET_FORMATS = {'hour': '%Y-%m-%d %H', 'day': '%Y-%m-%d'}
+BUCKET_STEPS = {'hour': datetime.timedelta(hours=1), 'day': datetime.timedelta(days=1)}
+
+
+def bucket_label(resolution):
+    """
+    Returns the SQL expression of the update_datetime given to the row kept for a bucket, the earliest time of
+    the hour or day, so it sorts before every other reading of the bucket.
+    """
+    suffix = ':00' if resolution == 'hour' else ' 00:00'
+    return f"substr(update_datetime, 1, {RESOLUTIONS[resolution]}) || '{suffix}'"
+
+
+def next_bucket(bucket, resolution):
+    """
+    Returns the update_datetime prefix of the bucket following a bucket.
+    """
+    start = datetime.datetime.strptime(bucket, BUCKET_FORMATS[resolution])
+    return (start + BUCKET_STEPS[resolution]).strftime(BUCKET_FORMATS[resolution])
+
+
+def compact_batch(conn, city, start, end, resolution):
+    """
+    Replaces the readings of a city with a time between two bounds by one row per bucket holding the mean of
+    every metric, in one transaction. The earliest reading of a bucket is updated and the others deleted.
+    A daily compaction does the same with the hourly readings of the city.
+    The progress of the city is saved in the same transaction, so the rollup triggers leave these rows alone
+    and the next run starts after them.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        city (str): City name.
+        start (str): First update_datetime of the batch, '' for the first batch of the city.
+        end (str): update_datetime prefix of the first bucket after the batch.
+        resolution (str): 'hour' or 'day'.
+
+    Returns:
+        int: Number of readings deleted.
+    """
+    label = bucket_label(resolution)
+    # Daily history rows have no time and are left as they are
+    batch = "city = ? AND update_datetime >= ? AND update_datetime < ? AND length(update_datetime) > 10"
+    means = ', '.join(f"avg({metric}) AS {metric}" for metric in ('temperature', 'humidity', 'wind_speed',
+                                                                   'precipitation'))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT INTO weather_compaction (city, resolution, compacted_before) VALUES (?, ?, ?) "
+                     "ON CONFLICT (city, resolution) DO UPDATE SET compacted_before=excluded.compacted_before",
+                     (city, resolution, end))
+        # min() makes SQLite read the bare id column from the earliest reading of the bucket
+        conn.execute(f"UPDATE weather SET update_datetime = b.label, "
+                     f"update_epoch = CAST(strftime('%s', b.label) AS INTEGER), temperature = b.temperature, "
+                     f"humidity = b.humidity, wind_speed = b.wind_speed, precipitation = b.precipitation "
+                     f"FROM (SELECT id, min(update_datetime) AS first, count(*) AS readings, {label} AS label, "
+                     f"{means} FROM weather WHERE {batch} GROUP BY label) AS b "
+                     f"WHERE weather.id = b.id AND (b.readings > 1 OR b.first != b.label)", (city, start, end))
+        removed = conn.execute(f"DELETE FROM weather WHERE {batch} AND update_datetime != {label}",
+                               (city, start, end)).rowcount
+        if resolution == 'day':
+            # The hourly readings have no id, the earliest hour of a day is found along the primary key
+            conn.execute(f"UPDATE weather_hourly SET update_datetime = b.label, temperature = b.temperature, "
+                         f"humidity = b.humidity, wind_speed = b.wind_speed, precipitation = b.precipitation "
+                         f"FROM (SELECT min(update_datetime) AS first, count(*) AS readings, {label} AS label, "
+                         f"{means} FROM weather_hourly WHERE {batch} GROUP BY label) AS b "
+                         f"WHERE weather_hourly.city = ? AND weather_hourly.update_datetime = b.first "
+                         f"AND (b.readings > 1 OR b.first != b.label)", (city, start, end, city))
+            removed += conn.execute(f"DELETE FROM weather_hourly WHERE {batch} AND update_datetime != {label}",
+                                    (city, start, end)).rowcount
+        conn.execute("UPDATE weather_compaction SET removed = removed + ? WHERE city = ? AND resolution = ?",
+                     (removed, city, resolution))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return removed
+
+
+def compact_city(conn, city, before, resolution='hour', batch_size=5000, max_batches=None):
+    """
+    Downsamples the readings of a city before a day in batches of about batch_size readings, starting where
+    the previous run stopped.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        city (str): City name.
+        before (str): First day (YYYY-MM-DD) kept at full resolution.
+        resolution (str): 'hour' or 'day'.
+        batch_size (int): Number of readings read per transaction, a bucket is never split.
+        max_batches (int): Stop after this many batches, no limit when not given.
+
+    Returns:
+        dict: Number of 'batches' run and readings 'removed'.
+    """
+    row = conn.execute("SELECT compacted_before FROM weather_compaction WHERE city = ? AND resolution = ?",
+                       (city, resolution)).fetchone()
+    start = row[0] if row is not None else ''
+    tables = ('weather', 'weather_hourly') if resolution == 'day' else ('weather',)
+    readings = ' UNION ALL '.join(f"SELECT update_datetime FROM {table} WHERE city = ? AND update_datetime >= ? "
+                                  f"AND update_datetime < ?" for table in tables)
+    done = {'batches': 0, 'removed': 0}
+    while start < before and (max_batches is None or done['batches'] < max_batches):
+        # Range of the (city, update_datetime) unique index, and of the hourly readings for a daily compaction
+        row = conn.execute(f"SELECT update_datetime FROM ({readings}) ORDER BY update_datetime LIMIT 1 OFFSET ?",
+                           (city, start, before) * len(tables) + (max(1, batch_size),)).fetchone()
+        end = before if row is None else row[0][:RESOLUTIONS[resolution]]
+        if end <= start:
+            # A single bucket holds more than batch_size readings
+            end = next_bucket(end, resolution)
+        done['removed'] += compact_batch(conn, city, start, end, resolution)
+        done['batches'] += 1
+        start = end
+    return done
+
+
+def reclaim_space(conn, pages=1000):
+    """
+    Returns the free pages of the database file to the file system, pages at a time so other connections
+    can write in between.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        pages (int): Number of pages freed per step.
+
+    Returns:
+        int: Number of pages freed, None if the database was not created with incremental vacuum.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    freed = 0
+    while free:
+        # execute() would only step the pragma once and free a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+        left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if left >= free:
+            break
+        freed += free - left
+        free = left
+    return freed
+
+
+def compact(conn, older_than=30, resolution='hour', batch_size=5000, cities=None, max_batches=None):
+    """
+    Downsamples the readings older than some days of every city to one row per hour or day, and their hourly
+    readings to one per day for a daily compaction, and reclaims the freed space. The rollups used by compare
+    and average keep the values of the raw readings.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        older_than (int): Number of days before today kept at full resolution.
+        resolution (str): 'hour' or 'day'.
+        batch_size (int): Number of readings read per transaction.
+        cities (list): Cities to compact, all when not given.
+        max_batches (int): Maximum number of batches per city, no limit when not given.
+
+    Returns:
+        dict: Number of 'cities', 'batches' run, readings 'removed' and 'pages' freed (None without incremental
+            vacuum).
+    """
+    before = (datetime.date.today() - datetime.timedelta(days=older_than)).isoformat()
+    if not cities:
+        cities = [row[0] for row in conn.execute("SELECT city FROM weather UNION SELECT city FROM weather_hourly")]
+    totals = {'cities': len(cities), 'batches': 0, 'removed': 0}
+    for city in cities:
+        done = compact_city(conn, city, before, resolution, batch_size, max_batches)
+        totals['batches'] += done['batches']
+        totals['removed'] += done['removed']
+    totals['pages'] = reclaim_space(conn)
+    return totals
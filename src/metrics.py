@@ -0,0 +1,294 @@
+# Counters, gauges and latency histograms exported in the Prometheus text format, and JSON log events
+import json
+import os
+import sys
+import threading
+import time
+
+# Seconds, from a cached response to a slow API call with retries
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Metric:
+    """
+    Counter, gauge or histogram with optional labels, one value per combination of label values.
+
+    Args:
+        name (str): Metric name, e.g. weather_api_requests_total.
+        help (str): Description written in the # HELP line.
+        kind (str): 'counter', 'gauge' or 'histogram'.
+        labels (tuple): Label names.
+        buckets (tuple): Upper bounds of the histogram buckets.
+    """
+
+    def __init__(self, name, help, kind, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds to a counter or gauge.
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """
+        Sets a gauge.
+        """
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def observe(self, value, **labels):
+        """
+        Adds an observation to a histogram.
+        """
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, then the sum and the count of all observations
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def get(self, **labels):
+        """
+        Returns the value of a counter or gauge, the count of a histogram, 0 if nothing was recorded.
+        """
+        value = self.values.get(self.key(labels), 0)
+        return value[-1] if isinstance(value, list) else value
+
+    def render(self):
+        """
+        Returns the lines of the metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = sorted((key, list(value) if isinstance(value, list) else value)
+                            for key, value in self.values.items())
+        for key, value in values:
+            pairs = [f'{label}={quote(label_value)}' for label, label_value in zip(self.labels, key)]
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{format_labels(pairs)} {format_value(value)}")
+                continue
+            for bound, count in zip([f'{bound:g}' for bound in self.buckets] + ['+Inf'], value[:-2] + value[-1:]):
+                lines.append(f"{self.name}_bucket{format_labels(pairs + ['le=' + quote(bound)])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {format_value(value[-2])}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {value[-1]}")
+        return lines
+
+
+def quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def format_labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Set of metrics rendered together. Asking twice for the same name returns the same metric.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def metric(self, name, help, kind, labels=(), buckets=LATENCY_BUCKETS):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(name, help, kind, labels, buckets)
+            return self.metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self.metric(name, help, 'counter', labels)
+
+    def gauge(self, name, help, labels=()):
+        return self.metric(name, help, 'gauge', labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.metric(name, help, 'histogram', labels, buckets)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return ''.join(line + '\n' for metric in metrics for line in metric.render())
+
+    def write_textfile(self, path):
+        """
+        Writes the metrics for the textfile collector of the Prometheus node exporter. The file is replaced
+        atomically so the collector never reads half of it.
+
+        Args:
+            path (str): Path of the .prom file.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as output:
+            output.write(self.render())
+        os.replace(temporary, path)
+
+
+REGISTRY = Registry()
+
+# Metrics of the fetcher, shared by the client, the insert path, the writer and the scheduler
+API_REQUESTS = REGISTRY.counter('weather_api_requests_total', 'API calls by endpoint and status code.',
+                                ('endpoint', 'status'))
+API_ERRORS = REGISTRY.counter('weather_api_errors_total', 'API calls failing with an error or a 4xx/5xx status.',
+                              ('endpoint',))
+API_RETRIES = REGISTRY.counter('weather_api_retries_total', 'Retries of failing API calls.', ('endpoint',))
+API_CACHE_HITS = REGISTRY.counter('weather_api_cache_hits_total', 'API calls answered by the response cache.',
+                                  ('endpoint',))
+API_LATENCY = REGISTRY.histogram('weather_api_latency_seconds', 'API call latency including retries.',
+                                 ('endpoint',))
+ROWS = REGISTRY.counter('weather_db_rows_total', 'Weather records written by result.', ('result',))
+COMMIT_LATENCY = REGISTRY.histogram('weather_db_commit_seconds', 'Latency of an insert and its commit.')
+QUEUE_DEPTH = REGISTRY.gauge('weather_writer_queue_depth', 'Records waiting for the database writer.')
+POLLS = REGISTRY.counter('weather_polls_total', 'Polls of the current conditions by result.', ('result',))
+SCHEDULER_RUNS = REGISTRY.counter('weather_scheduler_runs_total', 'Scheduler job runs by outcome.', ('outcome',))
+SCHEDULER_LAG = REGISTRY.histogram('weather_scheduler_lag_seconds', 'Seconds a job started after it was due.',
+                                   buckets=LAG_BUCKETS)
+
+# JSON log events are written to this stream when enabled, see configure
+log_stream = None
+exporter = None
+
+
+def log_event(event, **fields):
+    """
+    Writes one JSON log line with the time, the event name and the fields, when JSON logs are enabled.
+
+    Args:
+        event (str): Event name, e.g. api_call.
+        **fields: Values of the event.
+    """
+    if log_stream is None:
+        return
+    line = json.dumps(dict({'ts': round(time.time(), 3), 'event': event}, **fields), default=str)
+    log_stream.write(line + '\n')
+    log_stream.flush()
+
+
+class Exporter:
+    """
+    Exports the registry while a command runs: rewrites a textfile every interval seconds and/or serves
+    GET /metrics on a local port, both from a daemon thread.
+
+    Args:
+        registry (Registry): Metrics to export.
+        textfile (str): Optional path of the .prom file.
+        port (int): Optional port of the HTTP endpoint, bound to localhost.
+        interval (float): Seconds between two writes of the textfile.
+    """
+
+    def __init__(self, registry, textfile=None, port=None, interval=15.0):
+        self.registry = registry
+        self.textfile = textfile
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.server = None
+        self.threads = []
+        if port is not None:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(handler):
+                    if handler.path.split('?')[0] != '/metrics':
+                        handler.send_error(404)
+                        return
+                    body = registry.render().encode()
+                    handler.send_response(200)
+                    handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    handler.send_header('Content-Length', str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+
+                def log_message(handler, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+            self.threads.append(threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True))
+        if textfile is not None:
+            self.threads.append(threading.Thread(target=self.write_loop, name='metrics-textfile', daemon=True))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def write_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            self.registry.write_textfile(self.textfile)
+        except OSError as e:
+            print(f"Error writing metrics to {self.textfile}: {e}", file=sys.stderr)
+
+    def close(self):
+        """
+        Stops the threads and writes the textfile a last time.
+        """
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.textfile is not None:
+            self.write()
+
+
+def configure(textfile=None, port=None, interval=15.0, json_logs=False):
+    """
+    Starts the export of the metrics and enables the JSON log events of a command.
+
+    Args:
+        textfile (str): Optional path of the .prom file.
+        port (int): Optional port of the /metrics HTTP endpoint.
+        interval (float): Seconds between two writes of the textfile.
+        json_logs (bool): Write JSON log events to stderr.
+
+    Returns:
+        Exporter: The started exporter, None if the metrics are not exported.
+    """
+    global log_stream, exporter
+    log_stream = sys.stderr if json_logs else None
+    if textfile is None and port is None:
+        return None
+    exporter = Exporter(REGISTRY, textfile, port, interval).start()
+    return exporter
+
+
+def shutdown():
+    """
+    Stops the exporter started by configure, the textfile then holds the final values.
+    """
+    global log_stream, exporter
+    if exporter is not None:
+        exporter.close()
+        exporter = None
+    log_stream = None
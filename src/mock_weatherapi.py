@@ -0,0 +1,295 @@
+# Local stand-in for the weatherapi.com endpoints, used by tests and benchmarks
+import json
+import random
+import threading
+import time
+import datetime
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from src.recording import load_recording, replay_key
+
+
+def current_payload(city, update_interval=60):
+    """
+    Builds a synthetic current.json response for the given city. Like the real API the reading only changes
+    every update_interval seconds, last_updated is the start of the current interval.
+
+    Args:
+        city (str): City name sent in the 'q' parameter.
+        update_interval (float): Seconds between two updates of the reading.
+
+    Returns:
+        dict: Dictionary shaped like the current API response.
+    """
+    epoch = time.time() // update_interval * update_interval
+    # Below a minute the seconds are kept so every update has its own last_updated
+    last_updated = datetime.datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M' if update_interval >= 60
+                                                                   else '%Y-%m-%d %H:%M:%S')
+    seed = sum(map(ord, city))
+    return {'location': {'name': city, 'country': 'Mockland', 'lat': 50.11, 'lon': 8.68},
+            'current': {'temp_c': float(seed % 35), 'humidity': seed % 100, 'wind_mph': float(seed % 20),
+                        'precip_mm': 0.0, 'last_updated_epoch': epoch, 'last_updated': last_updated}}
+
+
+def history_payload(city, date):
+    """
+    Builds a synthetic history.json response for the given city and day.
+
+    Args:
+        city (str): City name sent in the 'q' parameter.
+        date (str): Day sent in the 'dt' parameter (format: YYYY-MM-DD).
+
+    Returns:
+        dict: Dictionary shaped like the history API response.
+    """
+    seed = sum(map(ord, city + date))
+    hours = [{'time': f'{date} {hour:02d}:00', 'temp_c': float(seed % 35) + (hour - 12) / 4,
+              'humidity': seed % 100, 'wind_mph': float(seed % 20), 'precip_mm': 0.0} for hour in range(24)]
+    return {'location': {'name': city, 'country': 'Mockland', 'lat': 50.11, 'lon': 8.68},
+            'forecast': {'forecastday': [{'date': date,
+                                          'day': {'avgtemp_c': float(seed % 35), 'avghumidity': float(seed % 100),
+                                                  'maxwind_mph': float(seed % 20), 'totalprecip_mm': 0.0},
+                                          'hour': hours}]}}
+
+
+class MockWeatherServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog large enough for many concurrent clients.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def injected_error(self):
+        """
+        Returns the status code of an error to answer instead of the request, None to answer it. Requests
+        above the rate limit of the current second get 429, the others an error of the error mix by chance.
+        """
+        with self.lock:
+            self.request_count += 1
+            if self.rate:
+                second = int(time.monotonic())
+                if second != self.rate_second:
+                    self.rate_second, self.rate_count = second, 0
+                self.rate_count += 1
+                if self.rate_count > self.rate:
+                    return 429
+        draw = random.random()
+        for status, fraction in self.errors.items():
+            if draw < fraction:
+                return status
+            draw -= fraction
+        return None
+
+    def replayed(self, endpoint, city, date=None):
+        """
+        Returns the next recorded (status code, body) of a request, None if it was not recorded. The recorded
+        responses of a request are answered in turn, starting again after the last one.
+        """
+        key = replay_key(endpoint, city, date)
+        responses = self.recording.get(key)
+        if not responses:
+            return None
+        with self.lock:
+            index = self.replay_index.get(key, 0)
+            self.replay_index[key] = index + 1
+        return responses[index % len(responses)]
+
+
+class MockWeatherHandler(BaseHTTPRequestHandler):
+    """
+    Request handler answering /v1/current.json and /v1/history.json with synthetic data
+    after sleeping for the latency configured on the server. Cities added to the server's
+    unknown_cities set are answered with the API's "No matching location found" error, and the
+    server's locations dictionary maps a lower case query to the location name the API returns
+    (by default the query itself). The current readings change every update_interval seconds of the server.
+    Bulk requests (POST current.json?q=bulk) are answered when the server's bulk_enabled is set, and
+    rejected like on the free plan otherwise. Connections are kept alive, the server counts them and the peak
+    number of requests in flight.
+    Responses in the server's recording are replayed instead of the synthetic data, and the server's error
+    mix and rate limit answer some requests with an error.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.delay_or_fail():
+            return
+        if not url.path.endswith('/current.json') or params.get('q') != 'bulk':
+            self.send_json(404, {'error': {'code': 1005, 'message': 'API URL is invalid.'}})
+        elif not self.server.bulk_enabled:
+            self.send_json(400, {'error': {'code': 2009, 'message': 'API key does not have access to the resource.'}})
+        else:
+            bulk = []
+            for location in body.get('locations', []):
+                city = location.get('q', '')
+                query = {'custom_id': location.get('custom_id'), 'q': city}
+                recorded = self.server.replayed('current', city)
+                if recorded is not None and recorded[0] == 200:
+                    query.update(recorded[1])
+                elif city in self.server.unknown_cities or recorded is not None:
+                    query['error'] = {'code': 1006, 'message': 'No matching location found.'}
+                else:
+                    query.update(current_payload(self.server.locations.get(city.lower(), city),
+                                                 self.server.update_interval))
+                bulk.append({'query': query})
+            self.send_json(200, {'bulk': bulk})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.delay_or_fail():
+            return
+        city = params.get('q', '')
+        name = self.server.locations.get(city.lower(), city)
+        endpoint = url.path.rsplit('/', 1)[-1].split('.')[0]
+        recorded = self.server.replayed(endpoint, city, params.get('dt')) if endpoint in ('current', 'history') \
+            else None
+        if recorded is not None:
+            self.send_json(*recorded)
+        elif city in self.server.unknown_cities:
+            self.send_json(400, {'error': {'code': 1006, 'message': 'No matching location found.'}})
+        elif url.path.endswith('/current.json'):
+            self.send_json(200, current_payload(name, self.server.update_interval))
+        elif url.path.endswith('/history.json'):
+            self.send_json(200, history_payload(name, params.get('dt', '')))
+        else:
+            self.send_json(404, {'error': {'code': 1005, 'message': 'API URL is invalid.'}})
+
+    def delay_or_fail(self):
+        """
+        Waits for the latency of the server and answers the request with an injected error if there is one.
+
+        Returns:
+            bool: True if the request was answered with an error.
+        """
+        delay = self.server.latency + random.uniform(0, self.server.latency_jitter)
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            if delay:
+                time.sleep(delay)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+        status = self.server.injected_error()
+        if status is None:
+            return False
+        if status == 429:
+            self.send_json(429, {'error': {'code': 2007, 'message': 'API key has exceeded calls per month quota.'}},
+                           {'Retry-After': '1'})
+        else:
+            self.send_json(status, {'error': {'code': 9999, 'message': 'Internal application error.'}})
+        return True
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(latency=0.0, port=0, update_interval=60, recording=None, errors=None, rate=None,
+                      latency_jitter=0.0):
+    """
+    Starts the mock weather API in a background thread.
+
+    Args:
+        latency (float): Seconds every request waits before it is answered.
+        port (int): Port to listen on, 0 picks a free port.
+        update_interval (float): Seconds between two updates of the current readings.
+        recording (str): Optional file written with --record, its responses are replayed and the requests
+            that were not recorded get synthetic data.
+        errors (dict): Fraction of the requests answered with each status code, e.g. {500: 0.01, 429: 0.02}.
+        rate (int): Maximum number of requests answered per second, the others get 429.
+        latency_jitter (float): Upper bound of a random number of seconds added to the latency of a request.
+
+    Returns:
+        tuple: The running server and the base URL to pass instead of BASEURL.
+    """
+    server = MockWeatherServer(('127.0.0.1', port), MockWeatherHandler)
+    server.latency = latency
+    server.latency_jitter = latency_jitter
+    server.recording = load_recording(recording) if recording else {}
+    server.replay_index = {}
+    server.errors = errors or {}
+    server.rate = rate
+    server.rate_second = server.rate_count = 0
+    server.update_interval = update_interval
+    server.bulk_enabled = True
+    server.connection_count = 0
+    server.request_count = 0
+    # Requests waiting for their latency at the same time, and the peak of it
+    server.in_flight = server.max_in_flight = 0
+    server.lock = threading.Lock()
+    server.unknown_cities = set()
+    server.locations = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def parse_errors(errors):
+    """
+    Parses STATUS=FRACTION options into the error mix of the server.
+
+    Args:
+        errors (tuple): Options like '500=0.01'.
+
+    Returns:
+        dict: Fraction per status code.
+    """
+    mix = {}
+    for error in errors:
+        status, _, fraction = error.partition('=')
+        try:
+            mix[int(status)] = float(fraction)
+        except ValueError:
+            raise click.BadParameter(f"{error!r} is not STATUS=FRACTION", param_hint='--error')
+    if sum(mix.values()) > 1:
+        raise click.BadParameter("The fractions add up to more than 1", param_hint='--error')
+    return mix
+
+
+@click.command()
+@click.option('--port', default=8080, show_default=True, help='Port to listen on.')
+@click.option('--latency', default=0.0, show_default=True, help='Seconds every request waits before it is answered.')
+@click.option('--update-interval', default=60.0, show_default=True,
+              help='Seconds between two updates of the current readings.')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Answer the requests with the responses of a file written with --record.')
+@click.option('--error', 'errors', multiple=True, metavar='STATUS=FRACTION',
+              help='Answer a fraction of the requests with an error status code, e.g. 500=0.01. Repeatable.')
+@click.option('--rate', type=int, default=None, help='Maximum number of requests answered per second.')
+@click.option('--latency-jitter', default=0.0, show_default=True,
+              help='Upper bound of the random seconds added to the latency.')
+def serve(port, latency, update_interval, replay, errors, rate, latency_jitter):
+    """
+    Runs the mock weather API in the foreground.
+    """
+    server, base_url = start_mock_server(latency, port, update_interval, replay, parse_errors(errors), rate,
+                                         latency_jitter)
+    print(f"Mock weather API listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,348 @@
+# Yearly partitions of the raw weather rows, kept in SQLite files attached next to the weather database
+import contextlib
+import datetime
+import os
+import sqlite3
+from src.weather_db import WEATHER_COLUMNS, hourly_readings, hourly_table, weather_table
+
+# Partition states: 'archived' holds the raw rows of the year, 'downsampled' one row per city and day,
+# 'dropped' no rows anymore. The rollups of the year stay in the weather database in every state.
+READABLE = ('archived', 'downsampled')
+# SQLite attaches at most 10 databases to a connection, the partitions are read in groups of at most this many
+MAX_ATTACHED = 8
+
+
+def database_path(conn):
+    """
+    Returns the file of the main database of a connection, '' for an in-memory database.
+    """
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path or ''
+    return ''
+
+
+def partition_path(database, year):
+    """
+    Returns the file of the partition of a year, weather_data.2023.db for weather_data.db.
+
+    Args:
+        database (str): Path of the weather database.
+        year (str): Year as YYYY.
+
+    Returns:
+        str: Path of the partition file.
+    """
+    root, extension = os.path.splitext(database)
+    return f"{root}.{year}{extension or '.db'}"
+
+
+def partitions(conn, states=None):
+    """
+    Returns the partitions of a weather database ordered by year.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        states (tuple): Only return the partitions in these states, all when not given.
+
+    Returns:
+        list: Tuples of year, path of the file, state and number of rows.
+    """
+    directory = os.path.dirname(database_path(conn))
+    rows = conn.execute("SELECT year, path, state, rows FROM weather_partitions ORDER BY year").fetchall()
+    # Paths are stored relative to the weather database, so both files can be moved together
+    return [(year, os.path.join(directory, path), state, count) for year, path, state, count in rows
+            if states is None or state in states]
+
+
+def attach(conn, year, path):
+    """
+    Attaches the partition of a year to a connection, once, as the schema p<year>.
+
+    Returns:
+        str: Schema name of the partition.
+    """
+    schema = f"p{year}"
+    if schema not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    return schema
+
+
+def has_hourly(conn, schema):
+    """
+    Returns whether a database holds hourly readings, the partitions archived before the hourly readings were
+    moved with their year have none.
+    """
+    return bool(conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' "
+                             f"AND name = 'weather_hourly'").fetchall())
+
+
+@contextlib.contextmanager
+def attached(conn, years):
+    """
+    Attaches the partitions of some years for the duration of a with block and detaches them afterwards.
+    The statements reading them must be finished or closed before the block ends.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        years (list): Tuples of year and path of the partition file.
+
+    Yields:
+        list: Schema names of the partitions.
+    """
+    schemas = []
+    try:
+        for year, path in years:
+            schemas.append(attach(conn, year, path))
+        yield schemas
+    finally:
+        for schema in schemas:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+
+def source_groups(conn, start=None, end=None, size=MAX_ATTACHED, hourly=True):
+    """
+    Yields the tables holding the raw weather rows between two days in groups that can be attached together:
+    the weather tables of the readable partitions whose year overlaps the range, oldest first and at most size
+    per group, and main.weather in the last group, each with its hourly readings. The partitions of a group are
+    attached while it is read and detached before the next group, partitions outside the range are not opened.
+    The groups follow each other in time, so the readings of a city read group after group are in time order.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        start (str): First day or time of the range, no lower bound when not given.
+        end (str): Last day or time of the range, no upper bound when not given.
+        size (int): Maximum number of partitions attached at once.
+        hourly (bool): Also yield the hourly readings, as a subquery with the columns of the weather table.
+
+    Yields:
+        list: Qualified table names of a group.
+    """
+    years = [(year, path) for year, path, _, _ in partitions(conn, READABLE)
+             if not ((start and year < start[:4]) or (end and year > end[:4]))]
+    groups = [years[index:index + size] for index in range(0, len(years), size)] or [[]]
+    for number, group in enumerate(groups, 1):
+        with attached(conn, group) as schemas:
+            if number == len(groups):
+                schemas = schemas + ['main']
+            sources = [f"{schema}.weather" for schema in schemas]
+            if hourly:
+                sources += [hourly_readings(f"{schema}.weather_hourly") for schema in schemas
+                            if has_hourly(conn, schema)]
+            yield sources
+
+
+def union_query(sources, select, where='1', order_by=None):
+    """
+    Returns one query reading the same columns from every source, with the parameters of the condition
+    repeated once per source. Sorting on the (city, update_datetime) unique index of every table lets SQLite
+    merge the sources without a temporary sort.
+
+    Args:
+        sources (list): Qualified table names, see source_groups.
+        select (str): Selected columns.
+        where (str): SQL condition applied to every source.
+        order_by (str): Optional ORDER BY columns of the whole query.
+
+    Returns:
+        str: SQL query.
+    """
+    query = ' UNION ALL '.join(f"SELECT {select} FROM {source} WHERE {where}" for source in sources)
+    return query + (f" ORDER BY {order_by}" if order_by else '')
+
+
+def year_range(year):
+    """
+    Returns the update_datetime bounds of a year, the range of the (city, update_datetime) index is used.
+    """
+    return f"{year}-01-01", f"{int(year) + 1}-01-01"
+
+
+def copy_year(database, path, year):
+    """
+    Copies the raw rows and the hourly readings of a year from the weather database into its partition file and
+    commits the partition. Rows copied by an earlier, interrupted run are kept.
+
+    Returns:
+        int: Number of rows and hourly readings of the year in the partition.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(weather_table('weather', autoincrement=False))
+        conn.execute("CREATE INDEX IF NOT EXISTS weather_city_epoch ON weather (city, update_epoch)")
+        conn.execute(hourly_table('weather_hourly'))
+        conn.execute("ATTACH DATABASE ? AS source", (database,))
+        with conn:
+            conn.execute(f"INSERT OR IGNORE INTO weather ({WEATHER_COLUMNS}) SELECT {WEATHER_COLUMNS} "
+                         f"FROM source.weather WHERE update_datetime >= ? AND update_datetime < ?", year_range(year))
+            conn.execute(f"INSERT OR IGNORE INTO weather_hourly SELECT * FROM source.weather_hourly "
+                         f"WHERE update_datetime >= ? AND update_datetime < ?", year_range(year))
+        return conn.execute("SELECT (SELECT COUNT(*) FROM weather) + (SELECT COUNT(*) FROM weather_hourly)"
+                            ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def archive_year(conn, year, attempts=3):
+    """
+    Moves the raw rows and the hourly readings of a year out of the weather database into the partition of
+    the year. The rows are copied and committed in the partition first, then the year is registered and its
+    rows deleted from the weather database in one transaction, which never loses a row if the process stops
+    in between. Rows written by the fetcher during the copy are copied on the next attempt. The rollups of the
+    year are kept.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        year (str): Year as YYYY.
+        attempts (int): Number of copies before giving up when the fetcher keeps writing rows of the year.
+
+    Returns:
+        int: Number of rows in the partition, None if the rows kept arriving.
+    """
+    database = database_path(conn)
+    if not database:
+        raise ValueError("Partitions need a database file, not an in-memory database")
+    path = partition_path(database, year)
+    try:
+        for _ in range(attempts):
+            count = copy_year(database, path, year)
+            schema = attach(conn, year, path)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                missing = sum(conn.execute(f"SELECT COUNT(*) FROM main.{table} w WHERE update_datetime >= ? "
+                                           f"AND update_datetime < ? AND NOT EXISTS (SELECT 1 FROM {schema}.{table} p "
+                                           f"WHERE p.city = w.city AND p.update_datetime = w.update_datetime)",
+                                           year_range(year)).fetchone()[0] for table in ('weather', 'weather_hourly'))
+                if missing:
+                    conn.rollback()
+                    continue
+                # Registered first, so the delete triggers keep the rollups of the year
+                conn.execute("INSERT INTO weather_partitions (year, path, state, rows, changed_at) "
+                             "VALUES (?, ?, 'archived', ?, datetime('now')) ON CONFLICT (year) DO UPDATE SET "
+                             "state='archived', rows=excluded.rows, changed_at=excluded.changed_at",
+                             (year, os.path.basename(path), count))
+                for table in ('weather', 'weather_hourly'):
+                    conn.execute(f"DELETE FROM main.{table} WHERE update_datetime >= ? AND update_datetime < ?",
+                                 year_range(year))
+                conn.commit()
+                return count
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return None
+    finally:
+        # Archiving many years must not exceed the attached databases
+        if f"p{year}" in {row[1] for row in conn.execute("PRAGMA database_list")}:
+            conn.execute(f"DETACH DATABASE p{year}")
+
+
+def archive(conn, before):
+    """
+    Moves every year before a given year out of the weather table and the hourly readings, each into its own
+    partition. Only years older than every year left in the weather database can be archived, so the newest
+    reading of a city is in the weather database whenever it has one there.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        before (int): First year kept in the weather table.
+
+    Returns:
+        dict: Number of rows moved per year, None for a year whose rows kept arriving.
+    """
+    years = [row[0] for row in conn.execute(
+        "SELECT substr(update_datetime, 1, 4) FROM weather WHERE update_datetime < ?1 UNION "
+        "SELECT substr(update_datetime, 1, 4) FROM weather_hourly WHERE update_datetime < ?1 ORDER BY 1",
+        (f"{before:04d}",))]
+    return {year: archive_year(conn, year) for year in years}
+
+
+def downsample_year(conn, year, path):
+    """
+    Replaces the raw rows of an archived partition by one row per city and day holding the daily means,
+    and the hourly readings by one reading per city and day at midnight, and vacuums the partition file.
+    Only the partition file is rewritten.
+
+    Returns:
+        int: Number of rows and hourly readings left in the partition.
+    """
+    means = ', '.join(f"avg({metric})" for metric in ('temperature', 'humidity', 'wind_speed', 'precipitation'))
+    shard = sqlite3.connect(path)
+    try:
+        hourly = has_hourly(shard, 'main')
+        with shard:
+            shard.execute(f"CREATE TEMP TABLE daily AS SELECT min(id) AS id, city, max(country), max(latitude), "
+                          f"max(longitude), {means}, update_date, CAST(strftime('%s', update_date) AS INTEGER), "
+                          f"update_date FROM weather WHERE update_date IS NOT NULL GROUP BY city, update_date")
+            shard.execute("DELETE FROM weather")
+            shard.execute(f"INSERT INTO weather ({WEATHER_COLUMNS}) SELECT * FROM temp.daily")
+            shard.execute("DROP TABLE temp.daily")
+            if hourly:
+                shard.execute(f"CREATE TEMP TABLE hours AS SELECT city, substr(update_datetime, 1, 10) || ' 00:00', "
+                              f"{means} FROM weather_hourly GROUP BY city, substr(update_datetime, 1, 10)")
+                shard.execute("DELETE FROM weather_hourly")
+                shard.execute("INSERT INTO weather_hourly SELECT * FROM temp.hours")
+                shard.execute("DROP TABLE temp.hours")
+        shard.execute("VACUUM")
+        count = shard.execute("SELECT (SELECT COUNT(*) FROM weather)" +
+                              (" + (SELECT COUNT(*) FROM weather_hourly)" if hourly else '')).fetchone()[0]
+    finally:
+        shard.close()
+    with conn:
+        conn.execute("UPDATE weather_partitions SET state='downsampled', rows=?, changed_at=datetime('now') "
+                     "WHERE year=?", (count, year))
+    return count
+
+
+def drop_year(conn, year, path):
+    """
+    Deletes the file of a partition. The year stays registered, its rollups still answer compare and
+    average and its readings are not fetched or stored again.
+    """
+    schema = f"p{year}"
+    if schema in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        conn.execute(f"DETACH DATABASE {schema}")
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with conn:
+        conn.execute("UPDATE weather_partitions SET state='dropped', rows=0, changed_at=datetime('now') "
+                     "WHERE year=?", (year,))
+
+
+def apply_retention(conn, downsample_before=None, drop_before=None):
+    """
+    Applies the retention policy to the partitions: the raw rows of the years before downsample_before are
+    downsampled to daily rows and the files of the years before drop_before are deleted.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        downsample_before (int): First year whose raw rows are kept, no downsampling when not given.
+        drop_before (int): First year whose partition file is kept, nothing dropped when not given.
+
+    Returns:
+        dict: The new state per changed year.
+    """
+    changed = {}
+    for year, path, state, _ in partitions(conn, READABLE):
+        if drop_before and int(year) < drop_before:
+            drop_year(conn, year, path)
+            changed[year] = 'dropped'
+        elif downsample_before and int(year) < downsample_before and state == 'archived':
+            downsample_year(conn, year, path)
+            changed[year] = 'downsampled'
+    return changed
+
+
+def closed_years(conn):
+    """
+    Returns the years whose readings are no longer written to the weather table.
+    """
+    return {row[0] for row in conn.execute("SELECT year FROM weather_partitions")}
+
+
+def default_before():
+    """
+    Returns the first year kept in the weather table by default: the current and the previous year.
+    """
+    return datetime.date.today().year - 1
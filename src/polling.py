@@ -0,0 +1,123 @@
+# Adaptive polling of the current conditions, following the update cadence of every city
+import threading
+import time
+
+
+class CityCadence:
+    """
+    What is known about the updates of one city: the last reading seen, when it was published and the
+    estimated seconds between two updates.
+    """
+
+    def __init__(self):
+        self.last_updated = None
+        self.last_epoch = None
+        self.cadence = None
+        self.misses = 0
+
+
+class AdaptivePolling:
+    """
+    Decides when to poll the current conditions of every city again. The API publishes a new reading every
+    few minutes (about 15 for weatherapi.com), so a poll is planned for grace seconds after the next update is
+    expected. When the reading has not changed yet, the delay doubles from grace seconds up to max_interval.
+    The cadence of a city is estimated from the publication times of the readings seen so far, until two
+    updates have been seen the polls back off the same way.
+
+    Args:
+        min_interval (float): Minimum seconds between two polls of a city.
+        max_interval (float): Maximum seconds between two polls of a city, bounds how stale a reading can get.
+        grace (float): Seconds after the expected update before polling, also the first backoff delay.
+    """
+
+    def __init__(self, min_interval=60.0, max_interval=900.0, grace=30.0):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.grace = grace
+        self.cities = {}
+        self.lock = threading.Lock()
+        self.stats = {'polls': 0, 'changed': 0, 'unchanged': 0, 'failed': 0}
+
+    def city(self, name):
+        cadence = self.cities.get(name)
+        if cadence is None:
+            cadence = self.cities[name] = CityCadence()
+        return cadence
+
+    def observe(self, name, last_updated, epoch=None, now=None):
+        """
+        Records the reading returned by a poll, called by the fetch workers before the reading is parsed.
+
+        Args:
+            name (str): City as polled.
+            last_updated (str): The last_updated value of the reading.
+            epoch (float): Publication time of the reading (last_updated_epoch), the time of the poll when
+                the API does not send it.
+            now (float): Current time, time.time() when not given.
+
+        Returns:
+            bool: True if the reading is new.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            city = self.city(name)
+            self.stats['polls'] += 1
+            if city.last_updated == last_updated:
+                city.misses += 1
+                self.stats['unchanged'] += 1
+                return False
+            self.stats['changed'] += 1
+        epoch = now if epoch is None else epoch
+        if city.last_epoch is not None and epoch > city.last_epoch:
+            interval = epoch - city.last_epoch
+            if city.cadence:
+                # An update missed in between shows up as a multiple of the cadence
+                interval /= max(1, round(interval / city.cadence))
+                city.cadence = 0.7 * city.cadence + 0.3 * interval
+            else:
+                city.cadence = interval
+        city.last_updated = last_updated
+        city.last_epoch = epoch
+        city.misses = 0
+        return True
+
+    def failed(self, name):
+        """
+        Records a failed poll, the next one is backed off like an unchanged reading.
+        """
+        with self.lock:
+            self.city(name).misses += 1
+            self.stats['polls'] += 1
+            self.stats['failed'] += 1
+
+    def next_delay(self, name, now=None):
+        """
+        Returns the seconds until the next poll of a city.
+
+        Args:
+            name (str): City as polled.
+            now (float): Current time, time.time() when not given.
+
+        Returns:
+            float: Seconds between min_interval and max_interval.
+        """
+        now = time.time() if now is None else now
+        city = self.city(name)
+        if city.cadence is None:
+            delay = self.grace * 2 ** min(city.misses, 30)
+        elif city.misses == 0:
+            delay = city.last_epoch + city.cadence + self.grace - now
+            if delay < self.min_interval:
+                # Published late or the clocks differ, check again soon
+                delay = self.grace
+        else:
+            delay = self.grace * 2 ** min(city.misses - 1, 30)
+        return min(self.max_interval, max(self.min_interval, delay))
+
+
+def reading_epoch(current):
+    """
+    Returns the publication time of a current.json reading, None if the API does not send last_updated_epoch.
+    """
+    epoch = current.get('last_updated_epoch')
+    return float(epoch) if isinstance(epoch, (int, float)) else None
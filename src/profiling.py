@@ -0,0 +1,160 @@
+# Optional profile of one CLI run: cProfile statistics of every thread and the time spent per phase
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+# Phases timed by the fetcher and the CLI, the seconds are summed over all threads
+PHASES = ('api', 'decode', 'parse', 'insert', 'query')
+
+# Profile of the running command, None when the run is not profiled
+active = None
+NOT_PROFILED = contextlib.nullcontext()
+
+
+class Profile:
+    """
+    Collects the cProfile statistics of the main thread and of every thread started during the run, and the
+    seconds and number of calls of every phase.
+
+    Args:
+        path (str): File of the cProfile statistics, the phase timings are written next to it with .json added.
+        command (str): Name of the profiled command.
+    """
+
+    def __init__(self, path, command):
+        self.path = path
+        self.command = command
+        self.phases = {phase: [0.0, 0] for phase in PHASES}
+        self.lock = threading.Lock()
+        self.profilers = []
+
+    def add(self, phase, seconds):
+        with self.lock:
+            totals = self.phases[phase]
+            totals[0] += seconds
+            totals[1] += 1
+
+    def profile_thread(self, frame, event, arg):
+        # Runs once at the first call of a new thread and replaces itself with a profiler of that thread
+        import cProfile
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        import cProfile
+        # CPU time of the interpreter startup, the imports and the parsing of the command line
+        self.startup = time.process_time()
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.started = time.perf_counter()
+        profiler = cProfile.Profile()
+        self.profilers.append(profiler)
+        threading.setprofile(self.profile_thread)
+        profiler.enable()
+
+    def stop(self):
+        """
+        Writes the merged cProfile statistics in the pstats format and the phase timings as JSON.
+
+        Returns:
+            dict: The phase timings written.
+        """
+        import pstats
+        self.profilers[0].disable()
+        threading.setprofile(None)
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            profilers = list(self.profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            # A thread that never returned to a profiled call has no statistics
+            try:
+                stats.add(profiler)
+            except TypeError:
+                pass
+        stats.dump_stats(self.path)
+        # Only the command name, the arguments hold the API key
+        summary = {'command': self.command, 'started_at': self.started_at,
+                   'wall_seconds': round(elapsed, 6), 'startup_cpu_seconds': round(self.startup, 6),
+                   'threads': len(profilers), 'profile': os.path.basename(self.path),
+                   'phases': {phase: {'seconds': round(seconds, 6), 'calls': calls}
+                              for phase, (seconds, calls) in self.phases.items()}}
+        with open(self.path + '.json', 'w') as output:
+            json.dump(summary, output, indent=2)
+        return summary
+
+
+def start(path, command, sample=1.0):
+    """
+    Starts profiling the current command for a fraction of the runs. The path may contain {pid} and {time}
+    so sampled runs of a scheduled command do not overwrite each other.
+
+    Args:
+        path (str): File of the cProfile statistics.
+        command (str): Name of the command.
+        sample (float): Fraction of the runs profiled, between 0 and 1.
+
+    Returns:
+        Profile: The started profile, None if this run is not sampled.
+    """
+    global active
+    import random
+    if sample < 1 and random.random() >= sample:
+        return None
+    path = path.format(pid=os.getpid(), time=time.strftime('%Y%m%dT%H%M%S'))
+    active = Profile(path, command)
+    active.start()
+    return active
+
+
+def stop():
+    """
+    Stops the profile started by start and writes it, printing a summary of the phases to stderr.
+    """
+    global active
+    if active is None:
+        return
+    profile, active = active, None
+    summary = profile.stop()
+    phases = ', '.join(f"{phase} {totals['seconds']:.3f}s ({totals['calls']} calls)"
+                       for phase, totals in summary['phases'].items() if totals['calls'])
+    print(f"Profile of {summary['command']} written to {profile.path} and {profile.path}.json: "
+          f"{summary['wall_seconds']:.3f}s, startup {summary['startup_cpu_seconds']:.3f}s CPU"
+          f"{', ' + phases if phases else ''}", file=sys.stderr)
+
+
+def phase(name):
+    """
+    Returns a context manager adding the time spent in it to a phase of the profile, a shared no-op when the
+    run is not profiled.
+    """
+    profile = active
+    return NOT_PROFILED if profile is None else PhaseTimer(profile, name)
+
+
+class PhaseTimer:
+    __slots__ = ('profile', 'name', 'started')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, time.perf_counter() - self.started)
+
+
+def record(name, seconds):
+    """
+    Adds seconds measured by the caller to a phase of the profile, when the run is profiled.
+    """
+    profile = active
+    if profile is not None:
+        profile.add(name, seconds)
@@ -0,0 +1,93 @@
+# Client of the query server, kept small because every CLI invocation imports it
+import json
+import os
+import socket
+import sqlite3
+from src import profiling
+from src.readings import LatestReading
+
+
+def default_socket(database):
+    """
+    Returns the Unix socket of the query server of a database, next to the database file.
+
+    Args:
+        database (str): Path of the SQLite database file.
+
+    Returns:
+        str: Path of the socket.
+    """
+    return database + '.sock'
+
+
+class QueryClient:
+    """
+    Sends the CLI queries to a running query server. When the server can not be reached the queries fall back
+    to a direct connection to the database, opened on first use.
+
+    Args:
+        path (str): Path of the Unix socket of the server.
+        database (str): Path of the SQLite database file used as fallback.
+        timeout (float): Seconds to wait for the server.
+    """
+
+    def __init__(self, path, database, timeout=1.0):
+        self.path = path
+        self.database = database
+        self.timeout = timeout
+        self.fallback = None
+
+    def direct(self):
+        """
+        Returns the direct queries, opening the database on first use.
+        """
+        if self.fallback is None:
+            from src.weather_db import connect
+            from src.weather_queries import DirectQueries
+            self.fallback = DirectQueries(connect(self.database))
+        return self.fallback
+
+    def request(self, query, **arguments):
+        """
+        Sends one request to the server.
+
+        Raises:
+            OSError: The server can not be reached.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(self.timeout)
+            client.connect(self.path)
+            client.sendall(json.dumps(dict(arguments, query=query)).encode() + b'\n')
+            response = b''
+            while not response.endswith(b'\n'):
+                chunk = client.recv(65536)
+                if not chunk:
+                    raise ConnectionError("The query server closed the connection")
+                response += chunk
+        response = json.loads(response)
+        if 'error' in response:
+            raise sqlite3.Error(response['error'])
+        return response['result']
+
+    def call(self, query, **arguments):
+        with profiling.phase('query'):
+            if self.fallback is None and os.path.exists(self.path):
+                try:
+                    return self.request(query, **arguments)
+                except OSError:
+                    pass
+            return getattr(self.direct(), query)(**arguments)
+
+    def latest(self, city):
+        row = self.call('latest', city=city)
+        return LatestReading._make(row) if row is not None else None
+
+    def average_since(self, city, days):
+        return self.call('average_since', city=city, days=days)
+
+    def month_average(self, city, month):
+        return self.call('month_average', city=city, month=month)
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.conn.close()
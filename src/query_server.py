@@ -0,0 +1,158 @@
+# Long running query server answering the CLI queries from an in-memory cache
+import datetime
+import json
+import os
+import socketserver
+import sqlite3
+import threading
+from src.query_client import default_socket
+from src.weather_db import connect
+from src.weather_queries import average_since, latest_row, month_average
+
+
+class QueryCache:
+    """
+    In-memory cache of the newest reading and of the averages of every city queried so far, kept in sync with
+    the database. Before every query the cache compares PRAGMA data_version with the value it last saw. When
+    another connection has committed since, the new rows are read by rowid to replace the newest readings.
+    The cities whose monthly rollups changed lose their cached averages, which are recomputed on their next
+    query, and their newest reading when no new row explains the change (rows updated, deleted or stored hourly).
+    The cached answers of the other cities are kept.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object, only used by the cache.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.averages = {}
+        self.data_version = None
+        self.last_id = conn.execute("SELECT coalesce(max(id), 0) FROM weather").fetchone()[0]
+        self.signatures = self.rollup_signatures()
+        self.stats = {'queries': 0, 'hits': 0, 'refreshes': 0}
+
+    def rollup_signatures(self):
+        """
+        Returns the totals of the monthly rollups of every city, which change with every row of the city that
+        is inserted, updated or deleted, in the weather table or the hourly readings.
+        """
+        rows = self.conn.execute("SELECT city, total(temperature_count), total(temperature_sum), "
+                                 "total(temperature_day_mean_sum), total(humidity_sum), total(wind_speed_sum) "
+                                 "FROM weather_monthly GROUP BY city")
+        return {city: signature for city, *signature in rows}
+
+    def refresh(self):
+        """
+        Applies the rows committed by other connections since the last query.
+        """
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        self.stats['refreshes'] += 1
+        rows = self.conn.execute("SELECT id, city, temperature, humidity, wind_speed, update_datetime, update_epoch "
+                                 "FROM weather WHERE id > ? ORDER BY id", (self.last_id,)).fetchall()
+        inserted = set()
+        for row_id, city, temperature, humidity, wind_speed, update_datetime, update_epoch in rows:
+            inserted.add(city)
+            cached = self.latest.get(city)
+            # Cities not cached yet are read on their first query, an older row does not replace the cached one
+            if cached is not None and (update_epoch or 0) >= cached[1]:
+                self.latest[city] = ((temperature, humidity, wind_speed, update_datetime), update_epoch or 0)
+            self.last_id = row_id
+        signatures = self.rollup_signatures()
+        changed = {city for city in signatures.keys() | self.signatures.keys()
+                   if signatures.get(city) != self.signatures.get(city)}
+        self.signatures = signatures
+        if not changed:
+            return
+        for city in changed - inserted:
+            self.latest.pop(city, None)
+        # The keys of the averages are (kind, city, ...)
+        self.averages = {key: value for key, value in self.averages.items() if key[1] not in changed}
+
+    def lookup(self, cache, key, query):
+        """
+        Returns a cached value, running the query on a miss.
+        """
+        with self.lock:
+            self.refresh()
+            self.stats['queries'] += 1
+            if key in cache:
+                self.stats['hits'] += 1
+                return cache[key]
+            value = query(self.conn.cursor())
+            cache[key] = value
+            return value
+
+    def query_latest(self, city):
+        def query(c):
+            row = latest_row(c, city)
+            return (row[:4], row[4] or 0) if row is not None else (None, -1)
+        return self.lookup(self.latest, city, query)[0]
+
+    def query_average_since(self, city, days):
+        # Rolling windows move with the calendar day
+        key = ('since', city, days, datetime.date.today())
+        return self.lookup(self.averages, key, lambda c: average_since(c, city, days))
+
+    def query_month_average(self, city, month):
+        return self.lookup(self.averages, ('month', city, month), lambda c: month_average(c, city, month))
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Answers one JSON request per line with one JSON response per line.
+    A request has a 'query' ('latest', 'average_since', 'month_average' or 'stats') and its arguments.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {'result': self.server.answer(request)}
+            except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class QueryServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Query server listening on a Unix socket, the database stays open and the answers are cached in memory.
+
+    Args:
+        database (str): Path of the SQLite database file.
+        path (str): Path of the Unix socket, next to the database when not given.
+    """
+    daemon_threads = True
+
+    def __init__(self, database, path=None):
+        self.database = database
+        self.path = path or default_socket(database)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        conn = connect(database)
+        conn.close()
+        # The handler threads share the connection, QueryCache serialises its use
+        self.cache = QueryCache(sqlite3.connect(database, check_same_thread=False))
+        super().__init__(self.path, QueryHandler)
+
+    def answer(self, request):
+        query = request['query']
+        if query == 'latest':
+            return self.cache.query_latest(request['city'])
+        if query == 'average_since':
+            return self.cache.query_average_since(request['city'], int(request['days']))
+        if query == 'month_average':
+            return self.cache.query_month_average(request['city'], request['month'])
+        if query == 'stats':
+            return dict(self.cache.stats)
+        raise ValueError(f"Unknown query: {query}")
+
+    def server_close(self):
+        super().server_close()
+        self.cache.conn.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,139 @@
+# Compact records of the weather readings shared by the fetchers, the writer, the insert path and the CLI
+from array import array
+from collections import namedtuple
+
+# Columns of a reading in the order of INSERT_WEATHER
+FIELDS = ('city', 'country', 'latitude', 'longitude', 'temperature', 'humidity', 'wind_speed', 'precipitation',
+          'update_datetime')
+# Columns kept in arrays of doubles by ReadingBatch, humidity is converted back to an integer by its column type
+NUMERIC_FIELDS = ('latitude', 'longitude', 'temperature', 'humidity', 'wind_speed', 'precipitation')
+
+
+class Reading(namedtuple('Reading', FIELDS)):
+    """
+    One weather reading. A tuple in the column order of INSERT_WEATHER without an instance dictionary, it is
+    bound to the insert statement as it is.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, weather_info):
+        """
+        Returns the reading of a dictionary with the keys of FIELDS, other keys are ignored.
+        """
+        return cls._make(map(weather_info.__getitem__, FIELDS))
+
+
+# Newest reading of a city as returned by the queries
+LatestReading = namedtuple('LatestReading', ['temperature', 'humidity', 'wind_speed', 'update_datetime'])
+
+# Record fetched for the city name given by the user, the API may answer with another location name
+Fetched = namedtuple('Fetched', ['query', 'record'])
+
+
+def as_reading(weather_info):
+    """
+    Returns a Reading for a reading or a dictionary containing weather information.
+    """
+    return Reading.from_dict(weather_info) if isinstance(weather_info, dict) else weather_info
+
+
+class ReadingBatch:
+    """
+    Many readings stored column by column, the coordinates and metrics in arrays of doubles and the names and
+    times in lists, instead of one tuple and six float objects per reading. Iterating gives Reading tuples.
+
+    Args:
+        readings (iterable): Readings to add.
+        hourly (bool): The readings are the hours of a history response and are stored in weather_hourly.
+    """
+    __slots__ = FIELDS + ('hourly',)
+
+    def __init__(self, readings=(), hourly=False):
+        self.hourly = hourly
+        self.city, self.country, self.update_datetime = [], [], []
+        for field in NUMERIC_FIELDS:
+            setattr(self, field, array('d'))
+        self.extend(readings)
+
+    def add(self, city, country, latitude, longitude, temperature, humidity, wind_speed, precipitation,
+            update_datetime):
+        """
+        Adds one reading given by its values in the order of FIELDS.
+        """
+        self.city.append(city)
+        self.country.append(country)
+        self.latitude.append(latitude)
+        self.longitude.append(longitude)
+        self.temperature.append(temperature)
+        self.humidity.append(humidity)
+        self.wind_speed.append(wind_speed)
+        self.precipitation.append(precipitation)
+        self.update_datetime.append(update_datetime)
+
+    def extend(self, readings):
+        for reading in readings:
+            self.add(*reading)
+
+    def __len__(self):
+        return len(self.city)
+
+    def __iter__(self):
+        return map(Reading, *(getattr(self, field) for field in FIELDS))
+
+    def hourly_rows(self):
+        """
+        Returns the rows of the weather_hourly table: city, update_datetime and the four metrics.
+        """
+        return zip(self.city, self.update_datetime, self.temperature, self.humidity, self.wind_speed,
+                   self.precipitation)
+
+
+def parse_current_weather(current_data):
+    """
+    Extracts the weather information from a current.json API response.
+
+    Args:
+        current_data (dict): Dictionary containing the current API response data.
+
+    Returns:
+        Reading: The current weather information.
+    """
+    location, current = current_data['location'], current_data['current']
+    return Reading(location['name'], location['country'], location['lat'], location['lon'], current['temp_c'],
+                   current['humidity'], current['wind_mph'], current['precip_mm'], current['last_updated'])
+
+
+def parse_historic_weather(historic_data):
+    """
+    Extracts the daily weather information from a history.json API response.
+
+    Args:
+        historic_data (dict): Dictionary containing the history API response data.
+
+    Returns:
+        Reading: The weather information of the requested day.
+    """
+    location, forecastday = historic_data['location'], historic_data['forecast']['forecastday'][0]
+    day = forecastday['day']
+    return Reading(location['name'], location['country'], location['lat'], location['lon'], day['avgtemp_c'],
+                   day['avghumidity'], day['maxwind_mph'], day['totalprecip_mm'], forecastday['date'])
+
+
+def parse_historic_hours(historic_data):
+    """
+    Extracts the hourly weather information of a history.json API response in one pass over its hours.
+
+    Args:
+        historic_data (dict): Dictionary containing the history API response data.
+
+    Returns:
+        ReadingBatch: The hourly readings of the requested day, stored in weather_hourly.
+    """
+    location = historic_data['location']
+    name, country, latitude, longitude = location['name'], location['country'], location['lat'], location['lon']
+    hours = ReadingBatch(hourly=True)
+    for hour in historic_data['forecast']['forecastday'][0]['hour']:
+        hours.add(name, country, latitude, longitude, hour['temp_c'], hour['humidity'], hour['wind_mph'],
+                  hour['precip_mm'], hour['time'])
+    return hours
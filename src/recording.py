@@ -0,0 +1,75 @@
+# Recording of weather API responses to a compressed file, replayed by the mock weather API
+import gzip
+import json
+import threading
+
+
+class Recorder:
+    """
+    Appends every response of the weather API to a gzip compressed file, one JSON line per response with the
+    endpoint, the city, the day, the status code and the body. The API key is not written.
+
+    Args:
+        path (str): File of the recording, appended to when it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def record(self, endpoint, params, status, data):
+        """
+        Writes one response.
+
+        Args:
+            endpoint (str): 'current', 'history' or 'current_bulk'.
+            params (dict): Parameters of the call.
+            status (int): Status code of the response.
+            data (dict): Decoded JSON body.
+        """
+        line = json.dumps({'endpoint': endpoint, 'q': params.get('q'), 'dt': params.get('dt'), 'status': status,
+                           'data': data}, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def replay_key(endpoint, city, date=None):
+    """
+    Returns the key of the recorded responses of a request: current responses by city, history responses by
+    city and day. Cities are matched case insensitively.
+    """
+    return (endpoint, city.lower()) if endpoint == 'current' else (endpoint, city.lower(), date or '')
+
+
+def load_recording(path):
+    """
+    Reads a recording into the responses of every request. The locations of a bulk response are split into
+    current responses of their cities.
+
+    Args:
+        path (str): File written by Recorder.
+
+    Returns:
+        dict: Per replay_key the list of (status code, body) recorded, in the order they were recorded.
+    """
+    responses = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry['endpoint'] == 'current_bulk':
+                for location in (entry['data'] or {}).get('bulk', []):
+                    query = location.get('query', {})
+                    if 'current' in query:
+                        body = {'location': query['location'], 'current': query['current']}
+                        responses.setdefault(replay_key('current', query['q']), []).append((200, body))
+            elif entry['q'] is not None:
+                key = replay_key(entry['endpoint'], entry['q'], entry['dt'])
+                responses.setdefault(key, []).append((entry['status'], entry['data']))
+    return responses
@@ -0,0 +1,134 @@
+# Persistent cache of weather API responses
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    On-disk cache of weather API responses, shared by all threads of a process. Entries are keyed on the
+    endpoint and the request parameters without the API key. Entries without a TTL never expire, the
+    least recently used entries are evicted once the cache holds more than max_entries responses. The access
+    times of cache hits are kept in memory and written in batches, before an eviction and when the cache closes,
+    so a hit does not wait for a write.
+
+    Args:
+        path (str): Path of the SQLite file holding the cache, ':memory:' for a temporary cache.
+        max_entries (int): Maximum number of cached responses.
+        current_ttl (float): Seconds a response of the current conditions stays valid.
+        flush_size (int): Number of access times of cache hits kept in memory before they are written.
+    """
+
+    def __init__(self, path='weather_cache.db', max_entries=100000, current_ttl=60.0, flush_size=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.current_ttl = current_ttl
+        self.flush_size = flush_size
+        # Access time per key of the cache hits not written yet
+        self.accessed = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # A lost cache entry only costs another API call, so there is no need to wait for the disk
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+                          "expires REAL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """
+        Builds the cache key of a request.
+
+        Args:
+            endpoint (str): The API endpoint URL.
+            params (dict): Dictionary containing the API parameters.
+
+        Returns:
+            str: The endpoint followed by the sorted parameters, without the API key.
+        """
+        return endpoint + '?' + '&'.join(f"{name}={value}" for name, value in sorted(params.items()) if name != 'key')
+
+    def get(self, endpoint, params):
+        """
+        Returns the cached response of a request.
+
+        Args:
+            endpoint (str): The API endpoint URL.
+            params (dict): Dictionary containing the API parameters.
+
+        Returns:
+            dict: The cached response data, None if there is no valid entry.
+        """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT payload, expires FROM responses WHERE key=?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                self.conn.execute("DELETE FROM responses WHERE key=?", (key,))
+                self.accessed.pop(key, None)
+                self.size -= 1
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.accessed[key] = now
+            if len(self.accessed) >= self.flush_size:
+                self.flush_accessed()
+                self.conn.commit()
+            self.stats['hits'] += 1
+        return json.loads(row[0])
+
+    def flush_accessed(self):
+        """
+        Writes the access times of the cache hits kept in memory, the caller holds the lock and commits.
+        """
+        if self.accessed:
+            self.conn.executemany("UPDATE responses SET accessed=? WHERE key=?",
+                                  [(accessed, key) for key, accessed in self.accessed.items()])
+            self.accessed.clear()
+
+    def put(self, endpoint, params, data, ttl=None):
+        """
+        Stores the response of a request and evicts the least recently used entries above max_entries.
+
+        Args:
+            endpoint (str): The API endpoint URL.
+            params (dict): Dictionary containing the API parameters.
+            data (dict): The response data.
+            ttl (float): Seconds the entry stays valid, None if it never expires.
+        """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        payload = json.dumps(data)
+        with self.lock:
+            self.accessed.pop(key, None)
+            updated = self.conn.execute("UPDATE responses SET payload=?, expires=?, accessed=? WHERE key=?",
+                                        (payload, expires, now, key)).rowcount
+            if not updated:
+                self.conn.execute("INSERT INTO responses (key, payload, expires, accessed) VALUES (?, ?, ?, ?)",
+                                  (key, payload, expires, now))
+                self.size += 1
+            if self.size > self.max_entries:
+                # The eviction order needs the access times of the recent hits
+                self.flush_accessed()
+                evicted = self.conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                                            "ORDER BY accessed LIMIT ?)", (self.size - self.max_entries,)).rowcount
+                self.size -= evicted
+                self.stats['evictions'] += evicted
+            self.conn.commit()
+
+    def close(self):
+        """
+        Writes the pending access times and closes the cache file.
+        """
+        with self.lock:
+            self.flush_accessed()
+            self.conn.commit()
+        self.conn.close()
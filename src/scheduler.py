@@ -0,0 +1,184 @@
+# Event driven scheduler for the recurring weather jobs
+import asyncio
+import heapq
+import inspect
+import itertools
+import random
+import signal
+from src import metrics
+
+
+class Job:
+    """
+    Recurring job of the scheduler.
+
+    Args:
+        name (str): Name used in the log messages.
+        interval (float): Seconds between two runs.
+        callback (callable): Function or coroutine function called without arguments.
+        jitter (float): Maximum random delay in seconds added to every run.
+    """
+
+    def __init__(self, name, interval, callback, jitter):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.jitter = jitter
+        self.slot = None
+        self.due = None
+        self.task = None
+        self.runs = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.lag = 0.0
+
+
+class Scheduler:
+    """
+    Runs recurring jobs on an asyncio event loop. The loop sleeps until the next job is due, every run
+    is started as its own task so a slow job does not delay the others, and a random jitter spreads
+    jobs with the same interval. A run is skipped while the previous run of the same job is still
+    going, and slots missed because the process was busy or suspended are coalesced into one run.
+    A job can move its own next run with reschedule, e.g. to poll just after the data is expected to change.
+
+    Args:
+        jitter (float): Default maximum random delay in seconds added to every run.
+    """
+
+    def __init__(self, jitter=0.0):
+        self.jitter = jitter
+        self.jobs = []
+        self.stop_event = None
+        self.wakeup = None
+        self.stopped = False
+        self.queue = []
+        self.order = itertools.count()
+
+    def every(self, interval, name, callback, jitter=None, first_run=0.0):
+        """
+        Adds a recurring job.
+
+        Args:
+            interval (float): Seconds between two runs.
+            name (str): Name used in the log messages.
+            callback (callable): Function or coroutine function called without arguments.
+            jitter (float): Maximum random delay of this job, the scheduler default when not given.
+            first_run (float): Seconds after the start of the scheduler at which the first run is due.
+
+        Returns:
+            Job: The added job.
+        """
+        job = Job(name, interval, callback, self.jitter if jitter is None else jitter)
+        job.slot = first_run
+        self.jobs.append(job)
+        return job
+
+    def stop(self):
+        """
+        Asks the scheduler to stop, running jobs are awaited before run returns.
+        """
+        self.stopped = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.wakeup.set()
+
+    def reschedule(self, job, delay):
+        """
+        Moves the next run of a job to the given number of seconds from now, plus its jitter, instead of the
+        next slot of its interval. Must be called from the event loop, e.g. by the job itself.
+
+        Args:
+            job (Job): Job returned by every.
+            delay (float): Seconds until the next run.
+        """
+        now = asyncio.get_running_loop().time()
+        job.slot = now + max(0.0, delay)
+        job.due = job.slot + random.uniform(0, job.jitter)
+        # The entry of the previous due time stays in the queue and is dropped when it comes up
+        heapq.heappush(self.queue, (job.due, next(self.order), job))
+        self.wakeup.set()
+
+    async def execute(self, job):
+        """
+        Runs a job once and reports its failure without stopping the scheduler.
+        """
+        try:
+            result = job.callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            metrics.SCHEDULER_RUNS.inc(outcome='failed')
+            metrics.log_event('job_failed', job=job.name, error=str(e))
+            print(f"An error occurred in job {job.name}:", e)
+
+    async def run(self, handle_signals=True):
+        """
+        Runs the jobs until stop is called or the process receives SIGTERM or SIGINT.
+
+        Args:
+            handle_signals (bool): Install SIGTERM and SIGINT handlers calling stop.
+        """
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        if self.stopped:
+            self.stop_event.set()
+        if handle_signals:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(signum, self.stop)
+                except (NotImplementedError, RuntimeError):
+                    pass
+        start = loop.time()
+        queue = self.queue
+        for job in self.jobs:
+            job.slot += start
+            job.due = job.slot + random.uniform(0, job.jitter)
+            heapq.heappush(queue, (job.due, next(self.order), job))
+        try:
+            while queue and not self.stop_event.is_set():
+                due, _, job = queue[0]
+                if due != job.due:
+                    # Replaced by reschedule
+                    heapq.heappop(queue)
+                    continue
+                delay = due - loop.time()
+                if delay > 0:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(queue)
+                now = loop.time()
+                if job.task is not None and not job.task.done():
+                    job.skipped += 1
+                    metrics.SCHEDULER_RUNS.inc(outcome='skipped')
+                    print(f"Skipping job {job.name}, the previous run is still going")
+                else:
+                    job.lag = now - due
+                    job.runs += 1
+                    metrics.SCHEDULER_RUNS.inc(outcome='started')
+                    metrics.SCHEDULER_LAG.observe(job.lag)
+                    metrics.log_event('job_run', job=job.name, lag=round(job.lag, 4))
+                    job.task = loop.create_task(self.execute(job))
+                # Move to the next slot, slots already in the past are coalesced into this run
+                job.slot += job.interval
+                if job.slot <= now:
+                    missed = int((now - job.slot) // job.interval) + 1
+                    job.slot += missed * job.interval
+                    job.coalesced += missed
+                    metrics.SCHEDULER_RUNS.inc(missed, outcome='coalesced')
+                job.due = job.slot + random.uniform(0, job.jitter)
+                heapq.heappush(queue, (job.due, next(self.order), job))
+        finally:
+            if handle_signals:
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    try:
+                        loop.remove_signal_handler(signum)
+                    except (NotImplementedError, RuntimeError):
+                        pass
+            running = [job.task for job in self.jobs if job.task is not None and not job.task.done()]
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
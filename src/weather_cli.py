@@ -1,92 +1,126 @@
 # CLI commands
 import click
+import os
 import sqlite3
 import datetime
+import functools
+from src import profiling, weather_db
+from src.weather_db import connect, DEFAULT_DATABASE
+from src.weather_queries import DirectQueries
 
 
 @click.group()
+@click.option('--database', envvar='WEATHER_DB', default=DEFAULT_DATABASE, show_default=True,
+              help='SQLite database file, also read from the WEATHER_DB environment variable.')
+@click.option('--socket', 'socket_path', envvar='WEATHER_SOCKET', default=None,
+              help='Unix socket of the query server, the database file followed by .sock when not given.')
+@click.option('--profile', 'profile_path', envvar='WEATHER_PROFILE', default=None, metavar='FILE',
+              help='Write a cProfile of the command to FILE in the pstats format and its time per phase to '
+                   'FILE.json, {pid} and {time} in FILE are replaced.')
+@click.option('--profile-sample', envvar='WEATHER_PROFILE_SAMPLE', type=click.FloatRange(0, 1), default=1.0,
+              show_default=True, help='Fraction of the runs profiled with --profile.')
 @click.pass_context
-def cli(ctx):
-    ctx.obj = sqlite3.connect('../weather_data.db')
-    pass
+def cli(ctx, database, socket_path, profile_path, profile_sample):
+    # Only the paths are kept, the command opens the database or asks the query server when it runs
+    ctx.obj = {'database': database, 'socket': socket_path}
+    if profile_path:
+        profiling.start(profile_path, ctx.invoked_subcommand, profile_sample)
+        ctx.call_on_close(profiling.stop)
+
+
+def pass_connection(command):
+    """
+    Passes the database connection as first argument of the command. The context object holds the database path
+    given to the group, the connection is opened when the command runs and closed when it ends. A connection
+    given as context object, e.g. by the tests, is used as is.
+    """
+    @click.pass_context
+    @functools.wraps(command)
+    def wrapper(ctx, *args, **kwargs):
+        conn = ctx.obj
+        if not isinstance(conn, sqlite3.Connection):
+            conn = connect((ctx.obj or {}).get('database') or DEFAULT_DATABASE)
+            ctx.call_on_close(conn.close)
+        return command(conn, *args, **kwargs)
+    return wrapper
+
+
+def pass_queries(command):
+    """
+    Passes the queries of latest, compare and average as first argument of the command. They are sent to the
+    query server when it is running and answered from the database otherwise, see QueryClient. A connection
+    given as context object is queried directly.
+    """
+    @click.pass_context
+    @functools.wraps(command)
+    def wrapper(ctx, *args, **kwargs):
+        if isinstance(ctx.obj, sqlite3.Connection):
+            queries = DirectQueries(ctx.obj)
+        else:
+            from src.query_client import QueryClient, default_socket
+            database = (ctx.obj or {}).get('database') or DEFAULT_DATABASE
+            queries = QueryClient((ctx.obj or {}).get('socket') or default_socket(database), database)
+            ctx.call_on_close(queries.close)
+        return command(queries, *args, **kwargs)
+    return wrapper
 
 
 @cli.command()
-@click.pass_obj
+@pass_queries
 @click.argument('city')
-def latest(conn, city):
+def latest(queries, city):
     """
     Retrieve the latest weather data for a given city.
 
     Args:
-        conn (sqlite3.Connection): SQLite database connection object.
+        queries (DirectQueries): Queries answered by the query server or the database.
         city (str): City for which weather data is to be retrieved.
 
     Returns:
         int: Return code (0 for success).
     """
     try:
-        c = conn.cursor()
-        # Retrieve latest weather data from database
-        c.execute("SELECT * FROM weather WHERE city=? ORDER BY update_datetime DESC LIMIT 1", (city,))
-        data = c.fetchone()
+        data = queries.latest(city)
         if data is None:
             print(f"No data available for {city}.")
         else:
             print(
-                f"Temperature: {data[5]}°C, Humidity: {data[6]}%, Wind Speed: {data[7]}m/s, update_datetime: {data[9]}")
+                f"Temperature: {data.temperature}°C, Humidity: {data.humidity}%, Wind Speed: {data.wind_speed}m/s, "
+                f"update_datetime: {data.update_datetime}")
         return 0
     except sqlite3.Error as e:
         print(f"An error occurred while querying the database: {e}")
 
 
 @cli.command()
-@click.pass_obj
+@pass_queries
 @click.argument('timeframe', type=click.Choice(['week', 'month', 'year']))
 @click.argument('city')
-def compare(conn, timeframe, city):
+def compare(queries, timeframe, city):
     """
     Compare the current weather data with average weather data for a given timeframe.
 
     Args:
-        conn (sqlite3.Connection): SQLite database connection object.
+        queries (DirectQueries): Queries answered by the query server or the database.
         timeframe (str): Timeframe for which average weather data is to be calculated ('week', 'month', or 'year').
         city (str): City for which weather data is to be compared.
 
     Returns:
         int: Return code (0 for success).
     """
-    global data, avg_temp
     try:
-        c = conn.cursor()
-
         # Calculate average temperature for specified timeframe
-        def query_builder(days):
-            try:
-                c.execute("SELECT AVG(group_avg_temp) from "
-                          "(SELECT AVG(temperature) AS group_avg_temp,strftime('%d', update_datetime) "
-                          " FROM weather WHERE city=?"
-                          "AND date(update_datetime) >=? "
-                          "group by strftime('%d', update_datetime)) ",
-                          (city, (datetime.date.today() - datetime.timedelta(days=days))))
-                return c.fetchone()
-            except sqlite3.Error as e:
-                print(f"An error occurred while querying the database: {e}")
-
-        if timeframe == 'week':
-            data = query_builder(7)
-        elif timeframe == 'month':
-            data = query_builder(30)
-        elif timeframe == 'year':
-            data = query_builder(365)
-        if data is not None:
-            avg_temp = data[0]
-        else:
+        avg_temp = queries.average_since(city, {'week': 7, 'month': 30, 'year': 365}[timeframe])
+        if avg_temp is None:
             print("No data found in the database.")
+            return 0
 
-        # Retrieve latest weather data from database
-        c.execute("SELECT temperature FROM weather WHERE city=? ORDER BY update_datetime DESC LIMIT 1", (city,))
-        current_temp = c.fetchone()[0]
+        # Retrieve latest weather data
+        data = queries.latest(city)
+        if data is None:
+            print(f"No data available for {city}.")
+            return 0
+        current_temp = data.temperature
 
         # Compare current temperature to average temperature
         if current_temp > avg_temp:
@@ -104,16 +138,16 @@ def compare(conn, timeframe, city):
 
 
 @cli.command()
-@click.pass_obj
+@pass_queries
 @click.argument('month')
 @click.argument('year')
 @click.argument('city')
-def average(conn, month, year, city):
+def average(queries, month, year, city):
     """
     Calculates and prints the average temperature for a given month and year in a specific city.
 
     Args:
-        conn (object): The database connection object
+        queries (DirectQueries): Queries answered by the query server or the database.
         month (str): The month for which to calculate the average temperature (format: MM)
         year (str): The year for which to calculate the average temperature (format: YYYY)
         city (str): The city for which to calculate the average temperature
@@ -125,23 +159,371 @@ def average(conn, month, year, city):
         sqlite3.Error: If an error occurs while querying the database
     """
     try:
-        c = conn.cursor()
-        c.execute("SELECT AVG(group_avg_temp) from "
-                  "(SELECT AVG(temperature) AS group_avg_temp,strftime('%d', update_datetime) "
-                  " FROM weather WHERE city=? AND "
-                  "strftime('%m',update_datetime)=? AND "
-                  "strftime('%Y',update_datetime)=? group by strftime('%d', update_datetime)) ",
-                  (city, month, year))
-        avg_temp = c.fetchone()[0]
+        first_day = datetime.date(int(year), int(month), 1)
+        avg_temp = queries.month_average(city, first_day.strftime('%Y-%m'))
         if avg_temp is None:
             print(f"No data available for {month}/{year}.")
         else:
             print(f"The average temperature for {month}/{year} was {avg_temp}°C.")
         return 0
+    except ValueError:
+        print(f"Invalid month or year: {month}/{year}.")
+    except sqlite3.Error as e:
+        print(f"An error occurred while querying the database: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.option('--city', default=None, help='Only rebuild the rollups of this city.')
+def rebuild_rollups(conn, city):
+    """
+    Rebuilds the daily and monthly rollup tables used by compare and average from the raw weather data.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        city (str): Optional city to rebuild, all cities when not given.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    try:
+        days = weather_db.rebuild_rollups(conn, city)
+        print(f"Rebuilt the rollups of {days} days.")
+        return 0
+    except sqlite3.Error as e:
+        print(f"An error occurred while rebuilding the rollups: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--full', is_flag=True, help='Export every row again instead of the rows newer than the last export.')
+@click.option('--chunk-size', default=10000, show_default=True, help='Maximum number of rows fetched and written at once.')
+def export(conn, directory, full, chunk_size):
+    """
+    Exports the weather table as columnar NumPy .npz files partitioned by city and month.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        directory (str): Export directory, later exports only add the rows inserted since.
+        full (bool): Export every row again.
+        chunk_size (int): Maximum number of rows fetched and written at once.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.columnar import export_weather
+    try:
+        written = export_weather(conn, directory, full, chunk_size)
+        print(f"Exported {written['rows']} rows into {written['files']} files in {directory}.")
+        return 0
+    except (sqlite3.Error, OSError) as e:
+        print(f"An error occurred while exporting the weather data: {e}")
+
+
+@cli.command('import')
+@pass_connection
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--on-conflict', type=click.Choice(['ignore', 'update']), default='ignore', show_default=True,
+              help='Keep or overwrite rows that are already stored.')
+def import_command(conn, directory, on_conflict):
+    """
+    Imports the columnar files written by export into the weather table.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        directory (str): Export directory.
+        on_conflict (str): Keep ('ignore') or overwrite ('update') rows that are already stored.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.columnar import import_weather
+    try:
+        counts = import_weather(conn, conn.cursor(), directory, on_conflict)
+        print(f"Imported {directory}: {counts['inserted']} inserted, {counts['updated']} updated, "
+              f"{counts['skipped']} skipped, {counts['failed']} failed.")
+        return 0
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"An error occurred while importing the weather data: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.option('--before', type=int, default=None,
+              help='First year kept in the weather table, the previous year when not given.')
+def archive(conn, before):
+    """
+    Moves the raw rows of the years before a given year out of the weather table into one partition file
+    per year. compare and average keep reading their rollups, latest, history, stats and export read the
+    partitions as well.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        before (int): First year kept in the weather table.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.partitions import archive as archive_years, default_before
+    try:
+        moved = archive_years(conn, before or default_before())
+        for year, count in moved.items():
+            if count is None:
+                print(f"{year}: rows kept arriving while archiving, run archive again.")
+            else:
+                print(f"Archived {year}: {count} rows.")
+        if not moved:
+            print("Nothing to archive.")
+        return 0
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"An error occurred while archiving the weather data: {e}")
+
+
+@cli.command('partitions')
+@pass_connection
+def list_partitions(conn):
+    """
+    Lists the yearly partitions with their state, number of rows and file size.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.partitions import partitions
+    rows = partitions(conn)
+    if not rows:
+        print("No partitions.")
+    for year, path, state, count in rows:
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        print(f"{year}  {state:<11}  {count:>10} rows  {size / 1e6:>9.1f} MB  {path}")
+    return 0
+
+
+@cli.command()
+@pass_connection
+@click.option('--downsample-before', type=int, default=None,
+              help='Replace the raw rows of the archived years before this year by daily means.')
+@click.option('--drop-before', type=int, default=None,
+              help='Delete the partition files of the years before this year, their rollups are kept.')
+def retention(conn, downsample_before, drop_before):
+    """
+    Applies a retention policy to the yearly partitions, only the partition files are rewritten or deleted.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        downsample_before (int): First year whose raw rows are kept.
+        drop_before (int): First year whose partition file is kept.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.partitions import apply_retention
+    try:
+        changed = apply_retention(conn, downsample_before, drop_before)
+        for year, state in changed.items():
+            print(f"{year}: {state}")
+        if not changed:
+            print("No partition changed.")
+        return 0
+    except (sqlite3.Error, OSError) as e:
+        print(f"An error occurred while applying the retention policy: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.option('--older-than', default=30, show_default=True, help='Number of days kept at full resolution.')
+@click.option('--resolution', type=click.Choice(['hour', 'day']), default='hour', show_default=True,
+              help='One row per city and hour or day for the older readings.')
+@click.option('--batch-size', default=5000, show_default=True, help='Number of readings per transaction.')
+@click.option('--city', 'cities', multiple=True, help='City to compact, can be repeated, all cities when not given.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per city, run again to resume.')
+@click.option('--enable-incremental-vacuum', is_flag=True,
+              help='Switch a database created without incremental vacuum over with one full VACUUM.')
+def compact(conn, older_than, resolution, batch_size, cities, max_batches, enable_incremental_vacuum):
+    """
+    Downsamples the readings older than some days to one row per city and hour or day, deletes the raw readings
+    in small transactions and returns the freed space with incremental vacuum. A compaction can be stopped and
+    resumes where it stopped. compare and average keep the values of the raw readings.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        older_than (int): Number of days kept at full resolution.
+        resolution (str): 'hour' or 'day'.
+        batch_size (int): Number of readings per transaction.
+        cities (tuple): Cities to compact, all when empty.
+        max_batches (int): Maximum number of batches per city.
+        enable_incremental_vacuum (bool): Switch the database to incremental vacuum first.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    from src.compaction import compact as compact_readings
+    try:
+        if enable_incremental_vacuum:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        totals = compact_readings(conn, older_than, resolution, batch_size, list(cities), max_batches)
+        print(f"Compacted {totals['cities']} cities in {totals['batches']} batches: "
+              f"{totals['removed']} readings removed.")
+        if totals['pages'] is None:
+            print("The database was created without incremental vacuum, the freed pages are reused but the file "
+                  "does not shrink. Run compact --enable-incremental-vacuum once to switch it over.")
+        else:
+            print(f"Freed {totals['pages']} pages.")
+        return 0
+    except sqlite3.Error as e:
+        print(f"An error occurred while compacting the weather data: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.argument('cities', nargs=-1, required=True)
+@click.option('--days', default=30, show_default=True, help='Number of days before today, when --start is not given.')
+@click.option('--start', default=None, help='First day of the window (YYYY-MM-DD).')
+@click.option('--end', default=None, help='Last day of the window (YYYY-MM-DD), today when not given.')
+@click.option('--metric', 'metrics', multiple=True, type=click.Choice(weather_db.METRICS),
+              help='Metric to summarize, can be repeated, all metrics when not given.')
+@click.option('--percentile', 'percentiles', multiple=True, type=click.FloatRange(0, 100), default=(50, 90, 95),
+              show_default=True, help='Percentile to compute, can be repeated.')
+@click.option('--resample', type=click.Choice(['day', 'week', 'month']), default=None,
+              help='Also print the mean of every metric per day, week or month.')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json']), default='table', show_default=True)
+@click.option('--from-export', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Read the readings from a columnar export directory instead of the database.')
+def stats(conn, cities, days, start, end, metrics, percentiles, resample, output_format, from_export):
+    """
+    Prints the count, min, max, mean, standard deviation and percentiles of every metric of one or more cities.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        cities (tuple): Cities to summarize.
+        days (int): Number of days before today, when start is not given.
+        start (str): First day of the window (YYYY-MM-DD).
+        end (str): Last day of the window (YYYY-MM-DD).
+        metrics (tuple): Metrics to summarize.
+        percentiles (tuple): Percentiles to compute.
+        resample (str): Optional resampling period ('day', 'week' or 'month').
+        output_format (str): 'table' or 'json'.
+        from_export (str): Optional columnar export directory to read instead of the database.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    import json
+    from src import weather_stats
+    metrics = list(metrics or weather_db.METRICS)
+    try:
+        end = end or datetime.date.today().isoformat()
+        start = start or (datetime.date.fromisoformat(end) - datetime.timedelta(days=days)).isoformat()
+        datetime.date.fromisoformat(start)
+    except ValueError:
+        print(f"Invalid window: {start} to {end}.")
+        return
+    try:
+        if from_export:
+            from src.columnar import read_columns
+            columns = read_columns(from_export, list(cities), start, end, ['update_datetime'] + metrics)
+            windows = weather_stats.window_from_columns(columns, cities, metrics)
+        else:
+            windows = weather_stats.load_window(conn, cities, start, end, metrics)
+        results = weather_stats.window_stats(windows, metrics, percentiles, resample)
+        if output_format == 'json':
+            print(json.dumps({'start': start, 'end': end, 'cities': results}, indent=2))
+        else:
+            print(weather_stats.format_table(results, metrics, percentiles))
+        return 0
+    except (sqlite3.Error, OSError) as e:
+        print(f"An error occurred while computing the statistics: {e}")
+
+
+@cli.command()
+@pass_connection
+@click.option('--city', 'cities', multiple=True, help='City to dump, can be repeated, all cities when not given.')
+@click.option('--start', default=None, help='First day (YYYY-MM-DD).')
+@click.option('--end', default=None, help='Last day (YYYY-MM-DD).')
+@click.option('--metric', 'metrics', multiple=True, type=click.Choice(weather_db.METRICS),
+              help='Metric to write, can be repeated, all metrics when not given.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+@click.option('--chunk-size', default=1000, show_default=True, help='Number of rows fetched and written at once.')
+def history(conn, cities, start, end, metrics, output_format, chunk_size):
+    """
+    Writes the readings of some cities and days to stdout as CSV or NDJSON, streamed in chunks.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        cities (tuple): Cities to dump, all cities when empty.
+        start (str): First day (YYYY-MM-DD).
+        end (str): Last day (YYYY-MM-DD).
+        metrics (tuple): Metrics to write, all metrics when empty.
+        output_format (str): 'csv' or 'ndjson'.
+        chunk_size (int): Number of rows fetched and written at once.
+
+    Returns:
+        int: Return code (0 for success).
+    """
+    import csv
+    import json
+    import sys
+    from src.weather_queries import stream_history
+    columns = ['city', 'update_datetime'] + list(metrics or weather_db.METRICS)
+    try:
+        for day in (start, end):
+            if day:
+                datetime.date.fromisoformat(day)
+    except ValueError:
+        print(f"Invalid date range: {start} to {end}.")
+        return
+    try:
+        chunks = stream_history(conn.cursor(), cities, start, end, columns[2:], chunk_size)
+        if output_format == 'csv':
+            writer = csv.writer(sys.stdout, lineterminator='\n')
+            writer.writerow(columns)
+            for rows in chunks:
+                writer.writerows(rows)
+        else:
+            for rows in chunks:
+                sys.stdout.write(''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows))
+        sys.stdout.flush()
+        return 0
+    except BrokenPipeError:
+        # The reader, e.g. head, stopped early; stdout is pointed at devnull so the exit does not fail to flush
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
     except sqlite3.Error as e:
         print(f"An error occurred while querying the database: {e}")
 
 
+cli.add_command(history, 'dump')
+
+
+@cli.command()
+@click.pass_obj
+def serve(obj):
+    """
+    Runs the query server answering latest, compare and average from memory until SIGTERM or Ctrl+C.
+
+    Args:
+        obj (dict): Database and socket paths given to the group.
+    """
+    import signal
+    import threading
+    from src.query_server import QueryServer
+    server = QueryServer(obj['database'], obj['socket'])
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Query server for {obj['database']} listening on {server.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print(f"Query server stopped after {server.cache.stats['queries']} queries "
+          f"({server.cache.stats['hits']} answered from memory)")
+
+
 if __name__ == '__main__':
     # Run CLI commands
     cli()
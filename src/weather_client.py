@@ -0,0 +1,252 @@
+# HTTP client for the weatherapi.com endpoints
+import datetime
+import random
+import threading
+import time
+from collections import namedtuple
+from src import metrics, profiling
+
+# API endpoint and parameters
+BASEURL = "http://api.weatherapi.com/v1"
+CURRENT_API = BASEURL + "/current.json"
+HISTORY_API = BASEURL + "/history.json"
+
+# Status codes worth retrying, everything else is returned to the caller as is
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Maximum number of locations of one bulk request
+BULK_LIMIT = 50
+
+ApiResponse = namedtuple('ApiResponse', ['data', 'status_code', 'latency', 'retries'])
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket used to keep concurrent API calls under a per-key rate limit.
+
+    Args:
+        rate (float): Number of tokens added to the bucket per second.
+        capacity (int): Maximum number of tokens the bucket can hold (burst size).
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and consumes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WeatherClient:
+    """
+    Client for the weather API sharing one pool of keep-alive connections between all threads.
+    Calls that fail with a connection error, a timeout, 429 or 5xx are retried with exponential
+    backoff and full jitter.
+
+    Args:
+        base_url (str): Base URL of the weather API.
+        timeout (float): Seconds to wait for the connection and for each read.
+        max_retries (int): Number of retries after the first attempt.
+        backoff (float): Base delay in seconds, doubled for every retry.
+        max_backoff (float): Upper bound of a single delay in seconds.
+        rate_limiter (TokenBucket): Optional rate limiter, can be shared with other clients of the same key.
+        pool_size (int): Maximum number of pooled connections kept per host.
+        cache (ResponseCache): Optional cache answering repeated requests without calling the API.
+        recorder (Recorder): Optional recorder writing every response received from the API to a file.
+    """
+
+    def __init__(self, base_url=BASEURL, timeout=10.0, max_retries=3, backoff=0.5, max_backoff=30.0,
+                 rate_limiter=None, pool_size=10, cache=None, recorder=None):
+        self.base_url = base_url
+        self.current_api = base_url + "/current.json"
+        self.history_api = base_url + "/history.json"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.recorder = recorder
+        # requests is imported on first use so the commands that never call the API start faster
+        import requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {'calls': 0, 'retries': 0, 'errors': 0, 'latency': 0.0}
+        self.lock = threading.Lock()
+        # Unknown until the first bulk request, bulk requests are not available on every subscription plan
+        self.bulk_supported = None
+
+    def retry_delay(self, attempt, response=None):
+        """
+        Returns the delay before the given retry, honouring a Retry-After header when the API sends one.
+        Both are capped at max_backoff so one response can not park a worker for an arbitrary time.
+
+        Args:
+            attempt (int): Number of the retry, starting at 0.
+            response (requests.Response): The response that is being retried, if any.
+
+        Returns:
+            float: Seconds to sleep before the retry.
+        """
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(self.max_backoff, float(response.headers['Retry-After']))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def cache_ttl(self, endpoint, params):
+        """
+        Returns how long a response may be cached, past days of the history never change.
+
+        Args:
+            endpoint (str): The API endpoint URL.
+            params (dict): Dictionary containing the API parameters.
+
+        Returns:
+            float: Seconds the response stays valid, None if it never expires.
+        """
+        if endpoint == self.history_api and params.get('dt', '') < datetime.date.today().isoformat():
+            return None
+        return self.cache.current_ttl
+
+    def request(self, endpoint, params, body=None):
+        """
+        Calls the endpoint with the given parameters, retrying transient failures.
+
+        Args:
+            endpoint (str): The API endpoint URL.
+            params (dict): Dictionary containing the API parameters.
+            body (dict): JSON body sent with a POST request instead of a GET, never cached.
+
+        Returns:
+            ApiResponse: The decoded JSON body (None if there is none), the status code (None if no response
+            was received), the latency in seconds including retries and the number of retries. A response
+            served from the cache has status code 200 and no retries.
+        """
+        import requests
+        started = time.perf_counter()
+        # current, history or current_bulk, the label of the endpoint in the metrics
+        name = endpoint.rsplit('/', 1)[-1].split('.')[0] + ('_bulk' if body is not None else '')
+        cache = self.cache if body is None else None
+        if cache is not None:
+            data = cache.get(endpoint, params)
+            if data is not None:
+                metrics.API_CACHE_HITS.inc(endpoint=name)
+                return ApiResponse(data, 200, time.perf_counter() - started, 0)
+        retries = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = None
+            try:
+                if body is None:
+                    response = self.session.get(endpoint, params=params, timeout=self.timeout)
+                else:
+                    response = self.session.post(endpoint, params=params, json=body, timeout=self.timeout)
+                error = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+            if not retryable or retries >= self.max_retries:
+                break
+            time.sleep(self.retry_delay(retries, response))
+            retries += 1
+
+        data = None
+        received = time.perf_counter()
+        profiling.record('api', received - started)
+        if response is not None:
+            try:
+                data = response.json()
+            except ValueError:
+                error = ValueError(f"Response is not JSON: {response.text[:100]!r}")
+            profiling.record('decode', time.perf_counter() - received)
+        if cache is not None and data is not None and response.status_code == 200:
+            cache.put(endpoint, params, data, self.cache_ttl(endpoint, params))
+        if self.recorder is not None and data is not None:
+            self.recorder.record(name, params, response.status_code, data)
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['retries'] += retries
+            self.stats['latency'] += latency
+            if error is not None or response.status_code >= 400:
+                self.stats['errors'] += 1
+        status = response.status_code if response is not None else None
+        metrics.API_REQUESTS.inc(endpoint=name, status=status if status is not None else 'none')
+        metrics.API_LATENCY.observe(latency, endpoint=name)
+        if retries:
+            metrics.API_RETRIES.inc(retries, endpoint=name)
+        if error is not None or status >= 400:
+            metrics.API_ERRORS.inc(endpoint=name)
+        metrics.log_event('api_call', endpoint=name, q=params.get('q'), dt=params.get('dt'), status=status,
+                          latency=round(latency, 4), retries=retries, error=str(error) if error else None)
+        if error is not None:
+            print(f"Error retrieving weather data: {error}, Status code: {status}")
+        return ApiResponse(data, status, latency, retries)
+
+    def current(self, city, api_key):
+        """
+        Calls current.json for the given city.
+
+        Args:
+            city (str): City name for which weather data is to be retrieved.
+            api_key (str): API key for accessing the weather API.
+
+        Returns:
+            ApiResponse: See request.
+        """
+        return self.request(self.current_api, {'q': city, 'key': api_key})
+
+    def history(self, city, api_key, date):
+        """
+        Calls history.json for the given city and day.
+
+        Args:
+            city (str): City name for which weather data is to be retrieved.
+            api_key (str): API key for accessing the weather API.
+            date (str): Day to retrieve in the format YYYY-MM-DD.
+
+        Returns:
+            ApiResponse: See request.
+        """
+        return self.request(self.history_api, {'q': city, 'key': api_key, 'dt': date})
+
+    def bulk_current(self, cities, api_key):
+        """
+        Calls current.json once for several cities with a bulk request. The custom_id of every location is
+        its index in the list.
+
+        Args:
+            cities (list): Up to BULK_LIMIT city names.
+            api_key (str): API key for accessing the weather API.
+
+        Returns:
+            ApiResponse: See request, the data holds one 'query' entry per location in its 'bulk' list.
+        """
+        body = {'locations': [{'q': city, 'custom_id': str(index)} for index, city in enumerate(cities)]}
+        return self.request(self.current_api, {'key': api_key, 'q': 'bulk'}, body)
+
+    def close(self):
+        """
+        Closes the pooled connections, the cache and the recording.
+        """
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.recorder is not None:
+            self.recorder.close()
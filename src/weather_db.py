@@ -0,0 +1,542 @@
+# SQLite connection and versioned schema migrations of the weather database
+import itertools
+import sqlite3
+import sys
+from src.readings import Fetched, ReadingBatch, as_reading
+
+# Database used when neither --database nor the WEATHER_DB environment variable is given
+DEFAULT_DATABASE = 'weather_data.db'
+
+# Metrics kept in the rollup tables, each with a count, sum, min and max column
+METRICS = ['temperature', 'humidity', 'wind_speed', 'precipitation']
+ROLLUP_COLUMNS = ', '.join(f"{metric}_{field}" for metric in METRICS for field in ('count', 'sum', 'min', 'max'))
+# The monthly rollups also keep the number of days and the sum of the daily means, compare and average
+# report the mean of the daily means
+MONTHLY_COLUMNS = ROLLUP_COLUMNS + ', ' + ', '.join(f"{metric}_{field}" for metric in METRICS
+                                                    for field in ('days', 'day_mean_sum'))
+
+
+def rollup_table(table, key):
+    """
+    Returns the CREATE TABLE statement of a rollup table.
+
+    Args:
+        table (str): Name of the rollup table.
+        key (str): Name of the time key column ('day' as YYYY-MM-DD or 'month' as YYYY-MM).
+
+    Returns:
+        str: SQL statement.
+    """
+    columns = ', '.join(f"{metric}_count INTEGER NOT NULL DEFAULT 0, {metric}_sum REAL NOT NULL DEFAULT 0, "
+                        f"{metric}_min REAL, {metric}_max REAL" for metric in METRICS)
+    return (f"CREATE TABLE IF NOT EXISTS {table} (city TEXT NOT NULL, {key} TEXT NOT NULL, {columns}, "
+            f"PRIMARY KEY (city, {key})) WITHOUT ROWID")
+
+
+def rollup_upsert(table, key, key_value):
+    """
+    Returns the statement adding the NEW row of a weather trigger to a rollup table.
+
+    Args:
+        table (str): Name of the rollup table.
+        key (str): Name of the time key column.
+        key_value (str): SQL expression of the time key of the NEW row.
+
+    Returns:
+        str: SQL statement.
+    """
+    values = ', '.join(f"NEW.{metric} IS NOT NULL, coalesce(NEW.{metric}, 0), NEW.{metric}, NEW.{metric}"
+                       for metric in METRICS)
+    updates = ', '.join(f"{metric}_count = {metric}_count + excluded.{metric}_count, "
+                        f"{metric}_sum = {metric}_sum + excluded.{metric}_sum, "
+                        f"{metric}_min = coalesce(min({metric}_min, excluded.{metric}_min), {metric}_min, "
+                        f"excluded.{metric}_min), "
+                        f"{metric}_max = coalesce(max({metric}_max, excluded.{metric}_max), {metric}_max, "
+                        f"excluded.{metric}_max)" for metric in METRICS)
+    return (f"INSERT INTO {table} (city, {key}, {ROLLUP_COLUMNS}) VALUES (NEW.city, {key_value}, {values}) "
+            f"ON CONFLICT (city, {key}) DO UPDATE SET {updates}")
+
+
+# Raw readings of the weather table and hourly readings of the weather_hourly table (migration 9), the
+# conditions on city and update_datetime are pushed down to the index of both tables
+RAW_READINGS = ("(SELECT city, update_datetime, update_date, temperature, humidity, wind_speed, precipitation "
+                "FROM weather UNION ALL SELECT city, update_datetime, substr(update_datetime, 1, 10), temperature, "
+                "humidity, wind_speed, precipitation FROM weather_hourly)")
+
+
+def hourly_readings(table='weather_hourly'):
+    """
+    Returns a subquery reading the hourly readings of a table with the columns of the weather table, NULL for
+    the id and the location, so they can be read together with raw weather rows. Conditions on city and
+    update_datetime still read a range of its primary key.
+
+    Args:
+        table (str): Name of the hourly table, may be qualified with the schema of an attached database.
+
+    Returns:
+        str: SQL subquery.
+    """
+    return (f"(SELECT NULL AS id, city, NULL AS country, NULL AS latitude, NULL AS longitude, temperature, "
+            f"humidity, wind_speed, precipitation, update_datetime, "
+            f"CAST(strftime('%s', update_datetime) AS INTEGER) AS update_epoch, "
+            f"substr(update_datetime, 1, 10) AS update_date FROM {table})")
+
+
+def daily_rollup_select(where, source='weather'):
+    """
+    Returns the query aggregating raw weather rows into daily rollup rows.
+
+    Args:
+        where (str): SQL condition selecting the raw rows.
+        source (str): Table or subquery of the raw rows, RAW_READINGS to include the hourly readings.
+
+    Returns:
+        str: SQL query.
+    """
+    aggregates = ', '.join(f"count({metric}), total({metric}), min({metric}), max({metric})" for metric in METRICS)
+    return (f"SELECT city, update_date, {aggregates} FROM {source} WHERE update_date IS NOT NULL AND {where} "
+            f"GROUP BY city, update_date")
+
+
+def monthly_rollup_select(where, day_means=True):
+    """
+    Returns the query aggregating daily rollup rows into monthly rollup rows.
+
+    Args:
+        where (str): SQL condition selecting the daily rollup rows.
+        day_means (bool): Also select the number of days and the sum of the daily means of every metric,
+            the columns added by migration 4.
+
+    Returns:
+        str: SQL query.
+    """
+    aggregates = ', '.join(f"sum({metric}_count), sum({metric}_sum), min({metric}_min), max({metric}_max)"
+                           for metric in METRICS)
+    if day_means:
+        aggregates += ', ' + ', '.join(f"sum({metric}_count > 0), total({metric}_sum / {metric}_count)"
+                                       for metric in METRICS)
+    return (f"SELECT city, substr(day, 1, 7), {aggregates} FROM weather_daily WHERE {where} "
+            f"GROUP BY city, substr(day, 1, 7)")
+
+
+def monthly_refresh(row, day_means=True, day=None):
+    """
+    Returns the statements recomputing the monthly rollup row of a changed weather row from the daily rollups.
+
+    Args:
+        row (str): 'OLD' or 'NEW'.
+        day_means (bool): See monthly_rollup_select.
+        day (str): SQL expression of the day of the row, its update_date when not given.
+
+    Returns:
+        str: SQL statements separated by semicolons.
+    """
+    month = f"substr({day or row + '.update_date'}, 1, 7)"
+    daily_month = f"city = {row}.city AND day BETWEEN {month} || '-01' AND {month} || '-31'"
+    columns = MONTHLY_COLUMNS if day_means else ROLLUP_COLUMNS
+    return (f"DELETE FROM weather_monthly WHERE city = {row}.city AND month = {month}; "
+            f"INSERT INTO weather_monthly (city, month, {columns}) {monthly_rollup_select(daily_month, day_means)};")
+
+
+def rollup_refresh(row, day_means=True, source='weather', day=None):
+    """
+    Returns the statements recomputing the day and month of a changed weather row from the raw data,
+    used when a row is updated or deleted and min/max can not be adjusted incrementally.
+
+    Args:
+        row (str): 'OLD' or 'NEW'.
+        day_means (bool): See monthly_rollup_select.
+        source (str): See daily_rollup_select.
+        day (str): SQL expression of the day of the row, its update_date when not given.
+
+    Returns:
+        str: SQL statements separated by semicolons.
+    """
+    day = day or f"{row}.update_date"
+    # Range of the (city, update_datetime) unique index, update_date has no index of its own
+    raw_day = f"city = {row}.city AND update_datetime >= {day} AND update_datetime < date({day}, '+1 day')"
+    return (f"DELETE FROM weather_daily WHERE city = {row}.city AND day = {day}; "
+            f"INSERT INTO weather_daily (city, day, {ROLLUP_COLUMNS}) {daily_rollup_select(raw_day, source)}; "
+            f"{monthly_refresh(row, day_means, day)}")
+
+
+def not_archived(row):
+    """
+    Returns the SQL condition true when the year of a weather trigger row has not been moved to a partition.
+    """
+    return f"NOT EXISTS (SELECT 1 FROM weather_partitions WHERE year = substr({row}.update_datetime, 1, 4))"
+
+
+def not_compacted(row):
+    """
+    Returns the SQL condition true when a weather trigger row is newer than the readings of its city already
+    downsampled by compact.
+    """
+    return (f"{row}.update_datetime >= coalesce((SELECT max(compacted_before) FROM weather_compaction "
+            f"WHERE city = {row}.city), '')")
+
+
+def rollup_triggers(day_means=True, partitions=False, compaction=False, hourly=False):
+    """
+    Returns the statements creating the triggers which keep the rollup tables up to date.
+
+    Args:
+        day_means (bool): Recompute the monthly row from the daily rows on every insert so it holds the
+            daily means (migration 4), instead of adding the raw reading to it (migration 3).
+        partitions (bool): Keep the rollups of the years moved to a partition when their rows leave the weather
+            table, and ignore new rows of those years (migration 6).
+        compaction (bool): Keep the rollups of the readings downsampled by compact, which are updated and
+            deleted in place of the raw readings (migration 7).
+        hourly (bool): Recompute a changed day from the raw and the hourly readings (migration 9).
+
+    Returns:
+        list: SQL statements.
+    """
+    if day_means:
+        insert_monthly = monthly_refresh('NEW')
+    else:
+        insert_monthly = rollup_upsert('weather_monthly', 'month', 'substr(NEW.update_date, 1, 7)') + ';'
+    conditions = ([not_archived('OLD')] if partitions else []) + ([not_compacted('OLD')] if compaction else [])
+    guard = f"WHEN {' AND '.join(conditions)} " if conditions else ""
+    source = RAW_READINGS if hourly else 'weather'
+    triggers = [f"CREATE TRIGGER IF NOT EXISTS weather_rollup_insert AFTER INSERT ON weather "
+                f"WHEN NEW.update_date IS NOT NULL BEGIN "
+                f"{rollup_upsert('weather_daily', 'day', 'NEW.update_date')}; {insert_monthly} END",
+                f"CREATE TRIGGER IF NOT EXISTS weather_rollup_update AFTER UPDATE ON weather {guard}BEGIN "
+                f"{rollup_refresh('OLD', day_means, source)} {rollup_refresh('NEW', day_means, source)} END",
+                f"CREATE TRIGGER IF NOT EXISTS weather_rollup_delete AFTER DELETE ON weather {guard}BEGIN "
+                f"{rollup_refresh('OLD', day_means, source)} END"]
+    if partitions:
+        # Archived years are read-only, a late reading would be counted twice in their rollups
+        triggers.append(f"CREATE TRIGGER IF NOT EXISTS weather_archived_insert BEFORE INSERT ON weather "
+                        f"WHEN NOT {not_archived('NEW')} BEGIN SELECT RAISE(IGNORE); END")
+    return triggers
+
+
+def hourly_triggers(compaction=False):
+    """
+    Returns the statements creating the triggers which add the hourly readings to the rollup tables, like the
+    readings of the weather table.
+
+    Args:
+        compaction (bool): Leave the rollups alone when a reading older than the compact progress of its city
+            is updated or deleted (migration 11).
+
+    Returns:
+        list: SQL statements.
+    """
+    new_day, old_day = "substr(NEW.update_datetime, 1, 10)", "substr(OLD.update_datetime, 1, 10)"
+    guard = ' AND '.join([not_archived('OLD')] + ([not_compacted('OLD')] if compaction else []))
+    return [f"CREATE TRIGGER IF NOT EXISTS weather_hourly_rollup_insert AFTER INSERT ON weather_hourly BEGIN "
+            f"{rollup_upsert('weather_daily', 'day', new_day)}; {monthly_refresh('NEW', day=new_day)} END",
+            f"CREATE TRIGGER IF NOT EXISTS weather_hourly_rollup_update AFTER UPDATE ON weather_hourly "
+            f"WHEN {guard} BEGIN {rollup_refresh('OLD', source=RAW_READINGS, day=old_day)} "
+            f"{rollup_refresh('NEW', source=RAW_READINGS, day=new_day)} END",
+            f"CREATE TRIGGER IF NOT EXISTS weather_hourly_rollup_delete AFTER DELETE ON weather_hourly "
+            f"WHEN {guard} BEGIN {rollup_refresh('OLD', source=RAW_READINGS, day=old_day)} END",
+            f"CREATE TRIGGER IF NOT EXISTS weather_hourly_archived_insert BEFORE INSERT ON weather_hourly "
+            f"WHEN NOT {not_archived('NEW')} BEGIN SELECT RAISE(IGNORE); END"]
+
+
+def hourly_table(name):
+    """
+    Returns the CREATE TABLE statement of a table holding hourly readings, the weather_hourly table itself
+    since migration 9 and the one of every partition.
+
+    Args:
+        name (str): Name of the table, may be qualified with the schema of an attached database.
+
+    Returns:
+        str: SQL statement.
+    """
+    return (f"CREATE TABLE IF NOT EXISTS {name} (city TEXT NOT NULL, update_datetime TEXT NOT NULL, "
+            f"temperature REAL, humidity INTEGER, wind_speed REAL, precipitation REAL, "
+            f"PRIMARY KEY (city, update_datetime)) WITHOUT ROWID")
+
+
+def weather_table(name, autoincrement=True):
+    """
+    Returns the CREATE TABLE statement of a table holding raw weather rows, the weather table itself since
+    migration 6 and the weather table of every partition.
+
+    Args:
+        name (str): Name of the table, may be qualified with the schema of an attached database.
+        autoincrement (bool): Never reuse the id of a deleted row, the rows moved to a partition keep their id
+            and the export and the query server read the new rows by id.
+
+    Returns:
+        str: SQL statement.
+    """
+    return (f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY{' AUTOINCREMENT' if autoincrement else ''}, "
+            f"city TEXT, country TEXT, latitude REAL, longitude REAL, temperature REAL, humidity INTEGER, "
+            f"wind_speed REAL, precipitation REAL, update_datetime TEXT, update_epoch INTEGER, update_date TEXT, "
+            f"CONSTRAINT ct UNIQUE (city, update_datetime))")
+
+
+# Columns of the raw weather rows in table order
+WEATHER_COLUMNS = ('id, city, country, latitude, longitude, temperature, humidity, wind_speed, precipitation, '
+                   'update_datetime, update_epoch, update_date')
+
+
+def rebuild_rollups(conn, city=None):
+    """
+    Rebuilds the daily and monthly rollup tables from the raw weather rows and the hourly readings. The days
+    downsampled by compact keep their daily rollups, computed from the readings before they were averaged,
+    and count in the rebuilt months.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        city (str): Optional city to rebuild, all cities when not given.
+
+    Returns:
+        int: Number of daily rollup rows written.
+    """
+    where, params = ("city = ?", (city,)) if city else ("1", ())
+    # The raw rows of the archived years are in their partitions, their rollups are kept as they are
+    live = "substr({}, 1, 4) NOT IN (SELECT year FROM weather_partitions)"
+    # Days before the compaction progress of their city, including a day compacted up to some hour
+    compacted = ("weather_daily.day < coalesce((SELECT max(compacted_before) FROM weather_compaction "
+                 "WHERE city = weather_daily.city), '')")
+    with conn:
+        conn.execute(f"DELETE FROM weather_daily WHERE {where} AND {live.format('day')} AND NOT {compacted}",
+                     params)
+        conn.execute(f"DELETE FROM weather_monthly WHERE {where} AND {live.format('month')}", params)
+        # The rollups of the compacted days are still there and are not replaced
+        days = conn.execute(f"INSERT OR IGNORE INTO weather_daily (city, day, {ROLLUP_COLUMNS}) "
+                            f"{daily_rollup_select(where, RAW_READINGS)}", params).rowcount
+        conn.execute(f"INSERT INTO weather_monthly (city, month, {MONTHLY_COLUMNS}) "
+                     f"{monthly_rollup_select(where + ' AND ' + live.format('day'))}", params)
+    return days
+
+
+# Ordered schema migrations, the version of a database is kept in PRAGMA user_version.
+# Databases created before the migrations existed have version 0 and already contain the weather table.
+MIGRATIONS = [
+    (1, "Create table to store weather data",
+     ['''CREATE TABLE IF NOT EXISTS weather
+             (id INTEGER PRIMARY KEY,
+              city TEXT,
+              country TEXT,
+              latitude REAL,
+              longitude REAL,
+              temperature REAL,
+              humidity INTEGER,
+              wind_speed REAL,
+              precipitation REAL,
+              update_datetime TEXT,
+              CONSTRAINT ct UNIQUE (city, update_datetime))''']),
+    (2, "Typed time columns and covering indexes for the city/time queries",
+     ["ALTER TABLE weather ADD COLUMN update_epoch INTEGER",
+      "ALTER TABLE weather ADD COLUMN update_date TEXT",
+      "UPDATE weather SET update_epoch = CAST(strftime('%s', update_datetime) AS INTEGER), "
+      "update_date = date(update_datetime)",
+      "CREATE INDEX IF NOT EXISTS weather_city_date ON weather (city, update_date, temperature)",
+      "CREATE INDEX IF NOT EXISTS weather_city_epoch ON weather (city, update_epoch)"]),
+    (3, "Daily and monthly rollup tables maintained by triggers",
+     [rollup_table('weather_daily', 'day'),
+      rollup_table('weather_monthly', 'month'),
+      *rollup_triggers(day_means=False),
+      f"INSERT INTO weather_daily (city, day, {ROLLUP_COLUMNS}) {daily_rollup_select('1')}",
+      f"INSERT INTO weather_monthly (city, month, {ROLLUP_COLUMNS}) {monthly_rollup_select('1', day_means=False)}"]),
+    (4, "Daily means in the monthly rollups, drop the covering index replaced by the rollups",
+     [*(f"ALTER TABLE weather_monthly ADD COLUMN {metric}_{field}" for metric in METRICS
+        for field in ('days INTEGER NOT NULL DEFAULT 0', 'day_mean_sum REAL NOT NULL DEFAULT 0')),
+      "DROP TRIGGER IF EXISTS weather_rollup_insert",
+      "DROP TRIGGER IF EXISTS weather_rollup_update",
+      "DROP TRIGGER IF EXISTS weather_rollup_delete",
+      *rollup_triggers(),
+      # compare and average read the rollups, the raw table only needs the unique and the latest index
+      "DROP INDEX IF EXISTS weather_city_date",
+      "DELETE FROM weather_monthly",
+      f"INSERT INTO weather_monthly (city, month, {MONTHLY_COLUMNS}) {monthly_rollup_select('1')}"]),
+    (5, "Location names returned by the API for the cities given to the fetcher",
+     ["CREATE TABLE IF NOT EXISTS city_names (query TEXT PRIMARY KEY COLLATE NOCASE, city TEXT NOT NULL) "
+      "WITHOUT ROWID"]),
+    (6, "Yearly partitions of the raw weather rows, ids are never reused",
+     ["CREATE TABLE IF NOT EXISTS weather_partitions (year TEXT PRIMARY KEY, path TEXT NOT NULL, "
+      "state TEXT NOT NULL, rows INTEGER NOT NULL DEFAULT 0, changed_at TEXT) WITHOUT ROWID",
+      "DROP TRIGGER IF EXISTS weather_rollup_insert",
+      "DROP TRIGGER IF EXISTS weather_rollup_update",
+      "DROP TRIGGER IF EXISTS weather_rollup_delete",
+      weather_table('weather_v6'),
+      f"INSERT INTO weather_v6 ({WEATHER_COLUMNS}) SELECT {WEATHER_COLUMNS} FROM weather",
+      "DROP TABLE weather",
+      "ALTER TABLE weather_v6 RENAME TO weather",
+      "CREATE INDEX IF NOT EXISTS weather_city_epoch ON weather (city, update_epoch)",
+      *rollup_triggers(partitions=True)]),
+    (7, "Progress of the compaction of old readings, whose rollups are kept",
+     ["CREATE TABLE IF NOT EXISTS weather_compaction (city TEXT NOT NULL, resolution TEXT NOT NULL, "
+      "compacted_before TEXT NOT NULL, removed INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (city, resolution)) "
+      "WITHOUT ROWID",
+      "DROP TRIGGER IF EXISTS weather_rollup_update",
+      "DROP TRIGGER IF EXISTS weather_rollup_delete",
+      *rollup_triggers(partitions=True, compaction=True)]),
+    (8, "High-water marks of the historic days synced per city",
+     ["CREATE TABLE IF NOT EXISTS sync_marks (query TEXT PRIMARY KEY COLLATE NOCASE, synced_from TEXT NOT NULL, "
+      "synced_through TEXT NOT NULL, synced_at TEXT) WITHOUT ROWID"]),
+    (9, "Hourly readings of the history API, included in the rollups",
+     [hourly_table('weather_hourly'),
+      "DROP TRIGGER IF EXISTS weather_rollup_update",
+      "DROP TRIGGER IF EXISTS weather_rollup_delete",
+      *rollup_triggers(partitions=True, compaction=True, hourly=True),
+      *hourly_triggers()]),
+    (10, "Days of the hourly readings in the order they were stored, read by the incremental export",
+     ["CREATE TABLE IF NOT EXISTS weather_hourly_days (id INTEGER PRIMARY KEY AUTOINCREMENT, city TEXT NOT NULL, "
+      "day TEXT NOT NULL, UNIQUE (city, day))",
+      "INSERT OR IGNORE INTO weather_hourly_days (city, day) "
+      "SELECT DISTINCT city, substr(update_datetime, 1, 10) FROM weather_hourly ORDER BY 1, 2",
+      "CREATE TRIGGER IF NOT EXISTS weather_hourly_day AFTER INSERT ON weather_hourly BEGIN "
+      "INSERT OR IGNORE INTO weather_hourly_days (city, day) VALUES (NEW.city, substr(NEW.update_datetime, 1, 10)); "
+      "END"]),
+    (11, "Compaction of the hourly readings, whose rollups are kept",
+     ["DROP TRIGGER IF EXISTS weather_hourly_rollup_update",
+      "DROP TRIGGER IF EXISTS weather_hourly_rollup_delete",
+      *hourly_triggers(compaction=True)]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """
+    Brings the database schema up to date by applying every pending migration in its own transaction.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+
+    Returns:
+        int: Schema version of the database after the migration.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {migration_version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"Migrated weather database to version {migration_version}: {description}", file=sys.stderr)
+        version = migration_version
+    return version
+
+
+def connect(path):
+    """
+    Opens the weather database in WAL mode and migrates it to the current schema.
+
+    Args:
+        path (str): Path of the SQLite database file, ':memory:' for a temporary database.
+
+    Returns:
+        sqlite3.Connection: SQLite database connection object.
+    """
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        # Only possible before the first table is created, compact then returns the freed pages in small steps
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets the CLI read while the fetcher writes and needs fewer fsyncs per commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    migrate(conn)
+    return conn
+
+
+# Insert statement shared by the single and bulk insert, bound to a Reading, the typed time columns are derived
+# from update_datetime
+INSERT_WEATHER = ("INSERT INTO weather (city,  country, latitude, longitude, temperature, humidity, wind_speed,"
+                  "precipitation, update_datetime, update_epoch, update_date)"
+                  "VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, CAST(strftime('%s', ?9) AS INTEGER), date(?9))")
+
+
+def weather_info_bulk_insert(weather_infos, conn, c, policy='ignore', flush_size=500):
+    """
+    Inserts many weather information records into the SQLite database with one executemany and one
+    transaction per batch of flush_size records, instead of one commit per record.
+
+    The location name of the records fetched for a query (Fetched) is remembered in the city_names table,
+    so the stored days of a city can be found under the name given by the user. The readings of an hourly
+    ReadingBatch are written into the weather_hourly table instead of the weather table, see
+    parse_historic_hours. The daily history row of their day is deleted in the same transaction, so the
+    rollups do not count the day twice.
+
+    Args:
+        weather_infos (iterable): Readings, ReadingBatch, Fetched records or dictionaries containing weather
+            information to be inserted, can be a generator.
+        conn (sqlite3.Connection): SQLite database connection object.
+        c (sqlite3.Cursor): SQLite database cursor object.
+        policy (str): 'ignore' keeps the stored row when (city, update_datetime) already exists,
+            'update' overwrites it with the new values.
+        flush_size (int): Number of records written per transaction.
+
+    Returns:
+        dict: Number of 'inserted', 'updated', 'skipped' and 'failed' rows.
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    weather_infos = iter(weather_infos)
+    while True:
+        batch = list(itertools.islice(weather_infos, max(1, flush_size)))
+        if not batch:
+            return counts
+        readings, hours, days, names = [], [], set(), set()
+        for record in batch:
+            query = None
+            if isinstance(record, Fetched):
+                query, record = record
+            if isinstance(record, ReadingBatch):
+                if record.hourly:
+                    hours.extend(record.hourly_rows())
+                    days.update(zip(record.city, (time[:10] for time in record.update_datetime)))
+                else:
+                    readings.extend(record)
+                city = record.city[0] if len(record) else None
+            else:
+                record = as_reading(record)
+                readings.append(record)
+                city = record.city
+            if query and city:
+                names.add((query, city))
+        try:
+            inserted, updated = 0, 0
+            if readings:
+                # rowcount only counts the rows changed by the statement itself, not by the rollup triggers
+                c.executemany(INSERT_WEATHER + " ON CONFLICT(city, update_datetime) DO NOTHING", readings)
+                inserted = c.rowcount
+            if policy == 'update' and inserted < len(readings):
+                # Rows inserted just above hold the same values and are therefore not counted as updated
+                c.executemany("UPDATE weather SET country=?2, latitude=?3, longitude=?4, temperature=?5, "
+                              "humidity=?6, wind_speed=?7, precipitation=?8 "
+                              "WHERE city=?1 AND update_datetime=?9 AND "
+                              "(country IS NOT ?2 OR latitude IS NOT ?3 OR longitude IS NOT ?4 "
+                              "OR temperature IS NOT ?5 OR humidity IS NOT ?6 "
+                              "OR wind_speed IS NOT ?7 OR precipitation IS NOT ?8)", readings)
+                updated = c.rowcount
+            if hours:
+                # Deleted first, the delete trigger recomputes the day from the hours already stored
+                c.executemany("DELETE FROM weather WHERE city=? AND update_datetime=?", days)
+                c.executemany("INSERT INTO weather_hourly (city, update_datetime, temperature, humidity, wind_speed, "
+                              "precipitation) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(city, update_datetime) DO NOTHING",
+                              hours)
+                inserted_hours = c.rowcount
+                inserted += inserted_hours
+                if policy == 'update' and inserted_hours < len(hours):
+                    c.executemany("UPDATE weather_hourly SET temperature=?3, humidity=?4, wind_speed=?5, "
+                                  "precipitation=?6 WHERE city=?1 AND update_datetime=?2 AND "
+                                  "(temperature IS NOT ?3 OR humidity IS NOT ?4 OR wind_speed IS NOT ?5 "
+                                  "OR precipitation IS NOT ?6)", hours)
+                    updated += c.rowcount
+            if names:
+                c.executemany("INSERT INTO city_names (query, city) VALUES (?, ?) "
+                              "ON CONFLICT(query) DO UPDATE SET city=excluded.city", names)
+            conn.commit()
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+            counts['skipped'] += len(readings) + len(hours) - inserted - updated
+        except sqlite3.Error as e:
+            print(f"Error inserting data into database: {e}")
+            conn.rollback()
+            counts['failed'] += len(readings) + len(hours)
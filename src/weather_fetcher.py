@@ -1,56 +1,85 @@
-import requests
 import sqlite3
-import schedule
 import datetime
 import time
 import click
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.weather_client import BASEURL, BULK_LIMIT, CURRENT_API, HISTORY_API, TokenBucket, WeatherClient
+from src.partitions import closed_years
+from src.weather_db import connect, DEFAULT_DATABASE, INSERT_WEATHER
+from src.response_cache import ResponseCache
+from src.readings import Fetched, as_reading, parse_current_weather, parse_historic_hours, parse_historic_weather
+from src.recording import Recorder
+from src.weather_writer import WeatherWriter
+from src import metrics, profiling
 
-# API endpoint and parameters
-BASEURL = "http://api.weatherapi.com/v1"
-CURRENT_API = BASEURL + "/current.json"
-HISTORY_API = BASEURL + "/history.json"
+# The database is opened by the commands, importing this module does not touch it.
+# asyncio and the scheduler are only imported by get-latest-weather.
 
-# Connect to SQLite database
-conn = sqlite3.connect('weather_data.db')
-c = conn.cursor()
+# Client used when the caller does not pass its own
+api_client = None
 
-# Create table to store weather data
-c.execute('''CREATE TABLE IF NOT EXISTS weather
-             (id INTEGER PRIMARY KEY, 
-              city TEXT, 
-              country TEXT,
-              latitude REAL,
-              longitude REAL,
-              temperature REAL, 
-              humidity INTEGER, 
-              wind_speed REAL, 
-              precipitation REAL,
-              update_datetime TEXT,                         
-              CONSTRAINT ct UNIQUE (city, update_datetime))''')
 
-
-def weather_api_call(endpoint, params):
+def weather_api_call(endpoint, params, client=None):
     """
      Calls the Weather API endpoint with the given parameters and returns the API response.
+     Transient failures are retried by the client, see WeatherClient.
 
      Args:
          endpoint (str): The API endpoint URL.
          params (dict): Dictionary containing the API parameters.
+         client (WeatherClient): Optional client, the shared module client is used when not given.
 
      Returns:
-         dict: Dictionary containing the API response data.
+         dict: Dictionary containing the API response data, None if no response could be retrieved.
      """
-    global response
-    try:
-        response = requests.get(endpoint, params=params)
-        data = response.json()
-        return data
-    except requests.exceptions.RequestException as e:
-        print(f"Error retrieving weather data: {e}, Status code: {response.status_code}")
-    except KeyError as e:
-        print(f"Error parsing API response: {e}")
-    finally:
-        print("Response received from API")
+    global api_client
+    if client is None:
+        if api_client is None:
+            api_client = WeatherClient()
+        client = api_client
+    data = client.request(endpoint, params).data
+    print("Response received from API")
+    return data
+
+
+def make_client(concurrency=4, rate_limit=None, base_url=BASEURL, timeout=10.0, max_retries=3, cache=None,
+                recorder=None):
+    """
+    Creates the client shared by all workers of a command.
+
+    Args:
+        concurrency (int): Number of workers, used as connection pool size and burst size of the rate limiter.
+        rate_limit (float): Optional maximum number of API calls per second for the API key.
+        base_url (str): Base URL of the weather API.
+        timeout (float): Seconds to wait for the connection and for each read.
+        max_retries (int): Number of retries of a failing call.
+        cache (ResponseCache): Optional response cache.
+        recorder (Recorder): Optional recorder of the API responses.
+
+    Returns:
+        WeatherClient: The client.
+    """
+    rate_limiter = TokenBucket(rate_limit, capacity=concurrency) if rate_limit else None
+    return WeatherClient(base_url, timeout=timeout, max_retries=max_retries, rate_limiter=rate_limiter,
+                         pool_size=concurrency, cache=cache, recorder=recorder)
+
+
+def read_cities(cities, cities_file=None):
+    """
+    Builds the list of cities from the command line arguments and an optional file.
+
+    Args:
+        cities (tuple): City names given as arguments.
+        cities_file (file): Optional file with one city per line, blank lines and lines starting with # are ignored.
+
+    Returns:
+        list: City names without duplicates, in the order they were given.
+    """
+    names = list(cities)
+    if cities_file is not None:
+        names += [line.strip() for line in cities_file if line.strip() and not line.strip().startswith('#')]
+    return list(dict.fromkeys(names))
 
 
 def weather_info_insert(weather_info, conn, c):
@@ -58,85 +87,721 @@ def weather_info_insert(weather_info, conn, c):
     Inserts weather information into the SQLite database.
 
     Args:
-        weather_info (dict): Dictionary containing weather information to be inserted.
+        weather_info (Reading): Reading to be inserted, or a dictionary containing weather information.
         conn (sqlite3.Connection): SQLite database connection object.
         c (sqlite3.Cursor): SQLite database cursor object.
     """
+    started = time.perf_counter()
+    result = 'failed'
     try:
-        c.execute("INSERT INTO weather (city,  country, latitude, longitude, temperature, humidity, wind_speed,"
-                  "precipitation, update_datetime)"
-                  "VALUES (:city, :country, :latitude, :longitude, :temperature, :humidity, :wind_speed,"
-                  ":precipitation, :update_datetime)", weather_info)
+        c.execute(INSERT_WEATHER, as_reading(weather_info))
         conn.commit()
+        result = 'inserted'
     except sqlite3.IntegrityError:
         print(f"Database already up to date with latest information")
         conn.rollback()
+        result = 'skipped'
     except sqlite3.Error as e:
         print(f"Error inserting data into database: {e}")
         conn.rollback()
     except Exception as e:
         print(f"Error: {e}")
+    metrics.ROWS.inc(result=result)
+    metrics.COMMIT_LATENCY.observe(time.perf_counter() - started)
+
+
+def fetch_historic_day(city, api_key, date, client=None, hourly=False):
+    """
+    Retrieves and parses the historic weather data of a single day.
+
+    Args:
+        city (str): City name for which historic weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        date (str): Day to retrieve in the format YYYY-MM-DD.
+        client (WeatherClient): Optional client shared by all concurrent callers.
+        hourly (bool): Keep the 24 hourly readings of the day instead of the daily aggregates.
+
+    Returns:
+        Fetched: The Reading of the day, or the ReadingBatch of its hours, with the query it was requested with,
+        None if the day could not be retrieved.
+    """
+    params = {'q': city, 'key': api_key, 'dt': date}
+    historic_data = weather_api_call(client.history_api if client else HISTORY_API, params, client)
+    try:
+        with profiling.phase('parse'):
+            historic_weather_info = (parse_historic_hours if hourly else parse_historic_weather)(historic_data)
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Error parsing historic weather data for {city} city and date {date}: {e}")
+        return None
+    # The API answers with its own location name, the query lets later runs find the stored days
+    return Fetched(city, historic_weather_info)
+
+
+def fetch_current_weather(city, api_key, client=None):
+    """
+    Retrieves and parses the current weather data of a city.
+
+    Args:
+        city (str): City name for which weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        client (WeatherClient): Optional client shared by all concurrent callers.
+
+    Returns:
+        Reading: The current weather information, None if it could not be retrieved.
+    """
+    params = {'q': city, 'key': api_key}
+    current_data = weather_api_call(client.current_api if client else CURRENT_API, params, client)
+    try:
+        with profiling.phase('parse'):
+            return parse_current_weather(current_data)
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Error parsing current weather data for {city} city: {e}")
+        return None
+
+
+def read_current_weather(city, current_data, polling=None):
+    """
+    Parses a current.json reading of a city. With adaptive polling a reading with the same last_updated as
+    the previous poll of the city is recorded but not parsed.
+
+    Args:
+        city (str): City name the reading was requested for.
+        current_data (dict): current.json response, or the query entry of a bulk response.
+        polling (AdaptivePolling): Optional cadence of the cities, records the reading.
+
+    Returns:
+        tuple: 'changed', 'unchanged' or 'failed', and the weather information of a changed reading.
+    """
+    try:
+        if polling is not None:
+            from src.polling import reading_epoch
+            current = current_data['current']
+            if not polling.observe(city, current['last_updated'], reading_epoch(current)):
+                return 'unchanged', None
+        with profiling.phase('parse'):
+            return 'changed', parse_current_weather(current_data)
+    except (KeyError, IndexError, TypeError) as e:
+        if isinstance(current_data, dict) and 'error' in current_data:
+            e = current_data['error'].get('message', e)
+        print(f"Error parsing current weather data for {city} city: {e}")
+        if polling is not None:
+            polling.failed(city)
+        return 'failed', None
+
+
+def poll_current_weather(city, api_key, client, polling):
+    """
+    Retrieves the current weather of a city for the adaptive polling, see read_current_weather.
+
+    Args:
+        city (str): City name for which weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        client (WeatherClient): Client shared by all concurrent callers.
+        polling (AdaptivePolling): Cadence of the cities, records the reading.
+
+    Returns:
+        tuple: 'changed', 'unchanged' or 'failed', and the weather information of a changed reading.
+    """
+    current_data = weather_api_call(client.current_api, {'q': city, 'key': api_key}, client)
+    return read_current_weather(city, current_data, polling)
+
+
+def fetch_current_weather_batch(cities, api_key, client, polling=None):
+    """
+    Retrieves the current weather of several cities with one bulk request. When the API key has no access to
+    bulk requests, the cities are requested one after the other over the keep-alive connection of the client,
+    and later batches go straight to the single requests.
+
+    Args:
+        cities (list): Up to BULK_LIMIT city names.
+        api_key (str): API key for accessing the Weather API.
+        client (WeatherClient): Client shared by all concurrent callers.
+        polling (AdaptivePolling): Optional cadence of the cities, see read_current_weather.
+
+    Returns:
+        dict: Per city the result and the weather information, see read_current_weather.
+    """
+    if client.bulk_supported is not False:
+        response = client.bulk_current(cities, api_key)
+        entries = response.data.get('bulk') if isinstance(response.data, dict) else None
+        if isinstance(entries, list):
+            client.bulk_supported = True
+            queries = {}
+            for entry in entries:
+                query = entry.get('query') if isinstance(entry, dict) else None
+                if isinstance(query, dict):
+                    queries[query.get('custom_id')] = query
+            return {city: read_current_weather(city, queries.get(str(index)), polling)
+                    for index, city in enumerate(cities)}
+        if client.bulk_supported is None and response.status_code in (400, 401, 403, 404):
+            print("Bulk requests are not available for this API key, requesting the cities one by one")
+            client.bulk_supported = False
+    return {city: read_current_weather(city, weather_api_call(client.current_api, {'q': city, 'key': api_key},
+                                                              client), polling)
+            for city in cities}
+
+
+def resolve_city(c, city):
+    """
+    Returns the location name the API returned for a city given by the user, e.g. 'Frankfurt' for 'frankfurt'.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City name as given by the user.
+
+    Returns:
+        str: The stored location name, the given name if the city was never retrieved.
+    """
+    c.execute("SELECT city FROM city_names WHERE query=?", (city,))
+    row = c.fetchone()
+    return row[0] if row is not None else city
+
+
+def stored_days(c, city, dates, hourly=False):
+    """
+    Returns the days of the given list for which the daily or hourly historic weather of a city is already
+    stored.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City name as given by the user, looked up under the location name returned by the API.
+        dates (list): Sorted days in the format YYYY-MM-DD.
+        hourly (bool): Only count the days stored with their hourly readings, a daily history row is replaced
+            by the hours of its day.
+
+    Returns:
+        set: Days already stored, every day of an archived year counts as stored.
+    """
+    if not dates:
+        return set()
+    city = resolve_city(c, city)
+    stored = set()
+    if not hourly:
+        # Range scan of the (city, update_datetime) unique index, readings with a time are not daily history
+        c.execute("SELECT update_datetime FROM weather WHERE city=? AND update_datetime BETWEEN ? AND ?",
+                  (city, dates[0], dates[-1]))
+        stored.update(row[0] for row in c.fetchall())
+    # Days retrieved with their hourly readings, range of the (city, day) unique index
+    c.execute("SELECT day FROM weather_hourly_days WHERE city=? AND day BETWEEN ? AND ?",
+              (city, dates[0], dates[-1]))
+    stored.update(row[0] for row in c.fetchall())
+    closed = closed_years(c.connection)
+    return (stored | {date for date in dates if date[:4] in closed}) & set(dates)
+
+
+def backfill_cities(cities, api_key, days, c, writer, client=None, concurrency=4, skip_stored=True, hourly=False):
+    """
+    Retrieves the last days of historic weather data of many cities with one bounded pool of workers.
+    Every worker puts the days it retrieves on the queue of the writer, and is slowed down when the
+    writer falls behind. Days already stored are not requested again when skip_stored is set.
+    A failing day or city is reported and does not stop the rest of the batch.
+
+    Args:
+        cities (list): City names for which historic weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        days (int): Number of days of historic data to be retrieved.
+        c (sqlite3.Cursor): SQLite database cursor object used to look up the stored days.
+        writer (WeatherWriter): Started writer storing the retrieved days.
+        client (WeatherClient): Optional client shared by the workers, one is created when not given.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+        skip_stored (bool): Do not request the days already stored.
+        hourly (bool): Store the hourly readings of every day, see fetch_historic_day.
+
+    Returns:
+        dict: Per city dictionary with the number of 'stored' (before the run), 'retrieved' and 'failed' days.
+    """
+    dates = sync_window(days)
+    pending = {}
+    for city in cities:
+        stored = stored_days(c, city, dates, hourly) if skip_stored else set()
+        pending[city] = [date for date in dates if date not in stored]
+    return retrieve_days(pending, {city: len(dates) - len(pending[city]) for city in cities}, api_key, writer,
+                         client, concurrency, hourly)
+
+
+def retrieve_days(pending, stored, api_key, writer, client=None, concurrency=4, hourly=False):
+    """
+    Retrieves the given days of every city with one bounded pool of workers, see backfill_cities.
+
+    Args:
+        pending (dict): Per city the list of days to retrieve (YYYY-MM-DD).
+        stored (dict): Per city the number of days already stored, only reported.
+        api_key (str): API key for accessing the Weather API.
+        writer (WeatherWriter): Started writer storing the retrieved days.
+        client (WeatherClient): Optional client shared by the workers, one is created when not given.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+        hourly (bool): Store the hourly readings of every day, see fetch_historic_day.
+
+    Returns:
+        dict: Per city dictionary with the number of 'stored' (before the run), 'retrieved' and 'failed' days.
+    """
+    client = client or make_client(concurrency)
+    cities = list(pending)
+    progress = {city: {'stored': stored[city], 'retrieved': 0, 'failed': 0} for city in cities}
+    finished = 0
+    for city in cities:
+        if not pending[city]:
+            finished += 1
+            print(f"[{finished}/{len(cities)}] Nothing to retrieve for {city} city, all {stored[city]} days are stored")
+
+    def fetch_and_queue(city, date):
+        historic_weather_info = fetch_historic_day(city, api_key, date, client, hourly)
+        if historic_weather_info is not None:
+            writer.put(historic_weather_info)
+        return historic_weather_info is not None
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(fetch_and_queue, city, date): (city, date)
+                   for city in cities for date in pending[city]}
+        for future in as_completed(futures):
+            city, date = futures[future]
+            try:
+                retrieved = future.result()
+            except Exception as e:
+                print(f"Error retrieving historic weather data for {city} city and date {date}: {e}")
+                retrieved = False
+            progress[city]['retrieved' if retrieved else 'failed'] += 1
+            if progress[city]['retrieved'] + progress[city]['failed'] == len(pending[city]):
+                finished += 1
+                print(f"[{finished}/{len(cities)}] Finished {city} city: {progress[city]['retrieved']} days "
+                      f"retrieved, {progress[city]['failed']} days failed, {progress[city]['stored']} days "
+                      f"already stored")
+    return progress
+
+
+def sync_window(days):
+    """
+    Returns the last days before today in the format YYYY-MM-DD, oldest first.
+    """
+    today = datetime.date.today()
+    return [(today - datetime.timedelta(days=offset)).isoformat() for offset in range(days, 0, -1)]
+
+
+def next_day(day, step=1):
+    """
+    Returns the day a number of days after a day in the format YYYY-MM-DD.
+    """
+    return (datetime.date.fromisoformat(day) + datetime.timedelta(days=step)).isoformat()
+
+
+def gap_ranges(days):
+    """
+    Merges sorted days into ranges of consecutive days.
+
+    Args:
+        days (list): Sorted days in the format YYYY-MM-DD.
+
+    Returns:
+        list: Tuples of the first and the last day of every range.
+    """
+    ranges = []
+    for day in days:
+        if ranges and next_day(ranges[-1][1]) == day:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def sync_mark(c, city):
+    """
+    Returns the high-water mark of a city: the first and the last day of the days known to be stored without
+    a gap, None if the city was never synced.
+    """
+    c.execute("SELECT synced_from, synced_through FROM sync_marks WHERE query=?", (city,))
+    return c.fetchone()
+
+
+def unchecked_days(window, mark):
+    """
+    Returns the days of the window outside the high-water mark, as the runs of days before and after it.
+    """
+    if mark is None:
+        return [window]
+    return [[day for day in window if day < mark[0]], [day for day in window if day > mark[1]]]
+
+
+def plan_sync(c, cities, days, full=False, hourly=False):
+    """
+    Finds the missing days of every city in the last days. Only the days outside the high-water mark of a
+    city are looked up, with one range scan of the (city, update_datetime) index per run of days, so a
+    nightly sync only looks at the days added since the previous one.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        cities (list): City names as given by the user.
+        days (int): Number of days before today.
+        full (bool): Look up every day of the window, ignoring the high-water marks.
+        hourly (bool): Only days stored with their hourly readings count as stored. The high-water marks are
+            ignored, since they also cover the days stored as daily rows.
+
+    Returns:
+        dict: Per city the 'window', its 'mark', the number of days 'checked', the 'missing' days and their
+            'gaps' as ranges of consecutive days.
+    """
+    window = sync_window(days)
+    plan = {}
+    for city in cities:
+        mark = None if full or hourly else sync_mark(c, city)
+        runs = unchecked_days(window, mark)
+        missing = []
+        for run in runs:
+            stored = stored_days(c, city, run, hourly)
+            missing += [day for day in run if day not in stored]
+        missing.sort()
+        plan[city] = {'window': window, 'mark': mark, 'checked': sum(len(run) for run in runs),
+                      'missing': missing, 'gaps': gap_ranges(missing)}
+    return plan
+
+
+def advance_sync_mark(conn, city, window, mark, hourly=False):
+    """
+    Extends the high-water mark of a city over the days of the window stored without a gap next to it, or
+    sets it to the days stored from the start of the window. Called once the writer has committed the days.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        city (str): City name as given by the user.
+        window (list): Days of the sync, see sync_window.
+        mark (tuple): High-water mark before the sync, None if there was none.
+        hourly (bool): Only count the days stored with their hourly readings.
+
+    Returns:
+        tuple: The new high-water mark, None if the first day of the window is missing.
+    """
+    c = conn.cursor()
+    stored = set()
+    for run in unchecked_days(window, mark):
+        stored |= stored_days(c, city, run, hourly)
+    if mark is not None and (mark[1] < next_day(window[0], -1) or mark[0] > next_day(window[-1])):
+        # Synced too long ago to touch the window, the mark starts again from the window
+        mark = None
+    first, last = mark if mark is not None else (window[0], next_day(window[0], -1))
+    if mark is None and window[0] not in stored:
+        return None
+    while next_day(last) in stored:
+        last = next_day(last)
+    while next_day(first, -1) in stored:
+        first = next_day(first, -1)
+    with conn:
+        conn.execute("INSERT INTO sync_marks (query, synced_from, synced_through, synced_at) "
+                     "VALUES (?, ?, ?, datetime('now')) ON CONFLICT (query) DO UPDATE SET "
+                     "synced_from=excluded.synced_from, synced_through=excluded.synced_through, "
+                     "synced_at=excluded.synced_at", (city, first, last))
+    return first, last
+
+
+def backfill_historic_weather(city, api_key, days, c, writer, client=None, concurrency=4):
+    """
+    Retrieves the last days of historic weather data of a single city, see backfill_cities.
+
+    Args:
+        city (str): City name for which historic weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        days (int): Number of days of historic data to be retrieved.
+        c (sqlite3.Cursor): SQLite database cursor object used to look up the stored days.
+        writer (WeatherWriter): Started writer storing the retrieved days.
+        client (WeatherClient): Optional client shared by the workers.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+
+    Returns:
+        int: Number of days retrieved from the API.
+    """
+    return backfill_cities([city], api_key, days, c, writer, client, concurrency)[city]['retrieved']
+
+
+async def run_latest_weather(cities, api_key, frequency, writer, client, scheduler, concurrency=4, polling=None,
+                             batch_size=1):
+    """
+    Polls the current weather of every city, or of every batch of cities, as its own scheduler job. The fetches
+    run in a pool of worker threads which put the readings on the queue of the writer. With adaptive polling
+    every job moves its next run to just after the earliest expected update of its cities, and unchanged
+    readings are not written.
+
+    Args:
+        cities (list): City names for which weather data is to be retrieved.
+        api_key (str): API key for accessing the weather API.
+        frequency (float): Minutes between two updates of a city.
+        writer (WeatherWriter): Started writer storing the readings.
+        client (WeatherClient): Client shared by all workers.
+        scheduler (Scheduler): Scheduler running the jobs, stop it to end the polling.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+        polling (AdaptivePolling): Optional adaptive polling, frequency is then the longest time between two polls.
+        batch_size (int): Number of cities requested together, see fetch_current_weather_batch.
+
+    Returns:
+        dict: Number of 'retrieved', 'unchanged' and 'failed' updates.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    totals = {'retrieved': 0, 'unchanged': 0, 'failed': 0}
+    jobs = {}
+
+    def fetch_and_queue(batch):
+        if len(batch) > 1:
+            results = fetch_current_weather_batch(batch, api_key, client, polling)
+        elif polling is not None:
+            results = {batch[0]: poll_current_weather(batch[0], api_key, client, polling)}
+        else:
+            current_weather_info = fetch_current_weather(batch[0], api_key, client)
+            results = {batch[0]: ('failed' if current_weather_info is None else 'changed', current_weather_info)}
+        for result, current_weather_info in results.values():
+            if current_weather_info is not None:
+                writer.put(current_weather_info)
+        return results
+
+    async def poll(batch):
+        results = await loop.run_in_executor(executor, fetch_and_queue, batch)
+        for city, (result, _) in results.items():
+            metrics.POLLS.inc(result=result)
+            if result == 'changed':
+                totals['retrieved'] += 1
+            elif result == 'unchanged':
+                totals['unchanged'] += 1
+            else:
+                totals['failed'] += 1
+                print(f"Failed to update the latest weather for {city} city")
+        if polling is not None:
+            scheduler.reschedule(jobs[batch[0]], min(polling.next_delay(city) for city in batch))
+
+    batch_size = max(1, min(batch_size, BULK_LIMIT))
+    for start in range(0, len(cities), batch_size):
+        batch = cities[start:start + batch_size]
+        name = batch[0] if len(batch) == 1 else f"{batch[0]} and {len(batch) - 1} more cities"
+        jobs[batch[0]] = scheduler.every(frequency * 60, name, functools.partial(poll, batch))
+    try:
+        await scheduler.run()
+    finally:
+        executor.shutdown(wait=True)
+    return totals
+
+
+def print_writer_metrics(writer):
+    """
+    Prints the insert counts and the batch statistics of a closed writer.
+    """
+    metrics = writer.metrics()
+    print(f"Database writes: {metrics['inserted']} inserted, {metrics['updated']} updated, {metrics['skipped']} "
+          f"skipped, {metrics['failed']} failed in {metrics['batches']} batches (largest {metrics['max_batch_size']}, "
+          f"average commit {metrics['average_commit_latency'] * 1000:.1f} ms, max queue depth "
+          f"{metrics['max_queue_depth']}, {metrics['blocked_puts']} blocked puts)")
+
+
+def api_options(command):
+    """
+    Adds the options shared by all commands calling the weather API. The decorated command receives the
+    list of cities, the client built from the options and the concurrency instead of the raw options.
+    """
+    options = [click.option('--cities-file', type=click.File('r'), default=None, help='File with one city per line.'),
+               click.option('--concurrency', default=4, show_default=True, help='Maximum number of API calls in flight.'),
+               click.option('--rate-limit', type=float, default=None, help='Maximum number of API calls per second.'),
+               click.option('--base-url', default=BASEURL, show_default=True, help='Base URL of the weather API.'),
+               click.option('--timeout', default=10.0, show_default=True, help='Seconds to wait for the API.'),
+               click.option('--max-retries', default=3, show_default=True,
+                            help='Retries of a call failing with a connection error, timeout, 429 or 5xx.'),
+               click.option('--no-cache', is_flag=True, help='Always call the API instead of the response cache.'),
+               click.option('--cache-path', default='weather_cache.db', show_default=True,
+                            help='File of the response cache.'),
+               click.option('--cache-size', default=100000, show_default=True,
+                            help='Maximum number of cached responses.'),
+               click.option('--record', type=click.Path(dir_okay=False), default=None,
+                            help='Append every API response to this gzip file, replayed by the mock weather API.'),
+               click.option('--queue-size', default=10000, show_default=True,
+                            help='Maximum number of fetched records waiting for the database writer.')]
+
+    @functools.wraps(command)
+    def wrapper(cities, cities_file, concurrency, rate_limit, base_url, timeout, max_retries, no_cache, cache_path,
+                cache_size, record, **kwargs):
+        cities = read_cities(cities, cities_file)
+        if not cities:
+            raise click.UsageError("Give at least one city as argument or with --cities-file")
+        cache = None if no_cache else ResponseCache(cache_path, cache_size)
+        recorder = Recorder(record) if record else None
+        client = make_client(concurrency, rate_limit, base_url, timeout, max_retries, cache, recorder)
+        try:
+            return command(cities=cities, client=client, concurrency=concurrency, **kwargs)
+        finally:
+            client.close()
+
+    for option in reversed(options):
+        wrapper = option(wrapper)
+    return wrapper
 
 
 @click.group()
-def cli():
-    pass
+@click.option('--database', envvar='WEATHER_DB', default=DEFAULT_DATABASE, show_default=True,
+              help='SQLite database file, also read from the WEATHER_DB environment variable.')
+@click.option('--metrics-file', default=None,
+              help='Write the metrics in the Prometheus text format to this file, e.g. for the node exporter.')
+@click.option('--metrics-port', type=int, default=None, help='Serve the metrics on http://127.0.0.1:PORT/metrics.')
+@click.option('--metrics-interval', default=15.0, show_default=True, help='Seconds between two writes of --metrics-file.')
+@click.option('--log-json', is_flag=True, help='Write one JSON log line per API call, database batch and job run to stderr.')
+@click.option('--profile', 'profile_path', envvar='WEATHER_PROFILE', default=None, metavar='FILE',
+              help='Write a cProfile of the command to FILE in the pstats format and its time per phase to '
+                   'FILE.json, {pid} and {time} in FILE are replaced.')
+@click.option('--profile-sample', envvar='WEATHER_PROFILE_SAMPLE', type=click.FloatRange(0, 1), default=1.0,
+              show_default=True, help='Fraction of the runs profiled with --profile.')
+@click.pass_context
+def cli(ctx, database, metrics_file, metrics_port, metrics_interval, log_json, profile_path, profile_sample):
+    ctx.obj = database
+    if profile_path:
+        # Registered first so it is written last, after the writer and the metrics exporter have stopped
+        profiling.start(profile_path, ctx.invoked_subcommand, profile_sample)
+        ctx.call_on_close(profiling.stop)
+    if metrics_file or metrics_port is not None or log_json:
+        metrics.configure(metrics_file, metrics_port, metrics_interval, log_json)
+        ctx.call_on_close(metrics.shutdown)
 
 
 @cli.command()
-@click.argument('city')
+@click.argument('cities', nargs=-1)
 @click.argument('api_key')
 @click.argument('days', type=int)
-def get_historic_weather(city, api_key, days):
+@api_options
+@click.option('--on-conflict', type=click.Choice(['ignore', 'update']), default='ignore', show_default=True,
+              help='Keep or overwrite days that are already stored.')
+@click.option('--flush-size', default=500, show_default=True, help='Number of days written per transaction.')
+@click.option('--hourly', is_flag=True, help='Store the 24 hourly readings of every day instead of the daily means.')
+@click.pass_obj
+def get_historic_weather(database, cities, api_key, days, client, concurrency, queue_size, on_conflict, flush_size,
+                         hourly):
     """
-    Retrieves historic weather data from the Weather API for the given city and stores it in the SQLite database.
+    Retrieves historic weather data from the Weather API for the given cities and stores it in the SQLite database.
 
     Args:
-        city (str): City name for which historic weather data is to be retrieved.
+        database (str): Path of the SQLite database file.
+        cities (list): City names for which historic weather data is to be retrieved.
         api_key (str): API key for accessing the Weather API.
         days (int): Number of days of historic data to be retrieved.
+        client (WeatherClient): Client built from the API options.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+        queue_size (int): Maximum number of retrieved days waiting for the database writer.
+        on_conflict (str): Keep ('ignore') or overwrite ('update') days that are already stored.
+        flush_size (int): Number of days written per transaction.
+        hourly (bool): Store the hourly readings of every day.
     """
-    end_date = datetime.datetime.today()
-    start_date = end_date - datetime.timedelta(days=days)
-
-    """ Loop through each day in the month or year """
-    while start_date < end_date:
-        # Format the date in the required API parameter format
-        startdate = start_date.strftime('%Y-%m-%d')
-
-        params = {'q': city, 'key': api_key, 'dt': startdate}
-        print(f"Retrieving historic weather data from API for city: {city}")
-        historic_data = weather_api_call(HISTORY_API, params)
-        historic_weather_info = {'city': historic_data['location']['name'],
-                                 'country': historic_data['location']['country'],
-                                 'latitude': historic_data['location']['lat'],
-                                 'longitude': historic_data['location']['lon'],
-                                 'temperature': historic_data['forecast']['forecastday'][0]['day']['avgtemp_c'],
-                                 'humidity': historic_data['forecast']['forecastday'][0]['day']['avghumidity'],
-                                 'wind_speed': historic_data['forecast']['forecastday'][0]['day']['maxwind_mph'],
-                                 'precipitation': historic_data['forecast']['forecastday'][0]['day']['totalprecip_mm'],
-                                 'update_datetime': historic_data['forecast']['forecastday'][0]['date']}
-        print(f"historic weather data {historic_weather_info} for {city} city for date {startdate}")
-        print(f"Writing current weather information for {city} city into database")
-        weather_info_insert(historic_weather_info, conn, c)
-        print(f"Database updated successfully with the historic weather data for {city} city and date {startdate}")
-        # Move to the next day
-        start_date += datetime.timedelta(days=1)
-    print(f"Database updated successfully with the last {days} weather data for {city} city")
+    print(f"Retrieving historic weather data from API for {len(cities)} cities")
+    # This connection only looks up the stored days, the writer owns the connection writing the retrieved days
+    conn = connect(database)
+    writer = WeatherWriter(database, on_conflict, batch_size=flush_size, max_queue=queue_size).start()
+    try:
+        progress = backfill_cities(cities, api_key, days, conn.cursor(), writer, client, concurrency,
+                                   skip_stored=on_conflict != 'update', hourly=hourly)
+    finally:
+        writer.close()
+        conn.close()
+    failed = [city for city in cities if progress[city]['failed']]
+    print(f"Database updated successfully with the last {days} weather data for {len(cities) - len(failed)} cities")
+    print_writer_metrics(writer)
+    print(f"API calls: {client.stats['calls']}, retries: {client.stats['retries']}, errors: {client.stats['errors']}")
+    if client.cache is not None:
+        print(f"Cache hits: {client.cache.stats['hits']}, misses: {client.cache.stats['misses']}")
+    if failed:
+        print(f"Historic weather data is incomplete for cities: {', '.join(failed)}")
 
 
 @cli.command()
-@click.argument('city')
+@click.argument('cities', nargs=-1)
+@click.argument('api_key')
+@click.option('--days', type=click.IntRange(1), default=30, show_default=True,
+              help='Number of days before today to keep complete.')
+@api_options
+@click.option('--dry-run', is_flag=True, help='Only report the missing days of every city.')
+@click.option('--full', is_flag=True, help='Look up every day of the window again, ignoring the high-water marks.')
+@click.option('--flush-size', default=500, show_default=True, help='Number of days written per transaction.')
+@click.option('--hourly', is_flag=True, help='Store the 24 hourly readings of every day instead of the daily means.')
+@click.pass_obj
+def sync(database, cities, api_key, days, client, concurrency, queue_size, dry_run, full, flush_size, hourly):
+    """
+    Retrieves only the missing days of historic weather data of the given cities. The stored days are looked
+    up in the index, the missing ones merged into gaps of consecutive days, and only the gaps are requested.
+    The days stored without a gap are remembered as the high-water mark of every city, so the next sync only
+    looks at the days added since.
+
+    Args:
+        database (str): Path of the SQLite database file.
+        cities (list): City names for which historic weather data is to be retrieved.
+        api_key (str): API key for accessing the Weather API.
+        days (int): Number of days before today to keep complete.
+        client (WeatherClient): Client built from the API options.
+        concurrency (int): Maximum number of API calls in flight at the same time.
+        queue_size (int): Maximum number of retrieved days waiting for the database writer.
+        dry_run (bool): Only report the missing days.
+        full (bool): Ignore the high-water marks.
+        flush_size (int): Number of days written per transaction.
+        hourly (bool): Store the hourly readings of every day.
+    """
+    conn = connect(database)
+    try:
+        plan = plan_sync(conn.cursor(), cities, days, full, hourly)
+        for city, city_plan in plan.items():
+            gaps = ', '.join(first if first == last else f"{first}..{last}" for first, last in city_plan['gaps'])
+            print(f"{city}: {len(city_plan['missing'])} missing days in {len(city_plan['gaps'])} gaps, "
+                  f"{city_plan['checked']} days checked{': ' + gaps if gaps else ''}")
+        missing = sum(len(city_plan['missing']) for city_plan in plan.values())
+        print(f"{missing} missing days for {len(cities)} cities")
+        if dry_run:
+            return
+        if missing:
+            writer = WeatherWriter(database, batch_size=flush_size, max_queue=queue_size).start()
+            try:
+                retrieve_days({city: plan[city]['missing'] for city in cities},
+                              {city: plan[city]['checked'] - len(plan[city]['missing']) for city in cities},
+                              api_key, writer, client, concurrency, hourly)
+            finally:
+                writer.close()
+            print_writer_metrics(writer)
+            print(f"API calls: {client.stats['calls']}, retries: {client.stats['retries']}, "
+                  f"errors: {client.stats['errors']}")
+        incomplete = []
+        for city in cities:
+            mark = advance_sync_mark(conn, city, plan[city]['window'], plan[city]['mark'], hourly)
+            if mark is None or mark[0] > plan[city]['window'][0] or mark[1] < plan[city]['window'][-1]:
+                incomplete.append(city)
+        if incomplete:
+            print(f"Historic weather data is incomplete for cities: {', '.join(incomplete)}")
+    finally:
+        conn.close()
+
+
+@cli.command()
+@click.argument('cities', nargs=-1)
 @click.argument('api_key')
 @click.argument('frequency', type=int)
-def get_latest_weather(city, api_key, frequency):
+@api_options
+@click.option('--jitter', default=10.0, show_default=True,
+              help='Maximum random delay in seconds of every update, spreads the cities over time.')
+@click.option('--flush-interval', default=5.0, show_default=True,
+              help='Maximum seconds a fetched reading waits before it is written.')
+@click.option('--adaptive', is_flag=True,
+              help='Poll every city just after its next update is expected, FREQUENCY is then the longest interval.')
+@click.option('--min-interval', default=60.0, show_default=True,
+              help='Minimum seconds between two polls of a city with --adaptive.')
+@click.option('--grace', default=30.0, show_default=True,
+              help='Seconds after the expected update before polling with --adaptive, also the first backoff delay.')
+@click.option('--batch-size', type=click.IntRange(1, BULK_LIMIT), default=1, show_default=True,
+              help='Cities requested together with one bulk request, one by one when the API key has no bulk access.')
+@click.pass_obj
+def get_latest_weather(database, cities, api_key, frequency, client, concurrency, queue_size, jitter, flush_interval,
+                       adaptive, min_interval, grace, batch_size):
     """
-      Retrieve and store the latest weather data for a given city.
+      Retrieve and store the latest weather data for the given cities until SIGTERM or Ctrl+C.
 
       Args:
-          city (str): City name for which weather data is to be retrieved.
+          database (str): Path of the SQLite database file.
+          cities (list): City names for which weather data is to be retrieved.
           api_key (str): API key for accessing the weather API.
           frequency (int): Frequency in minutes at which to update the weather data.
+          client (WeatherClient): Client built from the API options.
+          concurrency (int): Maximum number of API calls in flight at the same time.
+          queue_size (int): Maximum number of readings waiting for the database writer.
+          jitter (float): Maximum random delay in seconds of every update.
+          flush_interval (float): Maximum seconds a fetched reading waits before it is written.
+          adaptive (bool): Follow the update cadence of every city instead of polling every frequency minutes.
+          min_interval (float): Minimum seconds between two polls of a city with adaptive polling.
+          grace (float): Seconds after the expected update before polling with adaptive polling.
+          batch_size (int): Number of cities requested together.
 
       Returns:
           None
@@ -144,52 +809,24 @@ def get_latest_weather(city, api_key, frequency):
       Raises:
           None
       """
-
-    def get_current_weather(city, api_key, c):
-        """
-        Retrieve the current weather data from the weather API and store it in the database.
-
-        Args:
-            city (str): City name for which weather data is to be retrieved.
-            api_key (str): API key for accessing the weather API.
-            c (sqlite3.Connection): SQLite3 database connection.
-
-        Returns:
-            None
-
-        Raises:
-            None
-        """
-        params = {'q': city, 'key': api_key}
-        current_data = weather_api_call(CURRENT_API, params)
-        print(f"Retrieving latest weather from API for city: {city}")
-        current_weather_info = {'city': current_data['location']['name'],
-                                'country': current_data['location']['country'],
-                                'latitude': current_data['location']['lat'],
-                                'longitude': current_data['location']['lon'],
-                                'temperature': current_data['current']['temp_c'],
-                                'humidity': current_data['current']['humidity'],
-                                'wind_speed': current_data['current']['wind_mph'],
-                                'precipitation': current_data['current']['precip_mm'],
-                                'update_datetime': current_data['current']['last_updated']}
-        print(f"current weather data {current_weather_info} for {city} city")
-        print(f"Writing current weather information for {city} city into database")
-        weather_info_insert(current_weather_info, c, conn)
-        print(f"Database updated successfully with the latest weather updates for {city} city")
-
-    get_current_weather(city, api_key, conn)
-    print(f"Starting the Scheduler to get weather updates for {city} city every {frequency} minutes")
-    schedule.every(frequency).minutes.do(get_current_weather, city, api_key, c)
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(30)
-            time_of_next_run = schedule.next_run()
-            time_now = datetime.datetime.now()
-            time_remaining = time_of_next_run - time_now
-            print(f"Time left to get the next update {time_remaining}")
-        except Exception as e:
-            print("An error occurred in process:", e)
+    print(f"Starting the Scheduler to get weather updates for {len(cities)} cities every {frequency} minutes")
+    import asyncio
+    from src.scheduler import Scheduler
+    scheduler = Scheduler(jitter)
+    polling = None
+    if adaptive:
+        from src.polling import AdaptivePolling
+        polling = AdaptivePolling(min_interval, frequency * 60, grace)
+    writer = WeatherWriter(database, max_delay=flush_interval, max_queue=queue_size).start()
+    try:
+        totals = asyncio.run(run_latest_weather(cities, api_key, frequency, writer, client, scheduler, concurrency,
+                                                polling, batch_size))
+    finally:
+        # Readings fetched before the shutdown are still written
+        writer.close()
+    print(f"Scheduler stopped after {totals['retrieved']} updates ({totals['unchanged']} unchanged readings not "
+          f"written, {totals['failed']} failed)")
+    print_writer_metrics(writer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,174 @@
+# Read queries of the weather CLI, shared by the direct SQLite path and the query server
+import datetime
+from src.partitions import READABLE, attached, has_hourly, partitions, source_groups, union_query
+from src.readings import LatestReading
+
+
+def latest_row(c, city):
+    """
+    Returns the newest reading of a city with its update_epoch, from the weather table or the hourly readings.
+    The archived years are older than every year of the weather table, so their partitions are only read for a
+    city without readings in the weather database.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City for which weather data is to be retrieved.
+
+    Returns:
+        tuple: Temperature, humidity, wind speed, update_datetime and update_epoch, None if the city has no data.
+    """
+    row = newest_row(c, 'main', city)
+    if row is None:
+        # Newest year first, one partition attached at a time
+        for year, path, _, _ in reversed(partitions(c.connection, READABLE)):
+            with attached(c.connection, [(year, path)]) as (schema,):
+                row = newest_row(c, schema, city)
+            if row is not None:
+                return row
+    return row
+
+
+def newest_row(c, schema, city):
+    """
+    Returns the newest reading of a city in the weather table and the hourly readings of one schema.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        schema (str): Schema of the main database or of an attached partition.
+        city (str): City for which weather data is to be retrieved.
+
+    Returns:
+        tuple: Temperature, humidity, wind speed, update_datetime and update_epoch, None if the city has no data.
+    """
+    rows = c.execute(f"SELECT temperature, humidity, wind_speed, update_datetime, update_epoch FROM {schema}.weather "
+                     f"WHERE city=? ORDER BY update_epoch DESC LIMIT 1", (city,)).fetchall()
+    row = rows[0] if rows else None
+    if has_hourly(c.connection, schema):
+        # Newest hour along the primary key, its epoch is computed like the one of the compacted readings
+        hours = c.execute(f"SELECT temperature, humidity, wind_speed, update_datetime, "
+                          f"CAST(strftime('%s', update_datetime) AS INTEGER) FROM {schema}.weather_hourly WHERE city=? "
+                          f"ORDER BY update_datetime DESC LIMIT 1", (city,)).fetchall()
+        if hours and (row is None or hours[0][4] > (row[4] or 0)):
+            row = hours[0]
+    return row
+
+
+def latest_reading(c, city):
+    """
+    Returns the newest reading of a city.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City for which weather data is to be retrieved.
+
+    Returns:
+        LatestReading: Temperature, humidity, wind speed and update_datetime, None if the city has no data.
+    """
+    row = latest_row(c, city)
+    return LatestReading._make(row[:4]) if row is not None else None
+
+
+def average_since(c, city, days):
+    """
+    Returns the mean of the daily average temperatures of the last days. The days of the first month are read
+    from the daily rollups and the following months from one monthly rollup row each.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City for which the average is calculated.
+        days (int): Number of days before today.
+
+    Returns:
+        float: The average temperature, None if there is no data in the timeframe.
+    """
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    next_month = (start.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+    c.execute("SELECT total(day_mean_sum) / total(days) FROM ("
+              "SELECT total(temperature_sum / temperature_count) AS day_mean_sum, "
+              "sum(temperature_count > 0) AS days FROM weather_daily WHERE city=? AND day >=? AND day <? "
+              "UNION ALL SELECT total(temperature_day_mean_sum), total(temperature_days) "
+              "FROM weather_monthly WHERE city=? AND month >=?)",
+              (city, start.isoformat(), next_month.isoformat(), city, next_month.strftime('%Y-%m')))
+    return c.fetchone()[0]
+
+
+def month_average(c, city, month):
+    """
+    Returns the mean of the daily average temperatures of a month, read from its single monthly rollup row.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        city (str): City for which the average is calculated.
+        month (str): Month in the format YYYY-MM.
+
+    Returns:
+        float: The average temperature, None if the month has no data.
+    """
+    c.execute("SELECT temperature_day_mean_sum / temperature_days FROM weather_monthly "
+              "WHERE city=? AND month=? AND temperature_days > 0", (city, month))
+    row = c.fetchone()
+    return row[0] if row is not None else None
+
+
+def stream_history(c, cities=None, start=None, end=None, columns=('temperature',), chunk_size=1000):
+    """
+    Yields the readings of the cities and days in chunks of fetchmany, ordered by city and time along the
+    (city, update_datetime) unique index, so no more than one chunk is held in memory. The partitions of the
+    archived years in the range are read with the weather table. Beyond the partitions attached at once, the
+    years are read in groups one after the other, each ordered by city and time.
+
+    Args:
+        c (sqlite3.Cursor): SQLite database cursor object.
+        cities (list): Cities to read, all when not given.
+        start (str): First day (YYYY-MM-DD), no lower bound when not given.
+        end (str): Last day (YYYY-MM-DD), no upper bound when not given.
+        columns (list): Columns read after the city and update_datetime.
+        chunk_size (int): Number of rows fetched at once.
+
+    Yields:
+        list: Rows of city, update_datetime and the columns.
+    """
+    conditions, params = [], []
+    if cities:
+        conditions.append(f"city IN ({', '.join('?' for _ in cities)})")
+        params += list(cities)
+    if start:
+        conditions.append("update_datetime >= ?")
+        params.append(start)
+    if end:
+        conditions.append("update_datetime < ?")
+        params.append((datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat())
+    select = f"city, update_datetime{''.join(', ' + column for column in columns)}"
+    for sources in source_groups(c.connection, start, end):
+        # A cursor per group of partitions, closed before the group is detached
+        cursor = c.connection.execute(union_query(sources, select, ' AND '.join(conditions) or '1',
+                                                  'city, update_datetime'), params * len(sources))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+class DirectQueries:
+    """
+    Answers the CLI queries straight from an open SQLite connection.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def latest(self, city):
+        return latest_reading(self.conn.cursor(), city)
+
+    def average_since(self, city, days):
+        return average_since(self.conn.cursor(), city, days)
+
+    def month_average(self, city, month):
+        return month_average(self.conn.cursor(), city, month)
@@ -0,0 +1,193 @@
+# Multi-metric statistics over a city/time window, computed on column arrays
+import datetime
+import math
+from array import array
+from src.partitions import source_groups, union_query
+from src.weather_db import METRICS
+
+PERIODS = ['day', 'week', 'month']
+
+
+def load_window(conn, cities, start, end, metrics=METRICS):
+    """
+    Loads the readings of the cities between two days as one typed array per metric, with one query
+    reading a range of the (city, update_datetime) index per city in the weather table and in the partitions
+    of the archived years in the window, or one per group of partitions attached together.
+
+    Args:
+        conn (sqlite3.Connection): SQLite database connection object.
+        cities (list): City names.
+        start (str): First day (YYYY-MM-DD).
+        end (str): Last day (YYYY-MM-DD).
+        metrics (list): Metrics to load.
+
+    Returns:
+        dict: Per city the 'update_datetime' list and one array of floats per metric, NULL values are NaN.
+    """
+    windows = {city: dict({'update_datetime': []}, **{metric: array('d') for metric in metrics}) for city in cities}
+    placeholders = ', '.join('?' for _ in cities)
+    params = (*cities, start, (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat())
+    nan = float('nan')
+    for sources in source_groups(conn, start, end):
+        rows = conn.execute(union_query(sources, f"city, update_datetime, {', '.join(metrics)}",
+                                        f"city IN ({placeholders}) AND update_datetime >= ? AND update_datetime < ?",
+                                        'city, update_datetime'), params * len(sources))
+        for row in rows:
+            window = windows[row[0]]
+            window['update_datetime'].append(row[1])
+            for metric, value in zip(metrics, row[2:]):
+                window[metric].append(nan if value is None else value)
+    return windows
+
+
+def window_from_columns(columns, cities, metrics=METRICS):
+    """
+    Splits the columns read from a columnar export into per city windows, see load_window.
+
+    Args:
+        columns (dict): Columns returned by columnar.read_columns.
+        cities (list): City names.
+        metrics (list): Metrics to keep.
+
+    Returns:
+        dict: Per city the 'update_datetime' list and one array of floats per metric.
+    """
+    windows = {city: dict({'update_datetime': []}, **{metric: array('d') for metric in metrics}) for city in cities}
+    for index, city in enumerate(columns['city']):
+        window = windows[city]
+        window['update_datetime'].append(columns['update_datetime'][index])
+        for metric in metrics:
+            window[metric].append(columns[metric][index])
+    return windows
+
+
+def percentile(ordered, fraction):
+    """
+    Returns a percentile of sorted values with linear interpolation between the closest ranks.
+
+    Args:
+        ordered (list): Sorted values.
+        fraction (float): Percentile between 0 and 1.
+
+    Returns:
+        float: The percentile, None if there are no values.
+    """
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values, percentiles=(50, 90, 95)):
+    """
+    Returns the count, min, max, mean, population standard deviation and percentiles of a metric, NaN values
+    are left out.
+
+    Args:
+        values (array): Values of the metric.
+        percentiles (tuple): Percentiles to compute, between 0 and 100.
+
+    Returns:
+        dict: The statistics, None for every statistic but the count if there are no values.
+    """
+    ordered = sorted(value for value in values if value == value)
+    count = len(ordered)
+    summary = {'count': count, 'min': None, 'max': None, 'mean': None, 'stddev': None}
+    if count:
+        mean = math.fsum(ordered) / count
+        summary.update({'min': ordered[0], 'max': ordered[-1], 'mean': mean,
+                        'stddev': math.sqrt(math.fsum((value - mean) ** 2 for value in ordered) / count)})
+    for rank in percentiles:
+        summary[f'p{rank:g}'] = percentile(ordered, rank / 100)
+    return summary
+
+
+def period_key(update_datetime, period):
+    """
+    Returns the bucket of a reading: the day (YYYY-MM-DD), the ISO week (YYYY-Www) or the month (YYYY-MM).
+    """
+    if period == 'day':
+        return update_datetime[:10]
+    if period == 'month':
+        return update_datetime[:7]
+    year, week, _ = datetime.date.fromisoformat(update_datetime[:10]).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def resample(window, period, metrics=METRICS):
+    """
+    Returns the mean of every metric per day, week or month of a window.
+
+    Args:
+        window (dict): Window of a city, see load_window.
+        period (str): 'day', 'week' or 'month'.
+        metrics (list): Metrics to resample.
+
+    Returns:
+        list: One dictionary per bucket with the 'period', the number of 'readings' and the mean of every metric.
+    """
+    buckets = {}
+    for index, update_datetime in enumerate(window['update_datetime']):
+        key = period_key(update_datetime, period)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {'readings': 0, **{metric: [0.0, 0] for metric in metrics}}
+        bucket['readings'] += 1
+        for metric in metrics:
+            value = window[metric][index]
+            if value == value:
+                bucket[metric][0] += value
+                bucket[metric][1] += 1
+    return [dict({'period': key, 'readings': bucket['readings']},
+                 **{metric: bucket[metric][0] / bucket[metric][1] if bucket[metric][1] else None for metric in metrics})
+            for key, bucket in buckets.items()]
+
+
+def window_stats(windows, metrics=METRICS, percentiles=(50, 90, 95), period=None):
+    """
+    Computes the statistics of every metric of every city, and the resampled means when a period is given.
+
+    Args:
+        windows (dict): Windows by city, see load_window.
+        metrics (list): Metrics to summarize.
+        percentiles (tuple): Percentiles to compute.
+        period (str): Optional resampling period, 'day', 'week' or 'month'.
+
+    Returns:
+        dict: Per city the 'summary' of every metric and the 'resampled' buckets (empty without a period).
+    """
+    return {city: {'summary': {metric: summarize(window[metric], percentiles) for metric in metrics},
+                   'resampled': resample(window, period, metrics) if period else []}
+            for city, window in windows.items()}
+
+
+def format_table(stats, metrics=METRICS, percentiles=(50, 90, 95)):
+    """
+    Formats the statistics as an aligned text table, followed by the resampled means if any.
+
+    Returns:
+        str: The table.
+    """
+    def cell(value):
+        return '-' if value is None else f'{value:.2f}' if isinstance(value, float) else str(value)
+
+    columns = ['count', 'min', 'max', 'mean', 'stddev'] + [f'p{rank:g}' for rank in percentiles]
+    rows = [['city', 'metric'] + columns]
+    for city, city_stats in stats.items():
+        for metric in metrics:
+            rows.append([city, metric] + [cell(city_stats['summary'][metric][column]) for column in columns])
+    resampled = [['city', 'period', 'readings'] + list(metrics)]
+    for city, city_stats in stats.items():
+        for bucket in city_stats['resampled']:
+            resampled.append([city, bucket['period'], str(bucket['readings'])] + [cell(bucket[metric])
+                                                                                 for metric in metrics])
+    tables = [rows] + ([resampled] if len(resampled) > 1 else [])
+    lines = []
+    for table in tables:
+        widths = [max(len(row[index]) for row in table) for index in range(len(table[0]))]
+        if lines:
+            lines.append('')
+        lines += ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in table]
+    return '\n'.join(lines)
@@ -0,0 +1,188 @@
+# Single writer of the weather database fed by a bounded queue
+import queue
+import threading
+import time
+from src import metrics, profiling
+from src.weather_db import connect, weather_info_bulk_insert
+
+
+class WeatherWriter:
+    """
+    Background thread owning the only write connection of the weather database. Fetch workers put parsed
+    weather records on a bounded queue, the writer commits them in batches of up to batch_size records or
+    after max_delay seconds, whichever comes first. When the queue is full put blocks, which slows the
+    fetch workers down to the speed of the database.
+
+    Args:
+        database (str): Path of the SQLite database file.
+        policy (str): Conflict policy of weather_info_bulk_insert ('ignore' or 'update').
+        batch_size (int): Maximum number of records committed in one transaction.
+        max_delay (float): Maximum seconds a record waits in the queue before its batch is committed.
+        max_queue (int): Maximum number of records waiting in the queue.
+    """
+
+    def __init__(self, database, policy='ignore', batch_size=500, max_delay=1.0, max_queue=10000):
+        self.database = database
+        self.policy = policy
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self.queue = queue.Queue(maxsize=max(1, max_queue))
+        self.thread = threading.Thread(target=self.run, name='weather-writer', daemon=True)
+        self.lock = threading.Lock()
+        self.error = None
+        self.totals = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+        self.stats = {'batches': 0, 'rows': 0, 'last_batch_size': 0, 'max_batch_size': 0, 'max_queue_depth': 0,
+                      'blocked_puts': 0, 'commit_latency': 0.0, 'last_commit_latency': 0.0,
+                      'max_commit_latency': 0.0}
+
+    def start(self):
+        """
+        Starts the writer thread.
+
+        Returns:
+            WeatherWriter: The writer itself.
+        """
+        self.thread.start()
+        return self
+
+    def put(self, weather_info):
+        """
+        Queues a weather record, blocking while the queue is full.
+
+        Args:
+            weather_info (Reading): Record to be inserted, see weather_info_bulk_insert.
+
+        Raises:
+            Exception: The error which stopped the writer thread.
+        """
+        self.check()
+        try:
+            self.queue.put_nowait(weather_info)
+        except queue.Full:
+            with self.lock:
+                self.stats['blocked_puts'] += 1
+            self.enqueue(weather_info)
+        depth = self.queue.qsize()
+        if depth > self.stats['max_queue_depth']:
+            with self.lock:
+                self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], depth)
+
+    def close(self):
+        """
+        Writes the queued records, stops the writer thread and closes its connection. A writer that was
+        never started is started to write the records queued so far.
+
+        Returns:
+            dict: Number of 'inserted', 'updated', 'skipped' and 'failed' records over the writer's lifetime.
+
+        Raises:
+            Exception: The error which stopped the writer thread.
+        """
+        if self.thread.ident is None:
+            if self.queue.empty():
+                return self.totals
+            self.start()
+        if self.thread.is_alive():
+            self.enqueue(None)
+            self.thread.join()
+        self.check()
+        return self.totals
+
+    def check(self):
+        """
+        Raises the error which stopped the writer thread, if any.
+        """
+        if self.error is not None:
+            raise self.error
+
+    def enqueue(self, weather_info):
+        """
+        Waits for room in the queue as long as the writer thread is running or not started yet.
+        """
+        while True:
+            try:
+                self.queue.put(weather_info, timeout=0.1)
+                return
+            except queue.Full:
+                if self.thread.ident is not None and not self.thread.is_alive():
+                    self.check()
+                    raise RuntimeError("The weather writer thread stopped")
+
+    def metrics(self):
+        """
+        Returns a snapshot of the writer metrics.
+
+        Returns:
+            dict: Current queue depth, batch and commit latency statistics and the insert totals.
+        """
+        with self.lock:
+            snapshot = dict(self.stats, **self.totals)
+        snapshot['queue_depth'] = self.queue.qsize()
+        snapshot['average_commit_latency'] = (snapshot['commit_latency'] / snapshot['batches']
+                                              if snapshot['batches'] else 0.0)
+        return snapshot
+
+    def write(self, conn, c, batch):
+        """
+        Commits one batch and records its metrics.
+        """
+        started = time.perf_counter()
+        counts = weather_info_bulk_insert(batch, conn, c, self.policy, len(batch))
+        latency = time.perf_counter() - started
+        profiling.record('insert', latency)
+        with self.lock:
+            for key in self.totals:
+                self.totals[key] += counts[key]
+            self.stats['batches'] += 1
+            self.stats['rows'] += len(batch)
+            self.stats['last_batch_size'] = len(batch)
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+            self.stats['commit_latency'] += latency
+            self.stats['last_commit_latency'] = latency
+            self.stats['max_commit_latency'] = max(self.stats['max_commit_latency'], latency)
+        for key, count in counts.items():
+            if count:
+                metrics.ROWS.inc(count, result=key)
+        metrics.COMMIT_LATENCY.observe(latency)
+        metrics.QUEUE_DEPTH.set(self.queue.qsize())
+        metrics.log_event('db_batch', rows=len(batch), latency=round(latency, 4), **counts)
+
+    def run(self):
+        """
+        Main loop of the writer thread, a None record stops it after the pending batch is written.
+        """
+        try:
+            conn = connect(self.database)
+        except Exception as e:
+            print(f"Error opening database {self.database} for writing: {e}")
+            self.error = e
+            return
+        c = conn.cursor()
+        closing = False
+        try:
+            while not closing:
+                weather_info = self.queue.get()
+                if weather_info is None:
+                    break
+                batch = [weather_info]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        weather_info = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if weather_info is None:
+                        closing = True
+                        break
+                    batch.append(weather_info)
+                try:
+                    self.write(conn, c, batch)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} records into database: {e}")
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
@@ -0,0 +1,118 @@
+import unittest
+import io
+import math
+import os
+import tempfile
+from src.columnar import write_npy, read_npy, export_weather, import_weather, read_columns, partition_files
+from src.weather_db import connect, weather_info_bulk_insert
+from click.testing import CliRunner
+from src import weather_cli
+
+
+def reading(city, update_datetime, temperature, humidity=35):
+    """
+    Returns a weather record of the given city, time and temperature.
+    """
+    return {'city': city, 'country': 'Germany', 'latitude': 50.11, 'longitude': 8.68, 'temperature': temperature,
+            'humidity': humidity, 'wind_speed': 12.0, 'precipitation': 0.5, 'update_datetime': update_datetime}
+
+
+class TestColumnar(unittest.TestCase):
+    """
+    The TestColumnar class is a unit test class that tests the .npz format, the incremental export,
+    the partition pruning and the import of the src.columnar module.
+    """
+
+    def setUp(self):
+        """
+        Set up a database with readings of two cities over two months.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.export = os.path.join(self.directory.name, 'export')
+        self.conn = connect(os.path.join(self.directory.name, 'weather.db'))
+        rows = [reading('Berlin', f'2023-03-{day:02d}', float(day)) for day in range(25, 32)]
+        rows += [reading('Berlin', f'2023-04-{day:02d} 12:00', float(day), None) for day in range(1, 4)]
+        rows += [reading('Frankfurt/Main', '2023-04-01', 5.0)]
+        weather_info_bulk_insert(rows, self.conn, self.conn.cursor())
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_npy_format(self):
+        """
+        Test that a column is written with the NumPy 1.0 header, 64 byte aligned, and read back.
+        """
+        for values, descr, expected_descr in [([1.5, float('nan'), -2.0], '<f8', "'<f8'"),
+                                              ([1681415100, 0], '<i8', "'<i8'"),
+                                              (['2023-04-13 19:45', 'Zürich'], 'U', "'<U16'")]:
+            output = io.BytesIO()
+            write_npy(output, values, descr)
+            data = output.getvalue()
+            self.assertTrue(data.startswith(b'\x93NUMPY\x01\x00'))
+            header_length = int.from_bytes(data[8:10], 'little')
+            self.assertEqual((10 + header_length) % 64, 0)
+            self.assertIn(f"'descr': {expected_descr}", data[10:10 + header_length].decode('latin1'))
+            column = list(read_npy(data))
+            self.assertEqual(len(column), len(values))
+            for value, expected in zip(column, values):
+                if isinstance(expected, float) and math.isnan(expected):
+                    self.assertTrue(math.isnan(value))
+                else:
+                    self.assertEqual(value, expected)
+
+    def test_incremental_export_and_import(self):
+        """
+        Test that a second export only writes the new rows, and that the import restores every row.
+        """
+        written = export_weather(self.conn, self.export, chunk_size=4)
+        self.assertEqual(written['rows'], 11)
+        """ Berlin 2023-03 is split into two parts of at most 4 rows, plus Berlin 2023-04 and Frankfurt/Main """
+        self.assertEqual(written['files'], 4)
+        self.assertEqual(export_weather(self.conn, self.export)['rows'], 0)
+        weather_info_bulk_insert([reading('Berlin', '2023-04-10', 20.0)], self.conn, self.conn.cursor())
+        self.assertEqual(export_weather(self.conn, self.export), {'rows': 1, 'files': 1, 'last_id': 12,
+                                                                    'last_hourly_id': 0})
+
+        target = connect(os.path.join(self.directory.name, 'imported.db'))
+        counts = import_weather(target, target.cursor(), self.export)
+        self.assertEqual(counts, {'inserted': 12, 'updated': 0, 'skipped': 0, 'failed': 0})
+        query = ("SELECT city, country, latitude, longitude, temperature, humidity, wind_speed, precipitation, "
+                 "update_datetime, update_epoch, update_date FROM weather ORDER BY city, update_datetime")
+        self.assertEqual(target.execute(query).fetchall(), self.conn.execute(query).fetchall())
+        target.close()
+
+        """ A full export replaces the parts written so far """
+        self.assertEqual(export_weather(self.conn, self.export, full=True)['rows'], 12)
+        self.assertEqual(len(partition_files(self.export)), 3)
+
+    def test_read_columns_prunes_partitions(self):
+        """
+        Test that only the partitions of the requested cities and months are read, and rows are cut to the days.
+        """
+        export_weather(self.conn, self.export)
+        self.assertEqual(len(partition_files(self.export, ['Berlin'], '2023-04-01', '2023-04-30')), 1)
+        columns = read_columns(self.export, ['Berlin'], '2023-03-30', '2023-04-02', ['temperature'])
+        self.assertEqual(list(columns['temperature']), [30.0, 31.0, 1.0, 2.0])
+        self.assertEqual(columns['city'], ['Berlin'] * 4)
+        self.assertEqual(set(columns), {'city', 'temperature'})
+        columns = read_columns(self.export, ['Frankfurt/Main'])
+        self.assertEqual(list(columns['temperature']), [5.0])
+
+    def test_export_and_import_commands(self):
+        """
+        Test the export and import commands of the CLI.
+        """
+        runner = CliRunner()
+        target = os.path.join(self.directory.name, 'imported.db')
+        result = runner.invoke(weather_cli.export, [self.export], obj=self.conn)
+        self.assertEqual(result.output.strip(), f"Exported 11 rows into 3 files in {self.export}.")
+        result = runner.invoke(weather_cli.cli, ['--database', target, 'import', self.export])
+        self.assertIn(f"Imported {self.export}: 11 inserted, 0 updated, 0 skipped, 0 failed.", result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import datetime
+import os
+import tempfile
+from src.compaction import compact
+from src.weather_db import connect, rebuild_rollups, weather_info_bulk_insert
+
+
+def reading(update_datetime, temperature):
+    return {'city': 'Berlin', 'country': 'Germany', 'latitude': 52.5, 'longitude': 13.4, 'temperature': temperature,
+            'humidity': 60, 'wind_speed': 10.0, 'precipitation': 0.0, 'update_datetime': update_datetime}
+
+
+class TestCompaction(unittest.TestCase):
+    """
+    The TestCompaction class is a unit test class that tests the downsampling of old readings of the
+    src.compaction module.
+    """
+
+    def setUp(self):
+        """
+        Set up a weather database with readings every 10 minutes on two old days, a daily history row and a
+        reading of today.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = connect(os.path.join(self.directory.name, 'weather.db'))
+        self.today = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+        rows = [reading(f"2023-05-{day:02d} {hour:02d}:{minute:02d}", hour + minute / 10)
+                for day in (1, 2) for hour in range(24) for minute in range(0, 60, 10)]
+        rows += [reading('2023-05-03', 15.0), reading(self.today, 20.0)]
+        weather_info_bulk_insert(rows, self.conn, self.conn.cursor())
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.conn.close()
+        self.directory.cleanup()
+
+    def rollups(self):
+        return (self.conn.execute("SELECT * FROM weather_daily ORDER BY day").fetchall(),
+                self.conn.execute("SELECT * FROM weather_monthly ORDER BY month").fetchall())
+
+    def test_compact_hourly_and_resume(self):
+        """
+        Test that a stopped compaction resumes where it stopped, keeps one row per hour with the mean of the
+        readings and leaves the rollups, the history rows and the recent readings as they are.
+        """
+        rollups = self.rollups()
+        totals = compact(self.conn, older_than=30, batch_size=50, max_batches=2)
+        self.assertEqual((totals['batches'], totals['removed']), (2, 80))
+        totals = compact(self.conn, older_than=30, batch_size=50)
+        self.assertEqual(totals['removed'], 2 * 24 * 5 - 80)
+        self.assertEqual(compact(self.conn, older_than=30)['batches'], 0)
+        rows = self.conn.execute("SELECT update_datetime, temperature, update_epoch FROM weather "
+                                 "WHERE update_date = '2023-05-01' ORDER BY update_datetime").fetchall()
+        self.assertEqual(len(rows), 24)
+        self.assertEqual(rows[10][:2], ('2023-05-01 10:00', 12.5))
+        self.assertEqual(rows[10][2], 1682935200)
+        self.assertEqual(self.rollups(), rollups)
+        stored = [row[0] for row in self.conn.execute("SELECT update_datetime FROM weather "
+                                                      "WHERE update_datetime >= '2023-05-03'")]
+        self.assertEqual(stored, ['2023-05-03', self.today])
+        self.assertGreater(totals['pages'], 0)
+        """ A late reading of a compacted day is still added to the rollups """
+        weather_info_bulk_insert([reading('2023-05-01 10:05', 30.0)], self.conn, self.conn.cursor())
+        count = self.conn.execute("SELECT temperature_count FROM weather_daily WHERE day = '2023-05-01'")
+        self.assertEqual(count.fetchone()[0], 24 * 6 + 1)
+
+    def test_compact_daily(self):
+        """
+        Test that a daily compaction keeps one row per day and the rollups.
+        """
+        rollups = self.rollups()
+        compact(self.conn, older_than=30, resolution='day', batch_size=1000)
+        rows = self.conn.execute("SELECT update_datetime, temperature FROM weather "
+                                 "WHERE update_date < '2023-05-03' ORDER BY update_datetime").fetchall()
+        self.assertEqual(rows, [('2023-05-01 00:00', 14.0), ('2023-05-02 00:00', 14.0)])
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_compact_daily_hourly_readings(self):
+        """
+        Test that a daily compaction also keeps one hourly reading per day and the rollups of the hourly days.
+        """
+        with self.conn:
+            self.conn.executemany("INSERT INTO weather_hourly VALUES ('Berlin', ?, ?, 60, 10.0, 0.0)",
+                                  [(f"2023-05-04 {hour:02d}:00", float(hour)) for hour in range(1, 24)])
+        rollups = self.rollups()
+        totals = compact(self.conn, older_than=30, resolution='day', batch_size=100)
+        self.assertEqual(totals['removed'], 2 * 24 * 6 - 2 + 22)
+        rows = self.conn.execute("SELECT * FROM weather_hourly").fetchall()
+        self.assertEqual(rows, [('Berlin', '2023-05-04 00:00', 12.0, 60, 10.0, 0.0)])
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_rebuild_keeps_compacted_days(self):
+        """
+        Test that rebuilding the rollups during and after a compaction keeps the rollups of the compacted days
+        instead of recomputing them from the means.
+        """
+        rollups = self.rollups()
+        compact(self.conn, older_than=30, batch_size=50, max_batches=1)
+        rebuild_rollups(self.conn)
+        self.assertEqual(self.rollups(), rollups)
+        compact(self.conn, older_than=30, batch_size=50)
+        """ Only the day of the recent reading is rebuilt from the weather table """
+        self.assertEqual(rebuild_rollups(self.conn), 1)
+        self.assertEqual(self.rollups(), rollups)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+import urllib.request
+from unittest.mock import patch, MagicMock
+import requests
+from src import metrics
+from src.metrics import Registry, Exporter
+from src.weather_client import WeatherClient
+from src.weather_fetcher import weather_info_insert
+from src.weather_db import connect
+
+
+def make_response(status_code, payload):
+    """
+    Builds a requests.Response returning the given payload as JSON.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.json = lambda: payload
+    return response
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    The TestMetrics class is a unit test class that tests the Prometheus text format, the exporters and the
+    instrumentation of the API client and the insert path of the src.metrics module.
+    """
+
+    def test_render(self):
+        """
+        Test the counter, gauge and histogram lines of the text format.
+        """
+        registry = Registry()
+        registry.counter('calls_total', 'Calls.', ('endpoint',)).inc(2, endpoint='current')
+        registry.gauge('depth', 'Depth.').set(3)
+        latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE calls_total counter', lines)
+        self.assertIn('calls_total{endpoint="current"} 2', lines)
+        self.assertIn('depth 3', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum 5.55', lines)
+        self.assertIn('latency_seconds_count 3', lines)
+
+    def test_exporters(self):
+        """
+        Test that the textfile holds the final values after close and that the HTTP endpoint serves /metrics.
+        """
+        registry = Registry()
+        counter = registry.counter('runs_total', 'Runs.')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather.prom')
+            exporter = Exporter(registry, path, port=0, interval=60).start()
+            counter.inc()
+            port = exporter.server.server_address[1]
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+                self.assertIn('runs_total 1', response.read().decode())
+            counter.inc()
+            exporter.close()
+            with open(path) as textfile:
+                self.assertIn('runs_total 2', textfile.read())
+            self.assertEqual(os.listdir(directory), ['weather.prom'])
+
+    @patch('src.weather_client.time.sleep')
+    def test_client_and_insert_instrumentation(self, mock_sleep):
+        """
+        Test that API calls, retries, errors and inserted and skipped rows are counted and logged as JSON.
+        """
+        client = WeatherClient('http://weather.test/v1', max_retries=1)
+        client.session.get = MagicMock(side_effect=[make_response(503, {}), make_response(200, {'current': {}}),
+                                                    make_response(400, {'error': {}})])
+        before = {'ok': metrics.API_REQUESTS.get(endpoint='current', status=200),
+                  'errors': metrics.API_ERRORS.get(endpoint='current'),
+                  'retries': metrics.API_RETRIES.get(endpoint='current'),
+                  'latency': metrics.API_LATENCY.get(endpoint='current'),
+                  'inserted': metrics.ROWS.get(result='inserted'), 'skipped': metrics.ROWS.get(result='skipped')}
+        log = io.StringIO()
+        with patch.object(metrics, 'log_stream', log):
+            client.request(client.current_api, {'q': 'Berlin', 'key': 'KEY'})
+            client.request(client.current_api, {'q': 'Berlin', 'key': 'KEY'})
+        self.assertEqual(metrics.API_REQUESTS.get(endpoint='current', status=200), before['ok'] + 1)
+        self.assertEqual(metrics.API_ERRORS.get(endpoint='current'), before['errors'] + 1)
+        self.assertEqual(metrics.API_RETRIES.get(endpoint='current'), before['retries'] + 1)
+        self.assertEqual(metrics.API_LATENCY.get(endpoint='current'), before['latency'] + 2)
+        events = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual([(event['event'], event['status'], event['retries']) for event in events],
+                         [('api_call', 200, 1), ('api_call', 400, 0)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            conn = connect(os.path.join(directory, 'weather.db'))
+            reading = {'city': 'Berlin', 'country': 'Germany', 'latitude': 52.52, 'longitude': 13.4,
+                       'temperature': 12.5, 'humidity': 60, 'wind_speed': 8.1, 'precipitation': 0.0,
+                       'update_datetime': '2023-04-13 10:00'}
+            weather_info_insert(reading, conn, conn.cursor())
+            weather_info_insert(reading, conn, conn.cursor())
+            conn.close()
+        self.assertEqual(metrics.ROWS.get(result='inserted'), before['inserted'] + 1)
+        self.assertEqual(metrics.ROWS.get(result='skipped'), before['skipped'] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
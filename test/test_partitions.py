@@ -0,0 +1,134 @@
+import unittest
+import os
+import tempfile
+from src.columnar import export_weather
+from src.partitions import MAX_ATTACHED, apply_retention, archive, partitions, source_groups
+from src.weather_db import connect, rebuild_rollups, weather_info_bulk_insert
+from src.weather_fetcher import stored_days
+from src.weather_queries import latest_reading, month_average, stream_history
+from src.weather_stats import load_window
+
+
+def reading(city, update_datetime, temperature):
+    return {'city': city, 'country': 'Germany', 'latitude': 50.1, 'longitude': 8.7, 'temperature': temperature,
+            'humidity': 60, 'wind_speed': 10.0, 'precipitation': 0.0, 'update_datetime': update_datetime}
+
+
+class TestPartitions(unittest.TestCase):
+    """
+    The TestPartitions class is a unit test class that tests the yearly partitions of the src.partitions module
+    and that the queries read them like the weather table.
+    """
+
+    def setUp(self):
+        """
+        Set up a weather database with readings of three years.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'weather.db')
+        self.conn = connect(self.database)
+        rows = [reading('Berlin', '2022-06-01 10:00', 20.0), reading('Berlin', '2022-06-01 11:00', 22.0),
+                reading('Berlin', '2022-06-02', 18.0), reading('Berlin', '2023-01-05 12:00', 1.0),
+                reading('Berlin', '2024-03-01 12:00', 8.0), reading('Paris', '2023-07-14 12:00', 30.0)]
+        weather_info_bulk_insert(rows, self.conn, self.conn.cursor())
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_archive_is_transparent(self):
+        """
+        Test that archived years are moved to their partition files and still answer every query, while their
+        rollups are kept and late readings of them are ignored.
+        """
+        c = self.conn.cursor()
+        rollups = self.conn.execute("SELECT * FROM weather_monthly ORDER BY city, month").fetchall()
+        self.assertEqual(archive(self.conn, 2024), {'2022': 3, '2023': 2})
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'weather.2022.db')))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM weather").fetchone()[0], 1)
+        self.assertEqual(self.conn.execute("SELECT * FROM weather_monthly ORDER BY city, month").fetchall(), rollups)
+        self.assertEqual(month_average(c, 'Berlin', '2022-06'), 19.5)
+        """ Paris only has archived readings """
+        self.assertEqual(latest_reading(c, 'Paris'), (30.0, 60, 10.0, '2023-07-14 12:00'))
+        self.assertEqual(latest_reading(c, 'Berlin')[3], '2024-03-01 12:00')
+        rows = [row for chunk in stream_history(c, ['Berlin']) for row in chunk]
+        self.assertEqual([row[1] for row in rows], ['2022-06-01 10:00', '2022-06-01 11:00', '2022-06-02',
+                                                   '2023-01-05 12:00', '2024-03-01 12:00'])
+        """ Partitions outside the range are not read """
+        self.assertEqual(list(source_groups(self.conn, '2024-01-01', '2024-12-31', hourly=False)), [['main.weather']])
+        window = load_window(self.conn, ['Paris'], '2023-07-01', '2023-07-31')
+        self.assertEqual(list(window['Paris']['temperature']), [30.0])
+        counts = weather_info_bulk_insert([reading('Paris', '2023-07-15 12:00', 31.0)], self.conn, c)
+        self.assertEqual(counts['skipped'], 1)
+        self.assertEqual(stored_days(c, 'Paris', ['2023-12-31', '2024-01-01']), {'2023-12-31'})
+        """ Id 6 of the archived Paris row is not reused """
+        weather_info_bulk_insert([reading('Paris', '2024-07-14 12:00', 25.0)], self.conn, c)
+        self.assertEqual(self.conn.execute("SELECT max(id) FROM weather").fetchone()[0], 7)
+        rebuild_rollups(self.conn)
+        self.assertEqual(month_average(c, 'Berlin', '2022-06'), 19.5)
+
+    def test_many_partitions(self):
+        """
+        Test that more partitions than SQLite can attach at once are read in groups, in time order, and are
+        all detached afterwards.
+        """
+        c = self.conn.cursor()
+        weather_info_bulk_insert([reading('Berlin', f'{year}-05-01 12:00', float(year - 2000)) for year in
+                                  range(2000, 2012)] + [reading('Rome', '2000-08-01 12:00', 28.0)], self.conn, c)
+        archive(self.conn, 2024)
+        self.assertEqual(len(partitions(self.conn)), 14)
+        self.assertEqual([len(sources) for sources in source_groups(self.conn, hourly=False)], [MAX_ATTACHED, 7])
+        times = [row[1] for chunk in stream_history(c, ['Berlin'], chunk_size=5) for row in chunk]
+        self.assertEqual(len(times), 17)
+        self.assertEqual(times, sorted(times))
+        window = load_window(self.conn, ['Berlin'], '2000-01-01', '2024-12-31')
+        self.assertEqual(list(window['Berlin']['temperature'][:12]), [float(year) for year in range(12)])
+        self.assertEqual(latest_reading(c, 'Rome'), (28.0, 60, 10.0, '2000-08-01 12:00'))
+        self.assertEqual(export_weather(self.conn, os.path.join(self.directory.name, 'export'))['rows'], 19)
+        self.assertEqual({row[1] for row in self.conn.execute("PRAGMA database_list")} - {'main', 'temp'}, set())
+
+    def test_archive_hourly_readings(self):
+        """
+        Test that the hourly readings are archived and downsampled with their year and are still read by the
+        queries and the export.
+        """
+        c = self.conn.cursor()
+        with self.conn:
+            self.conn.executemany("INSERT INTO weather_hourly VALUES ('Rome', ?, ?, 70, 5.0, 0.0)",
+                                  [(f"2022-08-01 {hour:02d}:00", float(hour)) for hour in range(1, 4)])
+        rollups = self.conn.execute("SELECT * FROM weather_monthly ORDER BY city, month").fetchall()
+        self.assertEqual(archive(self.conn, 2024), {'2022': 6, '2023': 2})
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM weather_hourly").fetchone()[0], 0)
+        self.assertEqual(self.conn.execute("SELECT * FROM weather_monthly ORDER BY city, month").fetchall(), rollups)
+        self.assertEqual(latest_reading(c, 'Rome'), (3.0, 70, 5.0, '2022-08-01 03:00'))
+        rows = [row for chunk in stream_history(c, ['Rome']) for row in chunk]
+        self.assertEqual([row[1] for row in rows], ['2022-08-01 01:00', '2022-08-01 02:00', '2022-08-01 03:00'])
+        self.assertEqual(export_weather(self.conn, os.path.join(self.directory.name, 'export'))['rows'], 9)
+        self.assertEqual(apply_retention(self.conn, downsample_before=2023), {'2022': 'downsampled'})
+        self.assertEqual(latest_reading(c, 'Rome'), (2.0, 70, 5.0, '2022-08-01 00:00'))
+        self.assertEqual(partitions(self.conn)[0][3], 3)
+        self.assertEqual(month_average(c, 'Rome', '2022-08'), 2.0)
+
+    def test_retention(self):
+        """
+        Test that downsampling keeps one row per city and day and that a dropped partition only leaves its
+        rollups.
+        """
+        c = self.conn.cursor()
+        archive(self.conn, 2024)
+        self.assertEqual(apply_retention(self.conn, downsample_before=2023), {'2022': 'downsampled'})
+        rows = [row for chunk in stream_history(c, ['Berlin'], end='2022-12-31') for row in chunk]
+        self.assertEqual(rows, [('Berlin', '2022-06-01', 21.0), ('Berlin', '2022-06-02', 18.0)])
+        self.assertEqual(apply_retention(self.conn, drop_before=2024), {'2022': 'dropped', '2023': 'dropped'})
+        self.assertEqual([(year, state, count) for year, _, state, count in partitions(self.conn)],
+                         [('2022', 'dropped', 0), ('2023', 'dropped', 0)])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'weather.2022.db')))
+        self.assertIsNone(latest_reading(c, 'Paris'))
+        self.assertEqual(month_average(c, 'Paris', '2023-07'), 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import asyncio
+import os
+import tempfile
+from src.polling import AdaptivePolling
+from src.weather_fetcher import run_latest_weather
+from src.weather_writer import WeatherWriter
+from src.weather_client import WeatherClient
+from src.scheduler import Scheduler
+from src.mock_weatherapi import start_mock_server
+from src.weather_db import connect
+
+
+class TestAdaptivePolling(unittest.TestCase):
+    """
+    The TestAdaptivePolling class is a unit test class that tests the cadence estimate and the backoff of
+    the src.polling module, and the adaptive polling of run_latest_weather against the mock API.
+    """
+
+    def test_cadence_and_backoff(self):
+        """
+        Test that the next poll is planned just after the expected update and backs off while nothing changes.
+        """
+        polling = AdaptivePolling(min_interval=60, max_interval=900, grace=30)
+        self.assertTrue(polling.observe('Berlin', '10:00', 36000, now=36010))
+        """ The cadence is unknown after the first reading, the polls back off from the grace delay """
+        self.assertEqual(polling.next_delay('Berlin', now=36010), 60)
+        self.assertFalse(polling.observe('Berlin', '10:00', 36000, now=36070))
+        self.assertEqual(polling.next_delay('Berlin', now=36070), 60)
+        self.assertFalse(polling.observe('Berlin', '10:00', 36000, now=36130))
+        self.assertEqual(polling.next_delay('Berlin', now=36130), 120)
+        self.assertTrue(polling.observe('Berlin', '10:15', 36900, now=36950))
+        """ Next update expected at 37800, polled 30 seconds later """
+        self.assertEqual(polling.next_delay('Berlin', now=36950), 880)
+        self.assertFalse(polling.observe('Berlin', '10:15', 36900, now=37830))
+        self.assertEqual(polling.next_delay('Berlin', now=37830), 60)
+        """ A missed update does not halve the cadence estimate """
+        self.assertTrue(polling.observe('Berlin', '10:45', 38700, now=38720))
+        self.assertEqual(polling.next_delay('Berlin', now=38720), 900)
+        for _ in range(2000):
+            polling.observe('Berlin', '10:45', 38700)
+        self.assertEqual(polling.next_delay('Berlin'), 900)
+        self.assertEqual(polling.stats['changed'], 3)
+
+    def test_adaptive_run_latest_weather(self):
+        """
+        Test that adaptive polling stores every update of the mock API with far fewer calls than polling often
+        enough to see each update as quickly.
+        """
+        server, base_url = start_mock_server(update_interval=1)
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'weather.db')
+            writer = WeatherWriter(database, max_delay=0.1).start()
+            scheduler = Scheduler(jitter=0)
+            polling = AdaptivePolling(min_interval=0.05, max_interval=2, grace=0.1)
+
+            async def main():
+                asyncio.get_running_loop().call_later(4.2, scheduler.stop)
+                return await run_latest_weather(['Berlin'], 'API_KEY', 1, writer, WeatherClient(base_url), scheduler,
+                                                polling=polling)
+
+            try:
+                totals = asyncio.run(main())
+            finally:
+                writer.close()
+                server.shutdown()
+            conn = connect(database)
+            stored = conn.execute("SELECT COUNT(*) FROM weather").fetchone()[0]
+            conn.close()
+        """ Polling every 0.1 seconds would take 42 calls to see each update within 0.1 seconds """
+        self.assertLessEqual(server.request_count, 14)
+        self.assertGreaterEqual(stored, 4)
+        self.assertEqual(stored, totals['retrieved'])
+        self.assertEqual(totals['unchanged'], polling.stats['unchanged'])
+        self.assertEqual(writer.totals['skipped'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
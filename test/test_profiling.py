@@ -0,0 +1,79 @@
+import unittest
+import json
+import os
+import pstats
+import tempfile
+from click.testing import CliRunner
+from src import profiling, weather_cli, weather_fetcher
+from src.mock_weatherapi import start_mock_server
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    The TestProfiling class is a unit test class that tests the --profile option of both CLI groups and the
+    src.profiling module.
+    """
+
+    def setUp(self):
+        """
+        Set up a temporary directory holding the database and the profiles.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'weather.db')
+        self.runner = CliRunner()
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.directory.cleanup()
+
+    def read_profile(self, path):
+        with open(path + '.json') as summary:
+            return pstats.Stats(path), json.load(summary)
+
+    def test_profile_fetcher_threads(self):
+        """
+        Test that the profile of get-historic-weather holds the functions run by the worker threads and the
+        time of the API calls, the parsing and the inserts.
+        """
+        server, base_url = start_mock_server()
+        path = os.path.join(self.directory.name, 'fetch-{pid}.prof')
+        try:
+            result = self.runner.invoke(weather_fetcher.cli, ['--database', self.database, '--profile', path,
+                                                              'get-historic-weather', 'Berlin', 'SECRET_KEY', '3',
+                                                              '--base-url', base_url, '--no-cache'])
+        finally:
+            server.shutdown()
+        self.assertEqual(result.exit_code, 0, result.output)
+        path = path.format(pid=os.getpid())
+        stats, summary = self.read_profile(path)
+        self.assertIn('fetch_historic_day', {function for _, _, function in stats.stats})
+        self.assertEqual(summary['command'], 'get-historic-weather')
+        self.assertEqual(summary['phases']['api']['calls'], 3)
+        self.assertEqual(summary['phases']['decode']['calls'], 3)
+        self.assertEqual(summary['phases']['parse']['calls'], 3)
+        self.assertEqual(summary['phases']['insert']['calls'], 1)
+        with open(path + '.json') as summary:
+            self.assertNotIn('SECRET_KEY', summary.read())
+        self.assertIsNone(profiling.active)
+
+    def test_profile_queries_and_sampling(self):
+        """
+        Test that the queries of compare are timed and that a run outside the sample is not profiled.
+        """
+        path = os.path.join(self.directory.name, 'compare.prof')
+        result = self.runner.invoke(weather_cli.cli, ['--database', self.database, '--profile', path,
+                                                      '--profile-sample', '0', 'compare', 'week', 'Berlin'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertFalse(os.path.exists(path))
+        result = self.runner.invoke(weather_cli.cli, ['--database', self.database, '--profile', path,
+                                                      'compare', 'week', 'Berlin'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        _, summary = self.read_profile(path)
+        self.assertEqual(summary['phases']['query']['calls'], 1)
+        self.assertIs(profiling.phase('query'), profiling.NOT_PROFILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
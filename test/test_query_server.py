@@ -0,0 +1,118 @@
+import unittest
+import datetime
+import os
+import tempfile
+import threading
+from click.testing import CliRunner
+from src import weather_cli
+from src.query_client import QueryClient
+from src.query_server import QueryServer
+from src.weather_db import connect
+from src.weather_fetcher import weather_info_insert
+
+
+def reading(city, update_datetime, temperature):
+    """
+    Returns a weather record of the given city, time and temperature.
+    """
+    return {'city': city, 'country': 'Germany', 'latitude': 50.11, 'longitude': 8.68, 'temperature': temperature,
+            'humidity': 35, 'wind_speed': 12.0, 'precipitation': 0.0, 'update_datetime': update_datetime}
+
+
+class TestQueryServer(unittest.TestCase):
+    """
+    The TestQueryServer class is a unit test class that tests the cached answers of the
+    src.query_server module and the fallback of the CLI when no server is running.
+    """
+
+    def setUp(self):
+        """
+        Set up a database with readings of the last days and a running query server.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'weather.db')
+        self.conn = connect(self.database)
+        today = datetime.date.today()
+        for offset, temperature in [(3, 10.0), (2, 20.0), (1, 30.0)]:
+            day = (today - datetime.timedelta(days=offset)).isoformat()
+            weather_info_insert(reading('Berlin', day, temperature), self.conn, self.conn.cursor())
+        self.server = QueryServer(self.database)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = QueryClient(self.server.path, self.database)
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.close()
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_answers_from_memory(self):
+        """
+        Test that repeated queries are answered from the cache with the same results as the database.
+        """
+        yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+        for _ in range(3):
+            self.assertEqual(self.client.latest('Berlin'), (30.0, 35, 12.0, yesterday))
+            self.assertEqual(self.client.average_since('Berlin', 7), 20.0)
+        self.assertIsNone(self.client.latest('Paris'))
+        self.assertIsNone(self.client.fallback)
+        stats = self.client.request('stats')
+        self.assertEqual(stats['queries'], 7)
+        self.assertEqual(stats['hits'], 4)
+
+    def test_cache_follows_inserts(self):
+        """
+        Test that rows committed by another connection replace the cached reading and averages.
+        """
+        self.assertEqual(self.client.average_since('Berlin', 7), 20.0)
+        self.client.latest('Berlin')
+        today = datetime.date.today().isoformat()
+        weather_info_insert(reading('Berlin', today + ' 10:00', 40.0), self.conn, self.conn.cursor())
+        self.assertEqual(self.client.latest('Berlin'), (40.0, 35, 12.0, today + ' 10:00'))
+        self.assertEqual(self.client.average_since('Berlin', 7), 25.0)
+        """ An older row does not replace the newest reading """
+        weather_info_insert(reading('Berlin', today + ' 08:00', 0.0), self.conn, self.conn.cursor())
+        self.assertEqual(self.client.latest('Berlin')[0], 40.0)
+        self.conn.execute("DELETE FROM weather WHERE update_datetime=?", (today + ' 10:00',))
+        self.conn.commit()
+        self.assertEqual(self.client.latest('Berlin')[0], 0.0)
+
+    def test_cache_keeps_unchanged_cities(self):
+        """
+        Test that rows of another city and writes outside the readings keep the cached answers of a city.
+        """
+        self.client.latest('Berlin')
+        self.client.average_since('Berlin', 7)
+        today = datetime.date.today().isoformat()
+        weather_info_insert(reading('Paris', today, 15.0), self.conn, self.conn.cursor())
+        self.conn.execute("INSERT INTO city_names (query, city) VALUES ('paris', 'Paris')")
+        self.conn.commit()
+        hits = self.client.request('stats')['hits']
+        self.client.latest('Berlin')
+        self.assertEqual(self.client.average_since('Berlin', 7), 20.0)
+        self.assertEqual(self.client.average_since('Paris', 7), 15.0)
+        stats = self.client.request('stats')
+        self.assertEqual(stats['hits'], hits + 2)
+        self.assertEqual(stats['refreshes'], 2)
+
+    def test_cli_uses_server_and_falls_back(self):
+        """
+        Test that the CLI gives the same answer through the server and, once it is stopped, from the database.
+        """
+        runner = CliRunner()
+        through_server = runner.invoke(weather_cli.cli, ['--database', self.database, 'compare', 'week', 'Berlin'])
+        self.assertIn("above the average temperature for the past week", through_server.output)
+        self.assertEqual(self.client.request('stats')['queries'], 2)
+        self.server.shutdown()
+        self.server.server_close()
+        direct = runner.invoke(weather_cli.cli, ['--database', self.database, 'compare', 'week', 'Berlin'])
+        self.assertEqual(direct.output, through_server.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
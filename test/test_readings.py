@@ -0,0 +1,39 @@
+import unittest
+from src.mock_weatherapi import current_payload, history_payload
+from src.readings import Reading, ReadingBatch, as_reading, parse_current_weather, parse_historic_hours, \
+    parse_historic_weather
+
+
+class TestReadings(unittest.TestCase):
+    """
+    The TestReadings class is a unit test class that tests the reading records and the payload parsers of the
+    src.readings module.
+    """
+
+    def test_parsers(self):
+        """
+        Test that every payload is parsed into its reading type.
+        """
+        current = parse_current_weather(current_payload('Berlin'))
+        self.assertEqual((current.city, current.country, current.latitude), ('Berlin', 'Mockland', 50.11))
+        day = parse_historic_weather(history_payload('Berlin', '2023-05-01'))
+        seed = sum(map(ord, 'Berlin2023-05-01'))
+        self.assertEqual((day.update_datetime, day.temperature), ('2023-05-01', float(seed % 35)))
+        hours = parse_historic_hours(history_payload('Berlin', '2023-05-01'))
+        self.assertTrue(hours.hourly)
+        self.assertEqual(len(hours), 24)
+        self.assertEqual(list(hours.hourly_rows())[12][:3], ('Berlin', '2023-05-01 12:00', day.temperature))
+
+    def test_batch_round_trip(self):
+        """
+        Test that a batch gives back the readings added to it and that dictionaries are converted.
+        """
+        readings = [Reading('Berlin', 'Germany', 52.5, 13.4, 20.5, 60, 10.0, 0.0, '2023-05-01 10:00'),
+                    Reading('Paris', 'France', 48.9, 2.4, 22.0, 55, 5.0, 1.5, '2023-05-01 10:00')]
+        self.assertEqual(list(ReadingBatch(readings)), readings)
+        self.assertEqual(as_reading(dict(readings[0]._asdict(), query='berlin')), readings[0])
+        self.assertIs(as_reading(readings[1]), readings[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import gzip
+import json
+import os
+import tempfile
+from src.mock_weatherapi import start_mock_server
+from src.recording import Recorder, load_recording
+from src.weather_client import WeatherClient
+
+
+class TestRecording(unittest.TestCase):
+    """
+    The TestRecording class is a unit test class that tests the recording of API responses of the
+    src.recording module and their replay and error injection by the mock weather API.
+    """
+
+    def setUp(self):
+        """
+        Set up a mock weather API and a recording file.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'responses.jsonl.gz')
+        self.server, self.base_url = start_mock_server()
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.server.shutdown()
+        self.directory.cleanup()
+
+    def test_record_and_replay(self):
+        """
+        Test that the recorded responses are written without the API key and answered again by a mock started
+        with the recording, bulk responses by city and unrecorded requests with synthetic data.
+        """
+        client = WeatherClient(self.base_url, recorder=Recorder(self.path))
+        client.current('Berlin', 'SECRET')
+        client.history('Berlin', 'SECRET', '2023-05-01')
+        client.bulk_current(['Paris'], 'SECRET')
+        self.server.unknown_cities.add('Atlantis')
+        client.current('Atlantis', 'SECRET')
+        client.close()
+        with gzip.open(self.path, 'rt') as file:
+            text = file.read()
+        self.assertNotIn('SECRET', text)
+        self.assertEqual([json.loads(line)['endpoint'] for line in text.splitlines()],
+                         ['current', 'history', 'current_bulk', 'current'])
+        self.assertEqual(sorted(load_recording(self.path)), [('current', 'atlantis'), ('current', 'berlin'),
+                                                             ('current', 'paris'),
+                                                             ('history', 'berlin', '2023-05-01')])
+
+        recorded = {json.loads(line)['endpoint']: json.loads(line)['data'] for line in text.splitlines()[:2]}
+        recorded['current']['current']['temp_c'] = -40.0
+        with gzip.open(self.path, 'wt') as file:
+            file.write(json.dumps({'endpoint': 'current', 'q': 'Berlin', 'dt': None, 'status': 200,
+                                   'data': recorded['current']}) + '\n')
+            file.write(json.dumps({'endpoint': 'history', 'q': 'Berlin', 'dt': '2023-05-01', 'status': 200,
+                                   'data': recorded['history']}) + '\n')
+        server, base_url = start_mock_server(recording=self.path)
+        client = WeatherClient(base_url)
+        try:
+            self.assertEqual(client.current('berlin', 'key').data['current']['temp_c'], -40.0)
+            self.assertEqual(client.history('Berlin', 'key', '2023-05-01').data, recorded['history'])
+            self.assertEqual(client.current('Rome', 'key').data['location']['name'], 'Rome')
+        finally:
+            client.close()
+            server.shutdown()
+
+    def test_error_mix_and_rate(self):
+        """
+        Test that the mock answers the configured fraction of requests with an error and the requests above
+        its rate with 429.
+        """
+        client = WeatherClient(self.base_url, max_retries=0)
+        self.server.errors = {503: 1.0}
+        self.assertEqual(client.current('Berlin', 'key').status_code, 503)
+        self.server.errors = {}
+        self.server.rate = 2
+        statuses = [client.current('Berlin', 'key').status_code for _ in range(5)]
+        # The requests can fall into two seconds, one of them still holds three requests
+        self.assertEqual(statuses[:2], [200, 200])
+        self.assertIn(429, statuses)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
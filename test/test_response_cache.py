@@ -0,0 +1,91 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+from src.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    The TestResponseCache class is a unit test class that tests the expiry, eviction and
+    persistence of the src.response_cache module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment before each test case is executed.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.db')
+        self.endpoint = 'http://weather.test/v1/history.json'
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.directory.cleanup()
+
+    def test_key_ignores_api_key(self):
+        """
+        Test that the same request made with another API key hits the cache.
+        """
+        cache = ResponseCache(self.path)
+        cache.put(self.endpoint, {'q': 'City', 'dt': '2023-04-15', 'key': 'A'}, {'day': 1})
+        self.assertEqual(cache.get(self.endpoint, {'key': 'B', 'dt': '2023-04-15', 'q': 'City'}), {'day': 1})
+        self.assertIsNone(cache.get(self.endpoint, {'q': 'City', 'dt': '2023-04-16', 'key': 'A'}))
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1, 'evictions': 0})
+        cache.close()
+
+    def test_ttl_expiry(self):
+        """
+        Test that entries with a TTL expire and entries without one are kept.
+        """
+        cache = ResponseCache(self.path)
+        with patch('src.response_cache.time.time', return_value=1000.0):
+            cache.put(self.endpoint, {'q': 'Current'}, {'now': 1}, ttl=60)
+            cache.put(self.endpoint, {'q': 'History'}, {'day': 1})
+        with patch('src.response_cache.time.time', return_value=1000.0 + 10 ** 6):
+            self.assertIsNone(cache.get(self.endpoint, {'q': 'Current'}))
+            self.assertEqual(cache.get(self.endpoint, {'q': 'History'}), {'day': 1})
+        self.assertEqual(cache.size, 1)
+        cache.close()
+
+    def test_lru_eviction_and_persistence(self):
+        """
+        Test that the least recently used entry is evicted and that the entries survive a reopen.
+        """
+        cache = ResponseCache(self.path, max_entries=2)
+        cache.put(self.endpoint, {'q': 'A'}, {'city': 'A'})
+        cache.put(self.endpoint, {'q': 'B'}, {'city': 'B'})
+        cache.get(self.endpoint, {'q': 'A'})
+        cache.put(self.endpoint, {'q': 'C'}, {'city': 'C'})
+        self.assertIsNone(cache.get(self.endpoint, {'q': 'B'}))
+        self.assertEqual(cache.stats['evictions'], 1)
+        cache.close()
+
+        cache = ResponseCache(self.path, max_entries=2)
+        self.assertEqual(cache.size, 2)
+        self.assertEqual(cache.get(self.endpoint, {'q': 'A'}), {'city': 'A'})
+        self.assertEqual(cache.get(self.endpoint, {'q': 'C'}), {'city': 'C'})
+        cache.close()
+
+    def test_hits_do_not_write(self):
+        """
+        Test that cache hits keep their access time in memory until the cache closes.
+        """
+        cache = ResponseCache(self.path)
+        cache.put(self.endpoint, {'q': 'A'}, {'city': 'A'})
+        cache.put(self.endpoint, {'q': 'B'}, {'city': 'B'})
+        changes = cache.conn.total_changes
+        for _ in range(3):
+            cache.get(self.endpoint, {'q': 'A'})
+        self.assertEqual(cache.conn.total_changes, changes)
+        cache.close()
+        cache = ResponseCache(self.path)
+        oldest = cache.conn.execute("SELECT key FROM responses ORDER BY accessed LIMIT 1").fetchone()[0]
+        self.assertEqual(oldest, ResponseCache.make_key(self.endpoint, {'q': 'B'}))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
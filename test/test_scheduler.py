@@ -0,0 +1,81 @@
+import unittest
+import asyncio
+import time
+from src.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    The TestScheduler class is a unit test class that tests the timing, skipping and coalescing
+    of the src.scheduler module.
+    """
+
+    def run_for(self, scheduler, seconds):
+        """
+        Runs the scheduler on a new event loop and stops it after the given number of seconds.
+        """
+        async def main():
+            asyncio.get_running_loop().call_later(seconds, scheduler.stop)
+            await scheduler.run(handle_signals=False)
+        asyncio.run(main())
+
+    def test_jobs_run_concurrently(self):
+        """
+        Test that a slow job does not delay another job.
+        """
+        runs = {'slow': 0, 'fast': 0}
+
+        async def slow():
+            runs['slow'] += 1
+            await asyncio.sleep(0.35)
+
+        def fast():
+            runs['fast'] += 1
+
+        scheduler = Scheduler()
+        slow_job = scheduler.every(0.1, 'slow', slow)
+        fast_job = scheduler.every(0.1, 'fast', fast)
+        self.run_for(scheduler, 0.55)
+        self.assertGreaterEqual(runs['fast'], 5)
+        """ The slow job runs once per 0.35s, the slots in between are skipped """
+        self.assertEqual(runs['slow'], 2)
+        self.assertGreaterEqual(slow_job.skipped, 3)
+        self.assertEqual(fast_job.skipped, 0)
+
+    def test_missed_runs_are_coalesced(self):
+        """
+        Test that slots missed while the event loop was blocked lead to one run, not a burst of runs.
+        """
+        runs = []
+
+        def job():
+            runs.append(time.monotonic())
+
+        def block():
+            time.sleep(0.35)
+
+        scheduler = Scheduler()
+        recurring = scheduler.every(0.05, 'job', job)
+        scheduler.every(10, 'block', block, first_run=0.05)
+        self.run_for(scheduler, 0.5)
+        self.assertGreaterEqual(recurring.coalesced, 5)
+        self.assertLess(len(runs), 8)
+
+    def test_stop_waits_for_running_jobs(self):
+        """
+        Test that stopping the scheduler lets a running job finish.
+        """
+        finished = []
+
+        async def job():
+            await asyncio.sleep(0.2)
+            finished.append(True)
+
+        scheduler = Scheduler()
+        scheduler.every(60, 'job', job)
+        self.run_for(scheduler, 0.05)
+        self.assertEqual(finished, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
 import unittest
+import datetime
+import json
+import os
 import sqlite3
+import subprocess
+import sys
+import tempfile
+from src.weather_db import migrate, connect, weather_info_bulk_insert
 import click
 from click.testing import CliRunner
 from src import weather_cli
 from src.weather_cli import latest, compare, average
 from src.weather_fetcher import weather_info_insert
+from src.mock_weatherapi import history_payload
+from src.readings import parse_historic_hours
 
 
 class TestWeatherCli(unittest.TestCase):
@@ -35,6 +44,7 @@ class TestWeatherCli(unittest.TestCase):
               precipitation REAL,
               update_datetime TEXT,                         
               CONSTRAINT ct UNIQUE (city, update_datetime))''')
+        migrate(self.conn)
 
         test_data = [{'city': 'Frankfurt',
                       'country': 'Germany',
@@ -157,6 +167,101 @@ class TestWeatherCli(unittest.TestCase):
         self.assertIn(result.output.strip(),expected_output)
 
 
+    def test_database_option_and_environment(self):
+        """
+        Test that the group opens the database given by --database or WEATHER_DB only when a command runs.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather.db')
+            conn = connect(path)
+            weather_info_insert({'city': 'Berlin', 'country': 'Germany', 'latitude': 52.52, 'longitude': 13.4,
+                                 'temperature': 12.5, 'humidity': 60, 'wind_speed': 8.1, 'precipitation': 0.0,
+                                 'update_datetime': '2023-04-13 10:00'}, conn, conn.cursor())
+            conn.close()
+            expected_output = "Temperature: 12.5°C, Humidity: 60%, Wind Speed: 8.1m/s, update_datetime: 2023-04-13 10:00"
+            result = self.runner.invoke(weather_cli.cli, ['latest', 'Berlin'], env={'WEATHER_DB': path})
+            self.assertEqual(result.output.strip(), expected_output)
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'latest', 'Berlin'])
+            self.assertEqual(result.output.strip(), expected_output)
+            result = self.runner.invoke(weather_cli.cli, ['--help'], env={'WEATHER_DB': os.path.join(directory, 'x')})
+            self.assertEqual(result.exit_code, 0)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'x')))
+
+    def test_history_command(self):
+        """
+        Test the CSV and NDJSON output of the history command and its filters, with chunks smaller than the result.
+        """
+        result = self.runner.invoke(weather_cli.history, ['--city', 'Frankfurt', '--start', '2023-04-01', '--end',
+                                                          '2023-04-13', '--metric', 'temperature', '--chunk-size', '1'],
+                                    obj=self.conn)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.splitlines(), ['city,update_datetime,temperature',
+                                                      'Frankfurt,2023-04-13,27.5',
+                                                      'Frankfurt,2023-04-13 19:45,27.5'])
+        result = self.runner.invoke(weather_cli.cli.commands['dump'], ['--format', 'ndjson', '--start', '2023-04-13',
+                                                                       '--end', '2023-04-13'], obj=self.conn)
+        lines = [json.loads(line) for line in result.output.splitlines()]
+        self.assertEqual([line['city'] for line in lines], ['Frankfurt', 'Frankfurt', 'Heidelberg', 'Munich',
+                                                            'Stuttgart'])
+        self.assertEqual(lines[0], {'city': 'Frankfurt', 'update_datetime': '2023-04-13', 'temperature': 27.5,
+                                    'humidity': 35, 'wind_speed': 46.6, 'precipitation': 5.9})
+
+    def test_hourly_only_database(self):
+        """
+        Test that latest, compare, stats, history and export read a database holding only hourly readings.
+        """
+        today = datetime.date.today()
+        days = [(today - datetime.timedelta(days=offset)).isoformat() for offset in (2, 1)]
+        hours = [parse_historic_hours(history_payload('Berlin', day)) for day in days]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'weather.db')
+            conn = connect(path)
+            weather_info_bulk_insert(hours, conn, conn.cursor())
+            conn.close()
+            newest = f"{hours[1].temperature[23]}°C"
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'latest', 'Berlin'])
+            self.assertIn(f"Temperature: {newest}", result.output)
+            self.assertIn(f"update_datetime: {days[1]} 23:00", result.output)
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'compare', 'week', 'Berlin'])
+            self.assertIn(f"The current temperature is {newest}", result.output)
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'stats', 'Berlin', '--days', '7',
+                                                          '--format', 'json'])
+            self.assertEqual(json.loads(result.output)['cities']['Berlin']['summary']['temperature']['count'], 48)
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'history', '--city', 'Berlin', '--metric',
+                                                          'temperature'])
+            lines = result.output.splitlines()
+            self.assertEqual((len(lines), lines[1]), (49, f"Berlin,{days[0]} 00:00,{hours[0].temperature[0]}"))
+            export = os.path.join(directory, 'export')
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'export', export])
+            self.assertIn("Exported 48 rows", result.output)
+            result = self.runner.invoke(weather_cli.cli, ['--database', path, 'export', export])
+            self.assertIn("Exported 0 rows", result.output)
+
+    def test_import_is_lazy(self):
+        """
+        Test that importing the commands neither imports the HTTP client and asyncio nor creates the database.
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run([sys.executable, '-c', "import sys, src.weather_cli, src.weather_fetcher; "
+                                     "print(sorted({'requests', 'asyncio'} & set(sys.modules)))"],
+                                    cwd=directory, env=dict(os.environ, PYTHONPATH=root), capture_output=True,
+                                    text=True)
+            self.assertEqual(result.stdout.strip(), '[]', result.stderr)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_migration_messages_on_stderr(self):
+        """
+        Test that the migrations of a new database do not end up in the output of a command.
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run([sys.executable, '-m', 'src.weather_cli', '--database',
+                                     os.path.join(directory, 'weather.db'), 'latest', 'Berlin'],
+                                    env=dict(os.environ, PYTHONPATH=root), capture_output=True, text=True)
+        self.assertEqual(result.stdout, "No data available for Berlin.\n")
+        self.assertIn("Migrated weather database to version 1", result.stderr)
+
 
 if __name__ == '__main__':
     unittest.main()
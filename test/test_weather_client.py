@@ -0,0 +1,99 @@
+import unittest
+import time
+from unittest.mock import patch, MagicMock
+import requests
+from src.weather_client import WeatherClient, TokenBucket
+
+
+def make_response(status_code, payload, headers=None):
+    """
+    Builds a requests.Response returning the given payload as JSON.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.json = lambda: payload
+    return response
+
+
+class TestWeatherClient(unittest.TestCase):
+    """
+    The TestWeatherClient class is a unit test class that tests the retries, backoff, statistics
+    and rate limiting of the src.weather_client module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment before each test case is executed.
+        """
+        self.client = WeatherClient('http://weather.test/v1', timeout=2.0, max_retries=3, backoff=0.5)
+        self.endpoint = self.client.current_api
+        self.params = {'q': 'City', 'key': 'API_KEY'}
+
+    @patch('src.weather_client.time.sleep')
+    def test_retry_on_server_error(self, mock_sleep):
+        """
+        Test that 503 and 429 responses are retried with a bounded exponential backoff until the call succeeds.
+        """
+        self.client.session.get = MagicMock(side_effect=[make_response(503, {}),
+                                                         make_response(429, {}),
+                                                         make_response(200, {'current': {}})])
+        result = self.client.request(self.endpoint, self.params)
+        self.assertEqual(result.data, {'current': {}})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.retries, 2)
+        self.assertEqual(self.client.stats['retries'], 2)
+        self.assertEqual(self.client.stats['errors'], 0)
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertLessEqual(delays[0], 0.5)
+        self.assertLessEqual(delays[1], 1.0)
+        self.client.session.get.assert_called_with(self.endpoint, params=self.params, timeout=2.0)
+
+    @patch('src.weather_client.time.sleep')
+    def test_retry_after_header(self, mock_sleep):
+        """
+        Test that the Retry-After header of a 429 response is used as delay, capped at max_backoff.
+        """
+        self.client.session.get = MagicMock(side_effect=[make_response(429, {}, {'Retry-After': '7'}),
+                                                         make_response(429, {}, {'Retry-After': '3600'}),
+                                                         make_response(200, {})])
+        self.client.request(self.endpoint, self.params)
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [7.0, 30.0])
+
+    @patch('src.weather_client.time.sleep')
+    def test_connection_error_gives_up(self, mock_sleep):
+        """
+        Test that connection errors are retried and give an empty response once the retries are exhausted.
+        """
+        self.client.session.get = MagicMock(side_effect=requests.exceptions.ConnectionError("refused"))
+        result = self.client.request(self.endpoint, self.params)
+        self.assertIsNone(result.data)
+        self.assertIsNone(result.status_code)
+        self.assertEqual(result.retries, 3)
+        self.assertEqual(self.client.session.get.call_count, 4)
+        self.assertEqual(self.client.stats['errors'], 1)
+
+    def test_client_error_not_retried(self):
+        """
+        Test that a 400 response such as an unknown city is returned immediately.
+        """
+        error = {'error': {'code': 1006, 'message': 'No matching location found.'}}
+        self.client.session.get = MagicMock(return_value=make_response(400, error))
+        result = self.client.request(self.endpoint, self.params)
+        self.assertEqual(result.data, error)
+        self.assertEqual(result.retries, 0)
+        self.assertEqual(self.client.session.get.call_count, 1)
+
+    def test_token_bucket_rate_limit(self):
+        """
+        Test that the token bucket does not hand out more tokens than its rate allows.
+        """
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.perf_counter()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.perf_counter() - started, 0.18)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import sqlite3
+from src.readings import Fetched, ReadingBatch
+from src.weather_db import migrate, rebuild_rollups, weather_info_bulk_insert, SCHEMA_VERSION
+
+
+class TestWeatherDb(unittest.TestCase):
+    """
+    The TestWeatherDb class is a unit test class that tests the schema migrations
+    of the src.weather_db module.
+    """
+
+    def setUp(self):
+        """
+        Set up a database with the weather table as it was created before the migrations existed.
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS weather
+             (id INTEGER PRIMARY KEY,
+              city TEXT,
+              country TEXT,
+              latitude REAL,
+              longitude REAL,
+              temperature REAL,
+              humidity INTEGER,
+              wind_speed REAL,
+              precipitation REAL,
+              update_datetime TEXT,
+              CONSTRAINT ct UNIQUE (city, update_datetime))''')
+        self.conn.executemany("INSERT INTO weather (city, temperature, update_datetime) VALUES (?, ?, ?)",
+                              [('Frankfurt', 27.5, '2023-04-13 19:45'), ('Frankfurt', 35.5, '2023-04-15')])
+        self.conn.commit()
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.conn.close()
+
+    def test_migrate_existing_database(self):
+        """
+        Test that an existing database is migrated in place and its rows get the typed time columns.
+        """
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+        self.assertEqual(self.conn.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+        rows = self.conn.execute("SELECT update_epoch, update_date FROM weather ORDER BY id").fetchall()
+        self.assertEqual(rows, [(1681415100, '2023-04-13'), (1681516800, '2023-04-15')])
+        """ Running the migration again does nothing """
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+
+    def test_queries_use_index(self):
+        """
+        Test that the city/time queries of the CLI are answered from the indexes and rollup keys, and that the
+        covering index replaced by the rollups is gone.
+        """
+        migrate(self.conn)
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT temperature FROM weather "
+                                 "WHERE city=? ORDER BY update_epoch DESC LIMIT 1", ('Frankfurt',)).fetchall()
+        self.assertIn("USING INDEX weather_city_epoch", str(plan))
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT temperature_day_mean_sum FROM weather_monthly "
+                                 "WHERE city=? AND month=?", ('Frankfurt', '2023-04')).fetchall()
+        self.assertIn("USING PRIMARY KEY (city=? AND month=?)", str(plan))
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT * FROM weather WHERE city=? AND update_datetime >=? "
+                                 "AND update_datetime < date(?, '+1 day')",
+                                 ('Frankfurt', '2023-04-13', '2023-04-13')).fetchall()
+        self.assertIn("USING INDEX sqlite_autoindex_weather_1", str(plan))
+        indexes = self.conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='weather_city_date'")
+        self.assertIsNone(indexes.fetchone())
+
+    def test_rollups_follow_raw_data(self):
+        """
+        Test that the triggers keep the rollups equal to a rebuild from the raw data through inserts,
+        updates and deletes, and that days of different months are not merged.
+        """
+        migrate(self.conn)
+        self.conn.executemany("INSERT INTO weather (city, temperature, humidity, update_datetime, update_date) "
+                              "VALUES (?, ?, ?, ?, date(?))",
+                              [('Frankfurt', 10.0, 40, '2023-04-13 08:00', '2023-04-13 08:00'),
+                               ('Frankfurt', 25.5, 50, '2023-03-13', '2023-03-13')])
+        self.conn.execute("UPDATE weather SET temperature = 40.0 WHERE update_datetime = '2023-04-15'")
+        self.conn.execute("DELETE FROM weather WHERE update_datetime = '2023-04-13 19:45'")
+        self.conn.commit()
+        query_daily = "SELECT * FROM weather_daily ORDER BY city, day"
+        query_monthly = "SELECT * FROM weather_monthly ORDER BY city, month"
+        incremental = (self.conn.execute(query_daily).fetchall(), self.conn.execute(query_monthly).fetchall())
+        self.assertEqual(rebuild_rollups(self.conn), 3)
+        rebuilt = (self.conn.execute(query_daily).fetchall(), self.conn.execute(query_monthly).fetchall())
+        self.assertEqual(incremental, rebuilt)
+
+        april = self.conn.execute("SELECT temperature_count, temperature_sum, temperature_min, temperature_max, "
+                                  "humidity_count FROM weather_monthly WHERE city='Frankfurt' AND month='2023-04'")
+        self.assertEqual(april.fetchone(), (2, 50.0, 10.0, 40.0, 1))
+        """ The monthly row also holds the two daily means of April, 10.0 and 40.0 """
+        april = self.conn.execute("SELECT temperature_days, temperature_day_mean_sum FROM weather_monthly "
+                                  "WHERE city='Frankfurt' AND month='2023-04'")
+        self.assertEqual(april.fetchone(), (2, 50.0))
+        march = self.conn.execute("SELECT temperature_sum FROM weather_daily WHERE day='2023-03-13'")
+        self.assertEqual(march.fetchone(), (25.5,))
+
+    def test_bulk_insert_weather_data_to_db(self):
+        """
+        Test the batched insert with both conflict policies and a flush size smaller than the input.
+        """
+        migrate(self.conn)
+        c = self.conn.cursor()
+        rows = [{'city': 'TestCity', 'country': 'TestCountry', 'latitude': 26.43, 'longitude': 50.11,
+                 'temperature': 20.0 + day, 'humidity': 35, 'wind_speed': 45.6, 'precipitation': 5.9,
+                 'update_datetime': f'2023-04-{day:02d}'} for day in range(1, 11)]
+        counts = weather_info_bulk_insert(iter(rows), self.conn, c, flush_size=3)
+        self.assertEqual(counts, {'inserted': 10, 'updated': 0, 'skipped': 0, 'failed': 0})
+
+        rows[0] = dict(rows[0], temperature=-5.0)
+        counts = weather_info_bulk_insert(rows, self.conn, c, flush_size=3)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'skipped': 10, 'failed': 0})
+
+        rows.append(dict(rows[1], update_datetime='2023-04-11'))
+        counts = weather_info_bulk_insert(rows, self.conn, c, policy='update', flush_size=4)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1, 'skipped': 9, 'failed': 0})
+        c.execute("SELECT temperature FROM weather WHERE city='TestCity' AND update_datetime='2023-04-01'")
+        self.assertEqual(c.fetchone()[0], -5.0)
+
+    def test_hourly_readings_in_rollups(self):
+        """
+        Test that the hourly readings are bulk inserted into their own table and counted in the rollups, which
+        stay equal to a rebuild through inserts, updates and a change of a raw reading of the same day.
+        """
+        migrate(self.conn)
+        c = self.conn.cursor()
+        hours = ReadingBatch(hourly=True)
+        for hour in range(24):
+            hours.add('Frankfurt', 'Germany', 50.1, 8.7, float(hour), 50, 5.0, 0.0, f'2023-04-13 {hour:02d}:00')
+        counts = weather_info_bulk_insert([Fetched('frankfurt', hours)], self.conn, c)
+        self.assertEqual(counts, {'inserted': 24, 'updated': 0, 'skipped': 0, 'failed': 0})
+        hours.temperature[0] = 30.0
+        counts = weather_info_bulk_insert([Fetched('frankfurt', hours)], self.conn, c, policy='update')
+        self.assertEqual(counts, {'inserted': 0, 'updated': 1, 'skipped': 23, 'failed': 0})
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM weather WHERE update_date = '2023-04-13'")
+                         .fetchone()[0], 1)
+        self.conn.execute("UPDATE weather SET temperature = 0.0 WHERE update_datetime = '2023-04-13 19:45'")
+        self.conn.commit()
+        query = ("SELECT temperature_count, temperature_sum, temperature_min, temperature_max FROM weather_daily "
+                 "WHERE day = '2023-04-13'")
+        """ 24 hours from 0.0 to 23.0 with 30.0 instead of 0.0, and the raw reading set to 0.0 """
+        self.assertEqual(self.conn.execute(query).fetchone(), (25, 306.0, 0.0, 30.0))
+        incremental = self.conn.execute("SELECT * FROM weather_monthly ORDER BY month").fetchall()
+        rebuild_rollups(self.conn)
+        self.assertEqual(self.conn.execute(query).fetchone(), (25, 306.0, 0.0, 30.0))
+        self.assertEqual(self.conn.execute("SELECT * FROM weather_monthly ORDER BY month").fetchall(), incremental)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,18 @@
 import unittest
-from src.weather_fetcher import weather_info_insert, weather_api_call
+import asyncio
+import os
+import tempfile
+from click.testing import CliRunner
+from src import weather_fetcher
+from src.weather_fetcher import weather_info_insert, weather_api_call, backfill_historic_weather, run_latest_weather
+from src.weather_writer import WeatherWriter
+from src.weather_client import WeatherClient
+from src.response_cache import ResponseCache
+from src.scheduler import Scheduler
+from src.mock_weatherapi import start_mock_server
 from unittest.mock import patch
 import sqlite3
+from src.weather_db import migrate, connect
 import requests
 
 
@@ -31,7 +42,20 @@ class TestWeatherFetcher(unittest.TestCase):
               precipitation REAL,
               update_datetime TEXT,                         
               CONSTRAINT ct UNIQUE (city, update_datetime))''')
+        migrate(self.conn)
         self.conn.commit()
+        """ The fetch pipeline writes through a WeatherWriter thread, which needs a database file """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'weather_data.db')
+        self.reader = connect(self.database)
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.reader.close()
+        self.conn.close()
+        self.directory.cleanup()
 
     def test_insert_weather_data_to_db(self):
         """
@@ -66,11 +90,11 @@ class TestWeatherFetcher(unittest.TestCase):
         self.assertEqual(result[8], 5.9)
         self.assertEqual(result[9], '2023-04-15 19:45')
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_weather_api_call_success(self, mock_get):
         """
         Test making a successful API call to fetch weather data.
-        Mock the requests.get() method with a successful response.
+        Mock the requests.Session.get() method with a successful response.
         """
         mock_response = requests.Response()
         mock_response.status_code = 200
@@ -91,12 +115,14 @@ class TestWeatherFetcher(unittest.TestCase):
             'current': {'temp_c': 25, 'humidity': 70, 'wind_mph': 5, 'precip_mm': 0, 'last_updated': '2023-04-15 19:45'}
         }
         self.assertEqual(result, expected_data)
-        mock_get.assert_called_once_with(endpoint, params=params)
+        mock_get.assert_called_once_with(endpoint, params=params, timeout=10.0)
 
-    @patch('requests.get')
-    def test_weather_api_call_failure(self, mock_get):
+    @patch('src.weather_client.time.sleep')
+    @patch('requests.Session.get')
+    def test_weather_api_call_failure(self, mock_get, mock_sleep):
         """
-        Test making a failed API call to fetch weather data.Mock the requests.get() method with a failed response
+        Test making a failed API call to fetch weather data.Mock the requests.Session.get() method with a failed
+        response, the call is retried and the last response is returned.
         """
         mock_response = requests.Response()
         mock_response.status_code = 500
@@ -110,7 +136,262 @@ class TestWeatherFetcher(unittest.TestCase):
 
         """ Assert that correct failed response is returned """
         self.assertEqual(result, {'error': 'Internal Server Error'})
-        mock_get.assert_called_once_with(endpoint, params=params)
+        self.assertEqual(mock_get.call_count, 4)
+        mock_get.assert_called_with(endpoint, params=params, timeout=10.0)
+
+    def test_backfill_historic_weather(self):
+        """
+        Test the concurrent backfill against the local mock API, every day has to be stored exactly once.
+        """
+        server, base_url = start_mock_server(latency=0.05)
+        writer = WeatherWriter(self.database, batch_size=8).start()
+        try:
+            retrieved = backfill_historic_weather('TestCity', 'API_KEY', 20, self.reader.cursor(), writer,
+                                                  WeatherClient(base_url, pool_size=10), concurrency=10)
+        finally:
+            writer.close()
+            server.shutdown()
+        self.assertEqual(retrieved, 20)
+        self.assertEqual(server.request_count, 20)
+        self.assertEqual(writer.totals['inserted'], 20)
+        rows = self.reader.execute("SELECT COUNT(DISTINCT update_datetime) FROM weather WHERE city=?", ('TestCity',))
+        self.assertEqual(rows.fetchone()[0], 20)
+        """ The 10 workers overlap their requests without exceeding the pool size """
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLessEqual(server.max_in_flight, 10)
+
+    def test_backfill_skips_stored_and_cached_days(self):
+        """
+        Test that a second backfill does not call the API for days already stored, and that a backfill into
+        an empty database is answered from the response cache.
+        """
+        server, base_url = start_mock_server()
+        client = WeatherClient(base_url, cache=ResponseCache(':memory:'))
+        c = self.reader.cursor()
+        try:
+            for days, requests_made, cache_hits in [(5, 5, 0), (7, 7, 0)]:
+                writer = WeatherWriter(self.database).start()
+                backfill_historic_weather('TestCity', 'API_KEY', days, c, writer, client)
+                writer.close()
+                self.assertEqual(server.request_count, requests_made)
+                self.assertEqual(client.cache.stats['hits'], cache_hits)
+
+            self.reader.execute("DELETE FROM weather")
+            self.reader.commit()
+            writer = WeatherWriter(self.database).start()
+            self.assertEqual(backfill_historic_weather('TestCity', 'API_KEY', 7, c, writer, client), 7)
+            writer.close()
+            self.assertEqual(server.request_count, 7)
+            self.assertEqual(client.cache.stats['hits'], 7)
+        finally:
+            server.shutdown()
+
+    def test_backfill_skips_stored_days_of_resolved_name(self):
+        """
+        Test that the stored days are found when the API returns another location name than the query.
+        """
+        server, base_url = start_mock_server()
+        server.locations['new york'] = 'New York'
+        client = WeatherClient(base_url)
+        c = self.reader.cursor()
+        try:
+            for query in ['new york', 'NEW YORK']:
+                writer = WeatherWriter(self.database).start()
+                backfill_historic_weather(query, 'API_KEY', 4, c, writer, client)
+                writer.close()
+                self.assertEqual(server.request_count, 4)
+        finally:
+            server.shutdown()
+        rows = self.reader.execute("SELECT city, COUNT(*) FROM weather GROUP BY city")
+        self.assertEqual(rows.fetchall(), [('New York', 4)])
+
+    def test_run_latest_weather(self):
+        """
+        Test polling several cities on the scheduler, the readings queued at shutdown have to be written.
+        """
+        server, base_url = start_mock_server(latency=0.05)
+        scheduler = Scheduler(jitter=0.05)
+        writer = WeatherWriter(self.database, max_delay=60).start()
+        cities = ['Berlin', 'Munich', 'Hamburg']
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.3, scheduler.stop)
+            return await run_latest_weather(cities, 'API_KEY', 10, writer, WeatherClient(base_url), scheduler,
+                                            concurrency=3)
+
+        try:
+            totals = asyncio.run(main())
+        finally:
+            writer.close()
+            server.shutdown()
+        self.assertEqual(totals['retrieved'], 3)
+        self.assertEqual(writer.totals['inserted'], 3)
+        rows = self.reader.execute("SELECT city FROM weather ORDER BY city")
+        self.assertEqual(rows.fetchall(), [('Berlin',), ('Hamburg',), ('Munich',)])
+
+    def test_run_latest_weather_bulk(self):
+        """
+        Test that batches of cities take one bulk request each, N cities cost N / batch_size requests.
+        """
+        server, base_url = start_mock_server()
+        server.unknown_cities.add('Atlantis')
+        scheduler = Scheduler(jitter=0)
+        writer = WeatherWriter(self.database, max_delay=60).start()
+        cities = [f'City {index}' for index in range(11)] + ['Atlantis']
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.3, scheduler.stop)
+            return await run_latest_weather(cities, 'API_KEY', 10, writer, WeatherClient(base_url), scheduler,
+                                            batch_size=4)
+
+        try:
+            totals = asyncio.run(main())
+        finally:
+            writer.close()
+            server.shutdown()
+        self.assertEqual(server.request_count, 3)
+        self.assertEqual(totals, {'retrieved': 11, 'unchanged': 0, 'failed': 1})
+        self.assertEqual(writer.totals['inserted'], 11)
+
+    def test_bulk_fallback_to_single_requests(self):
+        """
+        Test that without bulk access the cities are requested one by one over one keep-alive connection,
+        and parsed into the same records as the bulk and single paths.
+        """
+        server, base_url = start_mock_server(update_interval=3600)
+        client = WeatherClient(base_url)
+        cities = ['Berlin', 'Munich', 'Hamburg', 'Cologne']
+        try:
+            bulk = weather_fetcher.fetch_current_weather_batch(cities[:2], 'API_KEY', client)
+            self.assertEqual(server.request_count, 1)
+            server.bulk_enabled = False
+            client.bulk_supported = None
+            single = weather_fetcher.fetch_current_weather_batch(cities[:2], 'API_KEY', client)
+            single.update(weather_fetcher.fetch_current_weather_batch(cities[2:], 'API_KEY', client))
+        finally:
+            client.close()
+            server.shutdown()
+        """ One rejected bulk request, then one request per city """
+        self.assertEqual(server.request_count, 1 + 1 + 4)
+        self.assertFalse(client.bulk_supported)
+        self.assertEqual(server.connection_count, 1)
+        self.assertEqual(bulk['Berlin'], single['Berlin'])
+        self.assertEqual(single['Cologne'][0], 'changed')
+        self.assertEqual(single['Cologne'][1].city, 'Cologne')
+
+    def test_get_historic_weather_multiple_cities(self):
+        """
+        Test the multi-city mode with cities from arguments and a file, an unknown city must not stop the batch.
+        """
+        server, base_url = start_mock_server()
+        server.unknown_cities.add('Atlantis')
+        runner = CliRunner()
+        try:
+            with runner.isolated_filesystem():
+                with open('cities.txt', 'w') as cities_file:
+                    cities_file.write("# cities\nMunich\n\nAtlantis\nBerlin\n")
+                result = runner.invoke(weather_fetcher.cli, ['--database', self.database, 'get-historic-weather',
+                                                             'Berlin', 'Hamburg', 'API_KEY', '3', '--cities-file',
+                                                             'cities.txt', '--base-url', base_url])
+        finally:
+            server.shutdown()
+        self.assertEqual(result.exit_code, 0, result.output)
+        rows = self.reader.execute("SELECT city, COUNT(*) FROM weather GROUP BY city ORDER BY city")
+        self.assertEqual(rows.fetchall(), [('Berlin', 3), ('Hamburg', 3), ('Munich', 3)])
+        self.assertIn("Finished Atlantis city: 0 days retrieved, 3 days failed", result.output)
+        self.assertIn("Historic weather data is incomplete for cities: Atlantis", result.output)
+        self.assertIn("Database writes: 9 inserted", result.output)
+
+    def test_sync_fetches_only_gaps(self):
+        """
+        Test that sync reports the gaps of every city, requests only the missing days and that the next sync
+        checks no day thanks to the high-water marks.
+        """
+        window = weather_fetcher.sync_window(5)
+        for day in window[1:3]:
+            weather_info_insert({'city': 'Berlin', 'country': 'Germany', 'latitude': 52.5, 'longitude': 13.4,
+                                 'temperature': 20.0, 'humidity': 60, 'wind_speed': 10.0, 'precipitation': 0.0,
+                                 'update_datetime': day}, self.reader, self.reader.cursor())
+        self.assertEqual(weather_fetcher.gap_ranges([window[0], *window[3:]]),
+                         [(window[0], window[0]), (window[3], window[4])])
+        server, base_url = start_mock_server()
+        runner = CliRunner()
+        arguments = ['--database', self.database, 'sync', 'Berlin', 'Hamburg', 'API_KEY', '--days', '5',
+                     '--base-url', base_url, '--no-cache']
+        try:
+            dry_run = runner.invoke(weather_fetcher.cli, arguments + ['--dry-run'])
+            self.assertEqual(server.request_count, 0)
+            result = runner.invoke(weather_fetcher.cli, arguments)
+            self.assertEqual(server.request_count, 3 + 5)
+            again = runner.invoke(weather_fetcher.cli, arguments)
+            self.assertEqual(server.request_count, 8)
+        finally:
+            server.shutdown()
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn(f"Berlin: 3 missing days in 2 gaps, 5 days checked: {window[0]}, {window[3]}..{window[4]}",
+                      dry_run.output)
+        self.assertIn("8 missing days for 2 cities", dry_run.output)
+        self.assertIn("Database writes: 8 inserted", result.output)
+        self.assertNotIn("incomplete", result.output)
+        self.assertIn("Hamburg: 0 missing days in 0 gaps, 0 days checked", again.output)
+        marks = self.reader.execute("SELECT query, synced_from, synced_through FROM sync_marks ORDER BY query")
+        self.assertEqual(marks.fetchall(), [('Berlin', window[0], window[-1]), ('Hamburg', window[0], window[-1])])
+
+    def test_sync_rejects_empty_window(self):
+        """
+        Test that sync refuses a window without days instead of failing while advancing the high-water marks.
+        """
+        result = CliRunner().invoke(weather_fetcher.cli, ['--database', self.database, 'sync', 'Berlin', 'API_KEY',
+                                                          '--days', '0'])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("Invalid value for '--days'", result.output)
+
+    def test_get_historic_weather_hourly(self):
+        """
+        Test that the hourly mode stores the 24 hours of every day and that the days are not requested again.
+        """
+        server, base_url = start_mock_server()
+        runner = CliRunner()
+        arguments = ['--database', self.database, 'get-historic-weather', 'Berlin', 'API_KEY', '2', '--hourly',
+                     '--base-url', base_url, '--no-cache']
+        try:
+            result = runner.invoke(weather_fetcher.cli, arguments)
+            again = runner.invoke(weather_fetcher.cli, arguments)
+        finally:
+            server.shutdown()
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(server.request_count, 2)
+        self.assertIn("Database writes: 48 inserted", result.output)
+        self.assertIn("Nothing to retrieve for Berlin city, all 2 days are stored", again.output)
+        self.assertEqual(self.reader.execute("SELECT COUNT(*) FROM weather").fetchone()[0], 0)
+        rows = self.reader.execute("SELECT temperature_count FROM weather_daily WHERE city='Berlin'").fetchall()
+        self.assertEqual(rows, [(24,), (24,)])
+
+    def test_hourly_replaces_daily_days(self):
+        """
+        Test that the hourly mode requests the days stored as daily rows again and replaces these rows, so the
+        rollups count every day once.
+        """
+        server, base_url = start_mock_server()
+        runner = CliRunner()
+        arguments = ['--database', self.database, 'get-historic-weather', 'Berlin', 'API_KEY', '2', '--base-url',
+                     base_url, '--no-cache']
+        try:
+            daily = runner.invoke(weather_fetcher.cli, arguments)
+            hourly = runner.invoke(weather_fetcher.cli, arguments + ['--hourly'])
+            again = runner.invoke(weather_fetcher.cli, arguments)
+        finally:
+            server.shutdown()
+        self.assertEqual(daily.exit_code, 0, daily.output)
+        self.assertEqual(hourly.exit_code, 0, hourly.output)
+        self.assertEqual(server.request_count, 4)
+        self.assertIn("Nothing to retrieve for Berlin city, all 2 days are stored", again.output)
+        self.assertEqual(self.reader.execute("SELECT COUNT(*) FROM weather").fetchone()[0], 0)
+        rows = self.reader.execute("SELECT temperature_count FROM weather_daily WHERE city='Berlin'").fetchall()
+        self.assertEqual(rows, [(24,), (24,)])
+        months = self.reader.execute("SELECT sum(temperature_count), sum(temperature_days) FROM weather_monthly "
+                                     "WHERE city='Berlin'")
+        self.assertEqual(months.fetchone(), (48, 2))
 
 
 if __name__ == '__main__':
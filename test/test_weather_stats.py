@@ -0,0 +1,101 @@
+import unittest
+import json
+import math
+import os
+import tempfile
+from array import array
+from src.weather_stats import load_window, summarize, resample, window_stats
+from src.weather_db import connect, weather_info_bulk_insert
+from click.testing import CliRunner
+from src import weather_cli
+
+
+def reading(city, update_datetime, temperature, humidity=40):
+    """
+    Returns a weather record of the given city, time and temperature.
+    """
+    return {'city': city, 'country': 'Germany', 'latitude': 52.52, 'longitude': 13.4, 'temperature': temperature,
+            'humidity': humidity, 'wind_speed': 10.0, 'precipitation': 0.0, 'update_datetime': update_datetime}
+
+
+class TestWeatherStats(unittest.TestCase):
+    """
+    The TestWeatherStats class is a unit test class that tests the statistics, the resampling and the stats
+    command of the src.weather_stats module.
+    """
+
+    def setUp(self):
+        """
+        Set up a database with two weeks of readings of Berlin and one reading of Hamburg.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = connect(os.path.join(self.directory.name, 'weather.db'))
+        rows = [reading('Berlin', f'2023-04-{day:02d} {hour:02d}:00', float(day), None if day == 5 else 40)
+                for day in range(1, 15) for hour in (6, 18)]
+        rows.append(reading('Hamburg', '2023-04-10 12:00', 8.0))
+        weather_info_bulk_insert(rows, self.conn, self.conn.cursor())
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_summarize(self):
+        """
+        Test the statistics and the interpolated percentiles, NaN values are left out.
+        """
+        summary = summarize(array('d', [4.0, 1.0, float('nan'), 3.0, 2.0]), (50, 90))
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual((summary['min'], summary['max'], summary['mean']), (1.0, 4.0, 2.5))
+        self.assertAlmostEqual(summary['stddev'], math.sqrt(1.25))
+        self.assertEqual(summary['p50'], 2.5)
+        self.assertAlmostEqual(summary['p90'], 3.7)
+        empty = summarize(array('d'), (50,))
+        self.assertEqual(empty, {'count': 0, 'min': None, 'max': None, 'mean': None, 'stddev': None, 'p50': None})
+
+    def test_load_window_and_resample(self):
+        """
+        Test that the window only holds the requested days and that the weekly means follow the ISO weeks.
+        """
+        windows = load_window(self.conn, ['Berlin', 'Hamburg'], '2023-04-03', '2023-04-09')
+        self.assertEqual(len(windows['Berlin']['update_datetime']), 14)
+        self.assertEqual(len(windows['Hamburg']['temperature']), 0)
+        self.assertTrue(math.isnan(windows['Berlin']['humidity'][4]))
+
+        weeks = resample(load_window(self.conn, ['Berlin'], '2023-04-01', '2023-04-14')['Berlin'], 'week')
+        self.assertEqual([week['period'] for week in weeks], ['2023-W13', '2023-W14', '2023-W15'])
+        self.assertEqual([week['readings'] for week in weeks], [4, 14, 10])
+        self.assertEqual(weeks[1]['temperature'], 6.0)
+        self.assertEqual(weeks[1]['humidity'], 40.0)
+
+        results = window_stats(windows, ['temperature'], (50,), 'day')
+        self.assertEqual(results['Berlin']['summary']['temperature']['mean'], 6.0)
+        self.assertEqual(len(results['Berlin']['resampled']), 7)
+        self.assertEqual(results['Hamburg']['summary']['temperature']['count'], 0)
+
+    def test_stats_command(self):
+        """
+        Test the JSON and table output of the stats command for several cities.
+        """
+        runner = CliRunner()
+        result = runner.invoke(weather_cli.stats, ['Berlin', 'Hamburg', '--start', '2023-04-01', '--end',
+                                                   '2023-04-14', '--format', 'json', '--resample', 'month'],
+                               obj=self.conn)
+        self.assertEqual(result.exit_code, 0, result.output)
+        output = json.loads(result.output)
+        self.assertEqual(output['cities']['Berlin']['summary']['temperature']['max'], 14.0)
+        self.assertEqual(output['cities']['Hamburg']['summary']['humidity']['mean'], 40.0)
+        self.assertEqual(output['cities']['Berlin']['resampled'][0]['period'], '2023-04')
+
+        result = runner.invoke(weather_cli.stats, ['Berlin', '--start', '2023-04-01', '--end', '2023-04-14',
+                                                   '--metric', 'temperature'], obj=self.conn)
+        lines = result.output.splitlines()
+        self.assertEqual(lines[0].split(), ['city', 'metric', 'count', 'min', 'max', 'mean', 'stddev', 'p50', 'p90',
+                                            'p95'])
+        self.assertEqual(lines[1].split()[:6], ['Berlin', 'temperature', '28', '1.00', '14.00', '7.50'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import os
+import tempfile
+import threading
+from src.weather_db import connect
+from src.weather_writer import WeatherWriter
+
+
+def reading(day):
+    """
+    Returns a daily weather record of the test city.
+    """
+    return {'city': 'TestCity', 'country': 'TestCountry', 'latitude': 26.43, 'longitude': 50.11,
+            'temperature': 20.0, 'humidity': 35, 'wind_speed': 45.6, 'precipitation': 5.9,
+            'update_datetime': f'2023-04-{day:02d}'}
+
+
+class TestWeatherWriter(unittest.TestCase):
+    """
+    The TestWeatherWriter class is a unit test class that tests the batching, backpressure and
+    error handling of the src.weather_writer module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment before each test case is executed.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'weather_data.db')
+
+    def tearDown(self):
+        """
+        Clean up the test environment after each test case is executed.
+        """
+        self.directory.cleanup()
+
+    def count_rows(self):
+        conn = connect(self.path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM weather").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_batches_by_size(self):
+        """
+        Test that records are committed in batches of at most batch_size records.
+        """
+        writer = WeatherWriter(self.path, batch_size=4, max_delay=60).start()
+        for day in range(1, 11):
+            writer.put(reading(day))
+        self.assertEqual(writer.close(), {'inserted': 10, 'updated': 0, 'skipped': 0, 'failed': 0})
+        metrics = writer.metrics()
+        self.assertLessEqual(metrics['max_batch_size'], 4)
+        self.assertGreaterEqual(metrics['batches'], 3)
+        self.assertEqual(self.count_rows(), 10)
+
+    def test_batches_by_delay(self):
+        """
+        Test that a record is written after max_delay seconds without waiting for a full batch.
+        """
+        writer = WeatherWriter(self.path, batch_size=500, max_delay=0.05).start()
+        try:
+            writer.put(reading(1))
+            for _ in range(100):
+                if writer.metrics()['rows']:
+                    break
+                threading.Event().wait(0.01)
+            self.assertEqual(writer.metrics()['rows'], 1)
+        finally:
+            writer.close()
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_backpressure(self):
+        """
+        Test that a full queue blocks the producer until the writer catches up, and that every record is written.
+        """
+        writer = WeatherWriter(self.path, batch_size=5, max_delay=0.01, max_queue=2)
+        writer.put(reading(1))
+        writer.put(reading(2))
+        # The queue is full and nothing consumes it until the timer starts the writer
+        timer = threading.Timer(0.2, writer.start)
+        timer.start()
+        for day in range(3, 29):
+            writer.put(reading(day))
+        timer.join()
+        self.assertEqual(writer.close(), {'inserted': 28, 'updated': 0, 'skipped': 0, 'failed': 0})
+        metrics = writer.metrics()
+        self.assertGreaterEqual(metrics['blocked_puts'], 1)
+        self.assertLessEqual(metrics['max_queue_depth'], 2)
+        self.assertLessEqual(metrics['max_batch_size'], 5)
+        self.assertEqual(metrics['rows'], 28)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+    def test_close_without_start_writes_queued_records(self):
+        """
+        Test that closing a writer that was never started still writes the queued records.
+        """
+        writer = WeatherWriter(self.path)
+        writer.put(reading(1))
+        self.assertEqual(writer.close()['inserted'], 1)
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_failing_writer_raises(self):
+        """
+        Test that put and close raise the error of a writer which can not open its database instead of blocking.
+        """
+        writer = WeatherWriter(os.path.join(self.directory.name, 'missing', 'weather_data.db'), max_queue=1).start()
+        writer.thread.join(5)
+        self.assertFalse(writer.thread.is_alive())
+        with self.assertRaises(Exception):
+            for day in range(1, 4):
+                writer.put(reading(day))
+        with self.assertRaises(Exception):
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()